@@ -0,0 +1,145 @@
+"""
+.. module:: aggregation
+   :platform: Unix, Windows
+   :synopsis: Defines the windowed aggregation and downsampling of sample
+   series used by the transducer data access services.
+
+.. moduleauthor:: James Ethridge <jeethridge@gmail.com>
+
+"""
+# -*- coding: utf-8 -*-
+import bisect
+import math
+from array import array
+import ieee1451types as ieee1451
+
+
+class WindowAggregates(object):
+    """Per window min, max, mean, count and last value of a series.
+
+    Each column is a typed array with one entry per non empty window, in
+    time order.
+    """
+
+    def __init__(self):
+        self.window_start = array('d')
+        self.minimum = array('d')
+        self.maximum = array('d')
+        self.mean = array('d')
+        self.count = array('L')
+        self.last = array('d')
+
+    def __len__(self):
+        return len(self.window_start)
+
+    def to_argument_array(self):
+        """Return the columns as an ArgumentArray of "window_start",
+        "min", "max", "mean", "count" and "last" Arguments."""
+        f64 = ieee1451.TypeCode.FLOAT64_ARRAY_TC
+        aa = ieee1451.ArgumentArray()
+        aa.put_by_name('window_start', ieee1451.Argument(
+                            f64, self.window_start.tolist()))
+        aa.put_by_name('min', ieee1451.Argument(f64, self.minimum.tolist()))
+        aa.put_by_name('max', ieee1451.Argument(f64, self.maximum.tolist()))
+        aa.put_by_name('mean', ieee1451.Argument(f64, self.mean.tolist()))
+        aa.put_by_name('count', ieee1451.Argument(
+                            ieee1451.TypeCode.UINT32_ARRAY_TC,
+                            self.count.tolist()))
+        aa.put_by_name('last', ieee1451.Argument(f64, self.last.tolist()))
+        return aa
+
+
+def aggregate_windows(timestamps, values, window):
+    """Aggregate a series over fixed time windows.
+
+    Windows are aligned to multiples of window seconds since the epoch so
+    that successive queries line up. The bounds of each window are found
+    by binary search in the sorted timestamps and the window is reduced
+    with the built-in min, max and sum over a slice, so the per sample
+    work runs in C rather than in the interpreter.
+
+    :param timestamps: sorted sequence of timestamps in seconds
+    :param values: sequence of numeric values
+    :param window: the window length in seconds
+    :return: a WindowAggregates
+    """
+    result = WindowAggregates()
+    n = len(timestamps)
+    if not n or window <= 0:
+        return result
+    if not isinstance(values, array):
+        values = array('d', values)
+
+    lo = 0
+    while lo < n:
+        start = math.floor(timestamps[lo] / window) * window
+        hi = bisect.bisect_left(timestamps, start + window, lo)
+        if hi <= lo:
+            # timestamp rounding put the sample past its own window
+            hi = lo + 1
+        chunk = values[lo:hi]
+        result.window_start.append(start)
+        result.minimum.append(min(chunk))
+        result.maximum.append(max(chunk))
+        result.mean.append(math.fsum(chunk) / len(chunk))
+        result.count.append(len(chunk))
+        result.last.append(chunk[-1])
+        lo = hi
+    return result
+
+
+def lttb(timestamps, values, threshold):
+    """Downsample a series to threshold points with the Largest Triangle
+    Three Buckets algorithm, which keeps the visual shape of the series
+    for plotting.
+
+    The first and last points are kept. The points in between are split
+    into threshold - 2 buckets and from each bucket the point forming the
+    largest triangle with the point kept from the previous bucket and the
+    average of the next bucket is kept. A threshold below 3 keeps the first
+    point, then the last.
+
+    :param timestamps: sorted sequence of timestamps in seconds
+    :param values: sequence of numeric values
+    :param threshold: the number of points to return
+    :return: the timestamps and values kept, as two array('d')
+    """
+    n = len(timestamps)
+    if threshold >= n:
+        return array('d', timestamps), array('d', values)
+    if threshold < 3:
+        keep = [0, n - 1][:max(0, threshold)]
+        return array('d', [timestamps[i] for i in keep]), \
+            array('d', [values[i] for i in keep])
+
+    out_t = array('d', [timestamps[0]])
+    out_v = array('d', [values[0]])
+    every = float(n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # the average of the next bucket
+        next_lo = int(math.floor((i + 1) * every)) + 1
+        next_hi = min(int(math.floor((i + 2) * every)) + 1, n)
+        avg_t = math.fsum(timestamps[next_lo:next_hi]) / (next_hi - next_lo)
+        avg_v = math.fsum(values[next_lo:next_hi]) / (next_hi - next_lo)
+
+        lo = int(math.floor(i * every)) + 1
+        hi = int(math.floor((i + 1) * every)) + 1
+        at = timestamps[a]
+        av = values[a]
+        dt = avg_t - at
+        dv = avg_v - av
+        best = lo
+        best_area = -1.0
+        for j in range(lo, hi):
+            area = abs(dt * (values[j] - av) - (timestamps[j] - at) * dv)
+            if area > best_area:
+                best_area = area
+                best = j
+        out_t.append(timestamps[best])
+        out_v.append(values[best])
+        a = best
+
+    out_t.append(timestamps[n - 1])
+    out_v.append(values[n - 1])
+    return out_t, out_v
@@ -0,0 +1,309 @@
+"""
+.. module:: binary_teds
+   :platform: Unix, Windows
+   :synopsis: Defines the parser and encoder for binary IEEE1451.0 TEDS,
+   i.e. the OctetArray form returned by TedsManager.read_raw_teds.
+
+.. moduleauthor:: James Ethridge <jeethridge@gmail.com>
+
+"""
+# -*- coding: utf-8 -*-
+import struct
+import ieee1451types as ieee1451
+import teds_support
+
+TC = ieee1451.TypeCode
+
+# struct formats for the fixed size TEDS data types, network byte order
+FIXED_FORMATS = {
+    TC.UINT8_TC: '>B',
+    TC.UINT16_TC: '>H',
+    TC.UINT32_TC: '>I',
+    TC.FLOAT32_TC: '>f',
+    TC.FLOAT64_TC: '>d',
+    TC.BOOLEAN_TC: '>?',
+}
+
+ARRAY_FORMATS = {
+    TC.UINT8_ARRAY_TC: 'B',
+    TC.UINT16_ARRAY_TC: 'H',
+    TC.UINT32_ARRAY_TC: 'I',
+    TC.FLOAT32_ARRAY_TC: 'f',
+    TC.FLOAT64_ARRAY_TC: 'd',
+}
+
+# TLV field definitions per TEDS type from Clause 8 of IEEE 1451.0.
+# Each entry maps a TLV type to (field name, TypeCode) or, for nested
+# fields, to (field name, dictionary of sub-field definitions).
+META_TEDS_FIELDS = {
+    3: ('TEDSID', TC.UINT8_ARRAY_TC),
+    4: ('UUID', TC.OCTET_ARRAY_TC),
+    10: ('OHoldOff', TC.FLOAT32_TC),
+    11: ('SHoldOff', TC.FLOAT32_TC),
+    12: ('TestTime', TC.FLOAT32_TC),
+    13: ('MaxChan', TC.UINT16_TC),
+}
+
+CHAN_TEDS_FIELDS = {
+    3: ('TEDSID', TC.UINT8_ARRAY_TC),
+    10: ('CalKey', TC.UINT8_TC),
+    11: ('ChanType', TC.UINT8_TC),
+    12: ('PhyUnits', TC.UINT8_ARRAY_TC),
+    13: ('LowLimit', TC.FLOAT32_TC),
+    14: ('HiLimit', TC.FLOAT32_TC),
+    15: ('OError', TC.FLOAT32_TC),
+    16: ('SelfTest', TC.UINT8_TC),
+    17: ('MRange', TC.UINT8_TC),
+    18: ('Sample', {40: ('DatModel', TC.UINT8_TC),
+                    41: ('ModLength', TC.UINT8_TC),
+                    42: ('SigBits', TC.UINT16_TC)}),
+    19: ('DataSet', {43: ('Repeats', TC.UINT16_TC),
+                     44: ('SOrigin', TC.FLOAT32_TC),
+                     45: ('StepSize', TC.FLOAT32_TC),
+                     46: ('SUnits', TC.UINT8_ARRAY_TC),
+                     47: ('PreTrigg', TC.UINT16_TC)}),
+    20: ('UpdateT', TC.FLOAT32_TC),
+    21: ('WSetupT', TC.FLOAT32_TC),
+    22: ('RSetupT', TC.FLOAT32_TC),
+    23: ('SPeriod', TC.FLOAT32_TC),
+    24: ('WarmUpT', TC.FLOAT32_TC),
+    25: ('RDelayT', TC.FLOAT32_TC),
+    26: ('TestTime', TC.FLOAT32_TC),
+    27: ('TimeSrc', TC.UINT8_TC),
+    28: ('InPropDl', TC.FLOAT32_TC),
+    29: ('OutPropD', TC.FLOAT32_TC),
+    30: ('TSError', TC.FLOAT32_TC),
+    31: ('Sampling', {48: ('SampMode', TC.UINT8_TC),
+                      49: ('SDefault', TC.UINT8_TC)}),
+    32: ('DataXmit', TC.UINT8_TC),
+    33: ('Buffered', TC.UINT8_TC),
+    34: ('EndOfSet', TC.UINT8_TC),
+    35: ('EdgeRpt', TC.UINT8_TC),
+    36: ('ActHalt', TC.UINT8_TC),
+    37: ('Direction', TC.UINT8_TC),
+    38: ('DAngles', TC.FLOAT32_ARRAY_TC),
+    39: ('ESOption', TC.UINT8_TC),
+}
+
+XDCR_NAME_FIELDS = {
+    3: ('TEDSID', TC.UINT8_ARRAY_TC),
+    4: ('Format', TC.UINT8_TC),
+    5: ('TCName', TC.STRING_TC),
+}
+
+TEDS_FIELDS = {
+    teds_support.TEDSType.META_TEDS: META_TEDS_FIELDS,
+    teds_support.TEDSType.CHAN_TEDS: CHAN_TEDS_FIELDS,
+    teds_support.TEDSType.XDCR_NAME: XDCR_NAME_FIELDS,
+}
+
+LENGTH_SIZE = 4
+CHECKSUM_SIZE = 2
+
+
+def checksum(octets):
+    """Compute the TEDS checksum: the one's complement of the sum, modulo
+    2**16, of all octets preceding the checksum.
+
+    :param octets: a bytearray holding the length field and data block
+    :return: the checksum as an integer
+    """
+    return (~sum(octets)) & 0xFFFF
+
+
+def _octets(raw):
+    """Normalize an OctetArray (str, bytes, bytearray or tuple of ints)."""
+    if isinstance(raw, bytearray):
+        return raw
+    return bytearray(raw)
+
+
+def decode_value(type_code, octets):
+    """Decode a single TLV value.
+
+    :param type_code: the ieee1451types.TypeCode of the field
+    :param octets: a bytearray holding just the value octets
+    :return: the decoded python value
+    """
+    fmt = FIXED_FORMATS.get(type_code)
+    if fmt is not None:
+        return struct.unpack(fmt, bytes(octets))[0]
+    fmt = ARRAY_FORMATS.get(type_code)
+    if fmt is not None:
+        count = len(octets) // struct.calcsize(fmt)
+        return struct.unpack('>%d%s' % (count, fmt), bytes(octets))
+    if type_code == TC.STRING_TC:
+        return bytes(octets).decode('utf-8')
+    return tuple(octets)
+
+
+def encode_value(type_code, value):
+    """Encode a single TLV value into a bytearray."""
+    fmt = FIXED_FORMATS.get(type_code)
+    if fmt is not None:
+        return bytearray(struct.pack(fmt, value))
+    fmt = ARRAY_FORMATS.get(type_code)
+    if fmt is not None:
+        return bytearray(struct.pack('>%d%s' % (len(value), fmt), *value))
+    if type_code == TC.STRING_TC:
+        return bytearray(value.encode('utf-8'))
+    return bytearray(value)
+
+
+def _scan(octets, start, end):
+    """Yield (tlv_type, value_start, value_end) for each TLV in a range
+    without decoding any values."""
+    pos = start
+    while pos < end:
+        if pos + 2 > end:
+            raise ValueError('Truncated TLV header at octet %d' % pos)
+        length = octets[pos + 1]
+        vstart = pos + 2
+        vend = vstart + length
+        if vend > end:
+            raise ValueError('TLV at octet %d overruns the TEDS' % pos)
+        yield octets[pos], vstart, vend
+        pos = vend
+
+
+class BinaryTEDS(object):
+    """A binary TEDS which decodes fields on demand.
+
+    The length field and checksum are verified up front. Looking up a field
+    only walks TLV headers until the field is found and decodes that value
+    alone; field offsets are remembered for later lookups.
+    """
+
+    def __init__(self, teds_type, raw, verify=True):
+        """Initialize the BinaryTEDS object.
+
+        :param teds_type: the teds_support.TEDSType of the TEDS
+        :param raw: the raw OctetArray including length and checksum
+        :param verify: verify the length field and checksum
+        """
+        self.teds_type = teds_type
+        self.fields = TEDS_FIELDS.get(teds_type, {})
+        self.octets = _octets(raw)
+        if len(self.octets) < LENGTH_SIZE + CHECKSUM_SIZE:
+            raise ValueError('TEDS is too short')
+        length = struct.unpack_from('>I', bytes(self.octets[:LENGTH_SIZE]))[0]
+        self.end = LENGTH_SIZE + length - CHECKSUM_SIZE
+        if verify:
+            if self.end + CHECKSUM_SIZE != len(self.octets):
+                raise ValueError('TEDS length field does not match the data')
+            expected = struct.unpack(
+                '>H', bytes(self.octets[self.end:self.end + CHECKSUM_SIZE]))[0]
+            if checksum(self.octets[:self.end]) != expected:
+                raise ValueError('TEDS checksum mismatch')
+        self.offsets = {}
+        self._scanner = self._walk(self.fields, LENGTH_SIZE, self.end)
+
+    def _walk(self, fields, start, end, prefix=''):
+        """Generator recording the offsets of every named field in order.
+
+        Fields unknown to this module are named by their TLV type prefixed
+        with the path of the nested field holding them, e.g. 'Sample/50'.
+        """
+        for tlv_type, vstart, vend in _scan(self.octets, start, end):
+            name, spec = fields.get(tlv_type,
+                                    (prefix + str(tlv_type),
+                                     TC.OCTET_ARRAY_TC))
+            if isinstance(spec, dict):
+                for found in self._walk(spec, vstart, vend,
+                                        prefix + name + '/'):
+                    yield found
+                continue
+            self.offsets[name] = (spec, vstart, vend)
+            yield name
+
+    def _find(self, name):
+        """Return the (type_code, start, end) of a field or None."""
+        found = self.offsets.get(name)
+        if found is not None or self._scanner is None:
+            return found
+        for scanned in self._scanner:
+            if scanned == name:
+                return self.offsets[name]
+        self._scanner = None
+        return None
+
+    def get_by_name(self, name):
+        """Return the named field as an ieee1451types.Argument or None."""
+        found = self._find(name)
+        if found is None:
+            return None
+        type_code, start, end = found
+        value = decode_value(type_code, self.octets[start:end])
+        return ieee1451.Argument(type_code, value)
+
+    def to_argument_array(self):
+        """Decode every field into an ieee1451types.ArgumentArray."""
+        if self._scanner is not None:
+            for _ in self._scanner:
+                pass
+            self._scanner = None
+        aa = ieee1451.ArgumentArray()
+        ordered = sorted(self.offsets.items(), key=lambda kv: kv[1][1])
+        for name, (type_code, start, end) in ordered:
+            value = decode_value(type_code, self.octets[start:end])
+            aa.put_by_name(name, ieee1451.Argument(type_code, value))
+        return aa
+
+
+def decode_teds(teds_type, raw, verify=True):
+    """Decode a binary TEDS into an ArgumentArray keyed by field name.
+
+    :param teds_type: the teds_support.TEDSType of the TEDS
+    :param raw: the raw OctetArray including length and checksum
+    :param verify: verify the length field and checksum
+    :return: an ieee1451types.ArgumentArray
+    """
+    return BinaryTEDS(teds_type, raw, verify).to_argument_array()
+
+
+def _encode_fields(fields, arg_array, prefix=''):
+    """Encode the fields of arg_array described by fields as TLVs, along
+    with the unknown fields named prefix followed by their TLV type."""
+    out = bytearray()
+    names = arg_array.indicies
+    fields = dict(fields)
+    for name in names:
+        tlv_type = name[len(prefix):]
+        if name.startswith(prefix) and tlv_type.isdigit() and \
+                int(tlv_type) not in fields:
+            fields[int(tlv_type)] = (name, TC.OCTET_ARRAY_TC)
+    for tlv_type in sorted(fields):
+        name, spec = fields[tlv_type]
+        if isinstance(spec, dict):
+            value = _encode_fields(spec, arg_array, prefix + name + '/')
+            if not value:
+                continue
+        elif name in names:
+            arg = arg_array.get_by_name(name)
+            value = encode_value(spec, arg.value)
+        else:
+            continue
+        if len(value) > 0xFF:
+            raise ValueError('TEDS field %s is too long' % name)
+        out.append(tlv_type)
+        out.append(len(value))
+        out.extend(value)
+    return out
+
+
+def encode_teds(teds_type, arg_array):
+    """Encode an ArgumentArray of TEDS fields into a binary TEDS.
+
+    Fields whose name is the decimal TLV type, as produced by decode_teds
+    for fields unknown to this module, are written back as raw octets
+    within the nested field named by their prefix, if any.
+
+    :param teds_type: the teds_support.TEDSType of the TEDS
+    :param arg_array: an ieee1451types.ArgumentArray keyed by field name
+    :return: a bytearray including the length field and checksum
+    """
+    block = _encode_fields(TEDS_FIELDS.get(teds_type, {}), arg_array)
+    octets = bytearray(struct.pack('>I', len(block) + CHECKSUM_SIZE))
+    octets.extend(block)
+    octets.extend(struct.pack('>H', checksum(octets)))
+    return octets
@@ -0,0 +1,272 @@
+"""
+.. module:: calibration_engine
+   :platform: Unix, Windows
+   :synopsis: Defines the NCAP-side correction engine which applies
+   Calibration TEDS to transducer sample data.
+
+.. moduleauthor:: James Ethridge <jeethridge@gmail.com>
+
+"""
+# -*- coding: utf-8 -*-
+import bisect
+import threading
+from array import array
+import teds_support
+
+
+class CalibrationSegment(object):
+    """Defines a single segment of a piecewise multinomial correction.
+
+    The segment applies to input values in [low_limit, hi_limit) and
+    evaluates coefs[0] + coefs[1]*x + coefs[2]*x**2 ... where x is the
+    input value less the segment offset.
+    """
+
+    def __init__(self, low_limit, hi_limit, offset, coefs):
+        self.low_limit = low_limit
+        self.hi_limit = hi_limit
+        self.offset = offset
+        self.coefs = tuple(coefs)
+
+    def __eq__(self, other):
+        """Override equality operation."""
+        return self.__dict__ == other.__dict__
+
+
+def _values(text):
+    """Convert a space separated TEDS Value string into a list of floats."""
+    if text is None:
+        return []
+    return [float(v) for v in str(text).split()]
+
+
+def _value(d, key, default=None):
+    """Read the Value child of a TEDS field as a float."""
+    field = d.get(key) if d else None
+    if field is None:
+        return default
+    if isinstance(field, dict):
+        field = field.get('Value')
+    vals = _values(field)
+    if not vals:
+        return default
+    return vals[0]
+
+
+def _cal_teds_dict(cal_teds):
+    """Get a prefix-free dictionary for a Calibration TEDS."""
+    if not isinstance(cal_teds, dict):
+        cal_teds = teds_support.teds_dict_from_xml(cal_teds)
+    return teds_support.strip_prefixes(cal_teds)
+
+
+def segments_from_cal_teds(cal_teds):
+    """Get the list of correction segments from a Calibration TEDS.
+
+    :param cal_teds: The Calibration TEDS as XML text or as the dictionary
+        returned by teds_support.teds_dict_from_xml
+    :return: a list of CalibrationSegment objects sorted by low_limit
+    """
+    cal_teds = _cal_teds_dict(cal_teds)
+
+    block = teds_support.subitem('CalibrationTEDSDataBlock', cal_teds)
+    if block is None:
+        block = cal_teds
+
+    segs = teds_support.subitem('Segment', block)
+    if segs is None:
+        segs = []
+    elif not isinstance(segs, list):
+        segs = [segs]
+
+    segments = []
+    for seg in segs:
+        coefs = seg.get('Coefs')
+        if isinstance(coefs, dict):
+            coefs = coefs.get('Value')
+        segments.append(CalibrationSegment(
+                            _value(seg, 'LowLimit', float('-inf')),
+                            _value(seg, 'HiLimit', float('inf')),
+                            _value(seg, 'Offset', 0.0),
+                            _values(coefs)))
+
+    segments.sort(key=lambda s: s.low_limit)
+    return segments
+
+
+def cal_teds_version(cal_teds):
+    """Get the version tag of a Calibration TEDS, i.e. its CheckSum.
+
+    :param cal_teds: The Calibration TEDS as XML text or dictionary
+    :return: the CheckSum text, or None if the TEDS does not carry one
+    """
+    return teds_support.subitem('CheckSum', _cal_teds_dict(cal_teds))
+
+
+class CalibrationEvaluator(object):
+    """A Calibration TEDS compiled into a callable correction function.
+
+    Segment limits and coefficients are unpacked into flat tuples once so
+    that each evaluation is a bisect over the breakpoints followed by a
+    Horner evaluation of the segment polynomial. Values outside of every
+    segment are clamped to the limits of the nearest segment, so a value
+    above the last hi_limit is corrected as hi_limit rather than by
+    extrapolating the last polynomial.
+    """
+
+    def __init__(self, segments, version=None):
+        self.version = version
+        self.segments = list(segments)
+        self._lows = [s.low_limit for s in self.segments]
+        self._his = tuple(s.hi_limit for s in self.segments)
+        self._offsets = tuple(s.offset for s in self.segments)
+        # Horner's method walks the coefficients from highest order down
+        self._coefs = tuple(tuple(reversed(s.coefs)) for s in self.segments)
+
+    def _segment_index(self, value):
+        """Return the index of the segment which applies to value, or of
+        the nearest segment if value lies outside of every segment."""
+        idx = bisect.bisect_right(self._lows, value) - 1
+        if idx < 0:
+            return 0
+        # value is beyond the segment starting below it, in a gap or above
+        # the last segment, use whichever neighbour is closer
+        if value >= self._his[idx] and idx + 1 < len(self._lows) and \
+                self._lows[idx + 1] - value < value - self._his[idx]:
+            return idx + 1
+        return idx
+
+    def _clamp(self, idx, value):
+        """Clamp value to the limits of segment idx."""
+        if value < self._lows[idx]:
+            return self._lows[idx]
+        if value > self._his[idx]:
+            return self._his[idx]
+        return value
+
+    def __call__(self, value):
+        """Correct a single sample."""
+        if not self.segments:
+            return float(value)
+        idx = self._segment_index(value)
+        x = self._clamp(idx, value) - self._offsets[idx]
+        result = 0.0
+        for c in self._coefs[idx]:
+            result = result * x + c
+        return result
+
+    def evaluate_block(self, values):
+        """Correct a block of samples.
+
+        :param values: any iterable of numeric samples
+        :return: an array('d') containing the corrected samples
+        """
+        result = array('d', values)
+        if not self.segments:
+            return result
+
+        lows = self._lows
+        offsets = self._offsets
+        coefs = self._coefs
+        segment_index = self._segment_index
+        clamp = self._clamp
+
+        if len(lows) == 1:
+            low = lows[0]
+            hi = self._his[0]
+            offset = offsets[0]
+            seg = coefs[0]
+            for i, v in enumerate(result):
+                x = min(max(v, low), hi) - offset
+                acc = 0.0
+                for c in seg:
+                    acc = acc * x + c
+                result[i] = acc
+            return result
+
+        for i, v in enumerate(result):
+            idx = segment_index(v)
+            x = clamp(idx, v) - offsets[idx]
+            acc = 0.0
+            for c in coefs[idx]:
+                acc = acc * x + c
+            result[i] = acc
+        return result
+
+
+def compile_cal_teds(cal_teds):
+    """Compile a Calibration TEDS into a CalibrationEvaluator.
+
+    :param cal_teds: The Calibration TEDS as XML text or dictionary
+    :return: a CalibrationEvaluator
+    """
+    cal_teds = _cal_teds_dict(cal_teds)
+    return CalibrationEvaluator(segments_from_cal_teds(cal_teds),
+                                cal_teds_version(cal_teds))
+
+
+class CalibrationEngine(object):
+    """NCAP-side correction engine.
+
+    Compiled evaluators are cached per (tim_id, channel_id) together with
+    the version of the Calibration TEDS they were compiled from, so a
+    channel's TEDS is only compiled again when its version changes. A TEDS
+    without a version is compiled on every load.
+    """
+
+    def __init__(self):
+        """Initialize the CalibrationEngine object."""
+        self.evaluators = {}
+        self.lock = threading.Lock()
+
+    def load_cal_teds(self, tim_id, channel_id, cal_teds, version=None):
+        """Compile and cache the Calibration TEDS for a channel.
+
+        :param tim_id: the TIM ID
+        :param channel_id: the Transducer Channel ID
+        :param cal_teds: the Calibration TEDS as XML text or dictionary
+        :param version: the TEDS version, defaults to the TEDS CheckSum;
+            the evaluator is not reused when neither is known
+        :return: the CalibrationEvaluator for the channel
+        """
+        cal_teds = _cal_teds_dict(cal_teds)
+        if version is None:
+            version = cal_teds_version(cal_teds)
+
+        key = (tim_id, channel_id)
+        with self.lock:
+            cached = self.evaluators.get(key)
+        if cached is not None and version is not None and \
+                cached.version == version:
+            return cached
+
+        evaluator = CalibrationEvaluator(segments_from_cal_teds(cal_teds),
+                                         version)
+        with self.lock:
+            self.evaluators[key] = evaluator
+        return evaluator
+
+    def get_evaluator(self, tim_id, channel_id):
+        """Return the cached evaluator for a channel or None."""
+        with self.lock:
+            return self.evaluators.get((tim_id, channel_id))
+
+    def invalidate(self, tim_id, channel_id):
+        """Drop the cached evaluator for a channel."""
+        with self.lock:
+            self.evaluators.pop((tim_id, channel_id), None)
+
+    def correct(self, tim_id, channel_id, value):
+        """Correct a single sample, returning it unchanged if the channel
+        has no Calibration TEDS loaded."""
+        evaluator = self.get_evaluator(tim_id, channel_id)
+        if evaluator is None:
+            return value
+        return evaluator(value)
+
+    def correct_block(self, tim_id, channel_id, values):
+        """Correct a block of samples, returning an array('d')."""
+        evaluator = self.get_evaluator(tim_id, channel_id)
+        if evaluator is None:
+            return array('d', values)
+        return evaluator.evaluate_block(values)
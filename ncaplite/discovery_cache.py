@@ -0,0 +1,137 @@
+"""
+.. module:: discovery_cache
+   :platform: Unix, Windows
+   :synopsis: Defines the cache of discovery results, and of their encoded
+   responses, used by the Discovery Services.
+
+.. moduleauthor:: James Ethridge <jeethridge@gmail.com>
+
+"""
+# -*- coding: utf-8 -*-
+import threading
+from timeutil import clock
+
+TIM_DISCOVER = 'tim_discover'
+TRANSDUCER_DISCOVER = 'transducer_discover'
+
+# seconds a discovery result is served from the cache by default, which
+# bounds how long a TIM added or removed without the backend reporting it
+# stays unseen
+DEFAULT_TTL = 5.0
+
+
+class DiscoveryCacheEntry(object):
+    """Defines a cached discovery result, the time it was stored and its
+    encoded responses keyed by (message_id, codec)."""
+
+    def __init__(self, result, timestamp):
+        self.result = result
+        self.timestamp = timestamp
+        self.encoded = {}
+
+
+class DiscoveryCache(object):
+    """Cache of discovery results.
+
+    TIM discovery is stored under (TIM_DISCOVER,) and transducer discovery
+    under (TRANSDUCER_DISCOVER, tim_id). Entries expire after ttl seconds
+    and are dropped by invalidate when the backend reports a topology
+    change.
+
+    The same result object is returned for every hit, which lets encoded
+    look up the response already encoded for it.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        """Initialize the DiscoveryCache object.
+
+        :param ttl: time to live of an entry in seconds, None keeps entries
+            until they are invalidated
+        """
+        self.ttl = ttl
+        self.entries = {}
+        self.by_result = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.by_result.pop(id(entry.result), None)
+
+    def get(self, key):
+        """Get a discovery result from the cache.
+
+        :return: the cached result or None on a miss
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and \
+                    clock() - entry.timestamp > self.ttl:
+                self._drop(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            return entry.result
+
+    def put(self, key, result):
+        """Store a discovery result in the cache."""
+        with self.lock:
+            self._drop(key)
+            entry = DiscoveryCacheEntry(result, clock())
+            self.entries[key] = entry
+            self.by_result[id(result)] = entry
+
+    def invalidate(self, tim_id=None):
+        """Remove entries after a topology change.
+
+        :param tim_id: the TIM which changed, None drops every entry. The
+            TIM list is dropped in either case since a TIM may have been
+            added or removed.
+        :return: the number of entries removed
+        """
+        with self.lock:
+            keys = [k for k in self.entries
+                    if tim_id is None or k[0] == TIM_DISCOVER or
+                    k == (TRANSDUCER_DISCOVER, tim_id)]
+            for k in keys:
+                self._drop(k)
+        return len(keys)
+
+    def encoded(self, result, message_id, codec, encode):
+        """Return the encoded response for a result, encoding it only the
+        first time it is requested for a given message and codec.
+
+        :param result: the result returned by the discovery service
+        :param message_id: the message ID of the response
+        :param codec: the codec used to encode the response
+        :param encode: callable taking no arguments which encodes the
+            response
+        :return: the encoded response
+        """
+        with self.lock:
+            entry = self.by_result.get(id(result))
+            if entry is None or entry.result is not result:
+                entry = None
+            else:
+                msg = entry.encoded.get((message_id, codec))
+                if msg is not None:
+                    return msg
+
+        msg = encode()
+        if entry is not None:
+            with self.lock:
+                entry.encoded[(message_id, codec)] = msg
+        return msg
+
+    def stats(self):
+        """Return a dictionary containing the hit and miss counters."""
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'size': len(self.entries)}
@@ -0,0 +1,231 @@
+"""
+.. module:: discovery_feed
+   :platform: Unix, Windows
+   :synopsis: Defines the discovery change feed which publishes TIM and
+   channel add / remove deltas to subscribed clients.
+
+.. moduleauthor:: James Ethridge <jeethridge@gmail.com>
+
+"""
+# -*- coding: utf-8 -*-
+import collections
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+TIM_ADDED = 'tim_added'
+TIM_REMOVED = 'tim_removed'
+CHANNEL_ADDED = 'channel_added'
+CHANNEL_REMOVED = 'channel_removed'
+
+
+class DiscoveryDelta(object):
+    """Defines a single change of the NCAP topology."""
+
+    def __init__(self, seq, op, tim_id, channel_id=None):
+        self.seq = seq
+        self.op = op
+        self.tim_id = tim_id
+        self.channel_id = channel_id
+
+    def __eq__(self, other):
+        """Override equality operation."""
+        return self.__dict__ == other.__dict__
+
+    def __str__(self):
+        return str(self.__dict__)
+
+    def serializable(self):
+        """Return the DiscoveryDelta in a serializable format"""
+        return dict(self.__dict__)
+
+
+class DiscoveryFeed(object):
+    """Sequenced feed of topology deltas.
+
+    The feed tracks the known TIMs and channels so that reports from the
+    backend, whether explicit notifications or fresh discovery results, only
+    publish what actually changed. Every delta gets the next sequence
+    number; the last max_history deltas are kept so a client can resume
+    from the last sequence number it saw. A client that fell further behind
+    is told to resync with a full discovery.
+
+    Deltas are passed to the sender callable, if any, once per subscriber
+    as sender(client_id, deltas, seq).
+    """
+
+    def __init__(self, max_history=1024):
+        """Initialize the DiscoveryFeed object.
+
+        :param max_history: the number of deltas kept for resuming clients
+        """
+        self.seq = 0
+        self.history = collections.deque(maxlen=max_history)
+        self.tims = set()
+        self.channels = {}
+        self.subscribers = set()
+        self.sender = None
+        self.lock = threading.Lock()
+        # held while a change is applied and sent so subscribers get the
+        # deltas in sequence order
+        self.publish_lock = threading.Lock()
+
+    def _append(self, deltas, op, tim_id, channel_id=None):
+        self.seq += 1
+        delta = DiscoveryDelta(self.seq, op, tim_id, channel_id)
+        self.history.append(delta)
+        deltas.append(delta)
+
+    def _add_tim(self, deltas, tim_id):
+        if tim_id not in self.tims:
+            self.tims.add(tim_id)
+            self._append(deltas, TIM_ADDED, tim_id)
+
+    def _remove_tim(self, deltas, tim_id):
+        for channel_id in sorted(self.channels.pop(tim_id, ())):
+            self._append(deltas, CHANNEL_REMOVED, tim_id, channel_id)
+        if tim_id in self.tims:
+            self.tims.discard(tim_id)
+            self._append(deltas, TIM_REMOVED, tim_id)
+
+    def _set_channels(self, deltas, tim_id, channel_ids):
+        self._add_tim(deltas, tim_id)
+        known = self.channels.setdefault(tim_id, set())
+        channel_ids = set(channel_ids)
+        for channel_id in sorted(known - channel_ids):
+            self._append(deltas, CHANNEL_REMOVED, tim_id, channel_id)
+        for channel_id in sorted(channel_ids - known):
+            self._append(deltas, CHANNEL_ADDED, tim_id, channel_id)
+        self.channels[tim_id] = channel_ids
+
+    def _publish(self, deltas):
+        """Pass new deltas to every subscriber, the publish lock must be
+        held."""
+        if not deltas:
+            return deltas
+        with self.lock:
+            sender = self.sender
+            subscribers = list(self.subscribers)
+            seq = self.seq
+        if sender is not None:
+            for client_id in subscribers:
+                try:
+                    sender(client_id, deltas, seq)
+                except Exception as e:
+                    logger.error('DiscoveryFeed: sending to %s failed: %s',
+                                 client_id, e)
+        return deltas
+
+    def update_tims(self, tim_ids):
+        """Report the complete list of TIMs, e.g. from a fresh discovery.
+
+        :return: the list of DiscoveryDelta published
+        """
+        deltas = []
+        with self.publish_lock:
+            with self.lock:
+                tim_ids = set(tim_ids)
+                for tim_id in sorted(self.tims - tim_ids):
+                    self._remove_tim(deltas, tim_id)
+                for tim_id in sorted(tim_ids - self.tims):
+                    self._add_tim(deltas, tim_id)
+            return self._publish(deltas)
+
+    def update_channels(self, tim_id, channel_ids):
+        """Report the complete list of channels of a TIM.
+
+        :return: the list of DiscoveryDelta published
+        """
+        deltas = []
+        with self.publish_lock:
+            with self.lock:
+                self._set_channels(deltas, tim_id, channel_ids)
+            return self._publish(deltas)
+
+    def notify(self, op, tim_id, channel_id=None):
+        """Report a single change, e.g. from a backend hot-plug event.
+
+        :param op: one of TIM_ADDED, TIM_REMOVED, CHANNEL_ADDED or
+            CHANNEL_REMOVED
+        :return: the list of DiscoveryDelta published
+        """
+        deltas = []
+        with self.publish_lock:
+            with self.lock:
+                if op == TIM_ADDED:
+                    self._add_tim(deltas, tim_id)
+                elif op == TIM_REMOVED:
+                    self._remove_tim(deltas, tim_id)
+                else:
+                    channel_ids = set(self.channels.get(tim_id, ()))
+                    if op == CHANNEL_ADDED:
+                        channel_ids.add(channel_id)
+                    else:
+                        channel_ids.discard(channel_id)
+                    self._set_channels(deltas, tim_id, channel_ids)
+            return self._publish(deltas)
+
+    def since(self, last_seq):
+        """Return the deltas after a sequence number.
+
+        :param last_seq: the last sequence number seen by the client
+        :return: the list of DiscoveryDelta, or None if some of them are no
+            longer kept or last_seq is ahead of the feed, e.g. it was seen
+            before the NCAP restarted, and the client has to resync
+        """
+        with self.lock:
+            if last_seq > self.seq:
+                return None
+            if last_seq == self.seq:
+                return []
+            if not self.history or self.history[0].seq > last_seq + 1:
+                return None
+            return [d for d in self.history if d.seq > last_seq]
+
+    def subscribe(self, client_id, last_seq=None):
+        """Add a subscriber.
+
+        Deltas published after this call are sent to the subscriber, those
+        published before it are returned when last_seq is given, so the
+        client sees each delta exactly once.
+
+        :param client_id: the subscriber passed to the sender
+        :param last_seq: optional last sequence number seen by the client
+        :return: the current sequence number and the list of missed
+            DiscoveryDelta, None if the client has to resync
+        """
+        with self.publish_lock:
+            deltas = [] if last_seq is None else self.since(last_seq)
+            with self.lock:
+                self.subscribers.add(client_id)
+                return self.seq, deltas
+
+    def unsubscribe(self, client_id):
+        """Remove a subscriber.
+
+        :return: True if the client was subscribed
+        """
+        with self.lock:
+            if client_id not in self.subscribers:
+                return False
+            self.subscribers.discard(client_id)
+            return True
+
+    def unsubscribe_client(self, client_id):
+        """Remove a subscriber which left, along with the resources of a
+        bare JID.
+
+        :return: the number of subscribers removed
+        """
+        prefix = client_id + '/'
+        with self.lock:
+            gone = [c for c in self.subscribers
+                    if c == client_id or str(c).startswith(prefix)]
+            self.subscribers.difference_update(gone)
+            return len(gone)
+
+    def has_subscribers(self):
+        """Return True if any client is subscribed."""
+        with self.lock:
+            return bool(self.subscribers)
@@ -7,8 +7,17 @@
 
 """
 
+import logging
+import threading
 import xml.etree.ElementTree as ET
 import ieee1451types as ieee1451
+import roster_store
+import discovery_cache
+import discovery_feed
+import worker_pool
+
+logger = logging.getLogger(__name__)
+
 
 class DiscoveryServices(object):
     """This class defines the discover services offered by an NCAP.
@@ -24,18 +33,218 @@ class DiscoveryServices(object):
         """
         """
         self.client_list = []
+        self.tree = None
+        self.roster_index = {}
+        self.roster_slots = {}
+        self.roster_lock = threading.RLock()
+        self.roster_store = None
+        self.discovery_cache = discovery_cache.DiscoveryCache()
+        # seconds a communication module may take to report its TIMs
+        # before it is left out of ncap_tim_discover, None waits forever
+        self.module_timeout = 10.0
+        self.discovery_feed = discovery_feed.DiscoveryFeed()
+        self.topology_stopped = threading.Event()
+        self.topology_thread = None
 
     def open_roster(self, roster_path):
         """ Open roster file.
         """
         self.roster_path = roster_path
         with open(self.roster_path, 'r') as f:
-            self.tree = ET.parse(self.roster_path)
+            tree = ET.parse(f)
+        with self.roster_lock:
+            self.tree = tree
+            self.rebuild_roster_index()
+
+    def rebuild_roster_index(self):
+        """ Rebuild the JID index of the roster from the XML tree.
+
+        The index maps each JID to the list of its user elements, and
+        roster_slots maps each user element to its position under the
+        roster root, so membership checks, joins and unjoins do not scan
+        the roster.
+        """
+        index = {}
+        slots = {}
+        for slot, user in enumerate(list(self.tree.getroot())):
+            if user.tag != 'user':
+                continue
+            index.setdefault(user.find('jid').text, []).append(user)
+            slots[user] = slot
+        with self.roster_lock:
+            self.roster_index = index
+            self.roster_slots = slots
+
+    def enable_roster_persistence(self, flush_interval=1.0, max_pending=100,
+                                  journal_path=None):
+        """ Persist roster changes to the roster file in the background.
+
+        Changes made by join and unjoin are written behind, see
+        roster_store.RosterStore. Changes journaled but not yet written
+        by a previous run are replayed first.
+
+        :param flush_interval: maximum number of seconds a change stays
+            unsaved
+        :param max_pending: number of unsaved changes which triggers a write
+        :param journal_path: optional path of an append-only journal of the
+            changes since the last write
+        :return: the started roster_store.RosterStore
+        """
+        store = roster_store.RosterStore(self.roster_path,
+                                         self.roster_snapshot,
+                                         flush_interval, max_pending,
+                                         journal_path)
+        records = store.journal_records()
+        with self.roster_lock:
+            for op, jid in records:
+                if op == roster_store.JOIN:
+                    self._add_user(jid)
+                else:
+                    self._remove_user(jid)
+            self.roster_store = store
+        if records:
+            store.flush()
+        store.start()
+        return store
+
+    def roster_snapshot(self):
+        """ Serialize the roster for the roster store. """
+        with self.roster_lock:
+            data = ET.tostring(self.tree.getroot())
+            if self.roster_store is not None:
+                self.roster_store.rotate_journal()
+        return data
+
+    def close_roster(self):
+        """ Write any unsaved roster changes and stop persisting them. """
+        store = self.roster_store
+        if store is not None:
+            store.close()
+        with self.roster_lock:
+            self.roster_store = None
+
+    def _add_user(self, client_id):
+        """ Add a user element to the roster, the roster lock must be held.
+        """
+        if client_id in self.roster_index:
+            return False
+        root = self.tree.getroot()
+        newuser = ET.Element("user")
+        newuser.text = '\n'
+        self.roster_slots[newuser] = len(root)
+        root.append(newuser)
+        newuser.set('subscription', 'true')
+        jabber = ET.Element("jid")
+        newuser.append(jabber)
+        jabber.text = '%s' % (client_id)
+        self.roster_index[client_id] = [newuser]
+        return True
+
+    def _remove_user(self, client_id):
+        """ Remove the user elements of a JID from the roster, the roster
+        lock must be held. """
+        users = self.roster_index.pop(client_id, None)
+        if users is None:
+            return False
+        root = self.tree.getroot()
+        for user in users:
+            # move the last element into the freed slot instead of
+            # shifting every element after it
+            slot = self.roster_slots.pop(user)
+            last = root[-1]
+            if last is not user:
+                root[slot] = last
+                if last in self.roster_slots:
+                    self.roster_slots[last] = slot
+            del root[-1]
+        return True
+
+    def is_client_on_roster(self, client_id):
+        """ Return True if the JID is registered on the roster. """
+        with self.roster_lock:
+            return client_id in self.roster_index
 
     def register_transducer_access_service(self, transducer_access):
         """Register a TimDiscovery service object with the\
-        TransducerDataAccessServices object."""
+        TransducerDataAccessServices object.
+
+        A backend offering a set_topology_listener method is given
+        notify_topology_change to report hot-plug events with."""
         self.transducer_access = transducer_access
+        set_listener = getattr(transducer_access, 'set_topology_listener',
+                               None)
+        if callable(set_listener):
+            set_listener(self.notify_topology_change)
+
+    def invalidate_discovery(self, tim_id=None):
+        """Drop cached discovery results after a topology change.
+
+        The 1451.X backend should call this whenever a TIM is registered or
+        unregistered or its channels change.
+
+        :param tim_id: the TIM which changed, None for any change
+        :return: the number of cached results dropped
+        """
+        return self.discovery_cache.invalidate(tim_id)
+
+    def notify_topology_change(self, op, tim_id, channel_id=None):
+        """Report a TIM or channel being added or removed by the backend.
+
+        Cached discovery results of the TIM are dropped and the change is
+        published to the clients subscribed to the discovery feed.
+
+        :param op: one of discovery_feed.TIM_ADDED, TIM_REMOVED,
+            CHANNEL_ADDED or CHANNEL_REMOVED
+        :param tim_id: the TIM which changed
+        :param channel_id: the channel which changed, for channel changes
+        :return: the list of discovery_feed.DiscoveryDelta published
+        """
+        self.invalidate_discovery(tim_id)
+        return self.discovery_feed.notify(op, tim_id, channel_id)
+
+    def refresh_topology(self, ncap_id=0):
+        """Run a full TIM and transducer discovery, bypassing the cache, so
+        the discovery feed publishes the changes since the last one.
+
+        :return: the result of ncap_tim_discover
+        """
+        self.invalidate_discovery()
+        result = self.ncap_tim_discover(ncap_id)
+        for tim_id in result['tim_ids']:
+            self.ncap_transducer_discover(ncap_id, tim_id)
+        return result
+
+    def run_topology_watch(self, interval):
+        """Discovery loop run by the topology watch thread. Discovery only
+        runs while the feed has subscribers."""
+        while not self.topology_stopped.wait(interval):
+            if not self.discovery_feed.has_subscribers():
+                continue
+            try:
+                self.refresh_topology()
+            except Exception as e:
+                logger.error('DiscoveryServices: topology refresh failed: '
+                             '%s', e)
+
+    def start_topology_watch(self, interval):
+        """Start polling the backend for topology changes every interval
+        seconds, for backends which do not report them.
+
+        :return: the started threading.Thread
+        """
+        self.topology_stopped.clear()
+        self.topology_thread = threading.Thread(
+                            target=self.run_topology_watch, args=(interval, ))
+        self.topology_thread.daemon = True
+        self.topology_thread.start()
+        return self.topology_thread
+
+    def stop_topology_watch(self):
+        """Stop the topology watch thread."""
+        self.topology_stopped.set()
+        if self.topology_thread is not None:
+            self.topology_thread.join()
+            self.topology_thread = None
 
     def ncap_client_join(self, client_id):
 
@@ -46,36 +255,15 @@ class DiscoveryServices(object):
 
         returns FALSE for unregistered, TRUE for registered.
         """
-        on_roster = 0
-
-        root = self.tree.getroot()
-
-        # Setting our list to an empty array
-        jid = []
-
-        # We need to find all of our users in our roster
-        # and then we can find the JID attribute
-        for user in root.findall('user'):
-            jid.append(user.find('jid').text)
-
-        # Check to see if the jid is in our list.
-        # If it is, we will respond to the message.
-        try:
-            jid.index(client_id)
-            on_roster = 1
-        except:
-            # The .index function throws an error if there is no match,
-            # so we will use this as our non-subscribed option.
-            on_roster = -1
-            newuser = ET.Element("user")
-            newuser.text = '\n'
-            root.append(newuser)
-            newuser.set('subscription', 'true')
-            jabber = ET.Element("jid")
-            newuser.append(jabber)
-            jabber.text = '%s' % (client_id)
-            # with open(self.roster_path, 'w') as f:
-            #    tree.write(f)
+        with self.roster_lock:
+            # Check the roster index to see if the jid is registered.
+            # If it is, we will respond to the message.
+            if self._add_user(client_id):
+                on_roster = -1
+                if self.roster_store is not None:
+                    self.roster_store.record(roster_store.JOIN, client_id)
+            else:
+                on_roster = 1
 
         return ((on_roster)*-1, )
 
@@ -86,49 +274,34 @@ class DiscoveryServices(object):
 
         returns FALSE for unregistered, TRUE for registered.
         """
-        on_roster = 0
-        # with open(self.roster_path, 'r') as f:
-        #     tree = ET.parse(f)
-
-        root = self.tree.getroot()
+        with self.roster_lock:
+            if not self._remove_user(client_id):
+                return None
+            if self.roster_store is not None:
+                self.roster_store.record(roster_store.UNJOIN, client_id)
 
-        # Setting our list to an empty array
-        jid = []
-
-        # find all of our users in our roster and
-        # then we can find the JID attribute
-        for user in root.findall('user'):
-            jid.append(user.find('jid').text)
-
-        # Check to see if the jid is in our list.
-        # If it is, we will respond to the message.
-        try:
-            on_roster = 1
-            jid.index(client_id)
-        except:
-            on_roster = -1
-
-        if on_roster >= 0:
-            # find all of our users in roster and then find the JID attribute
-            for user in root.findall('user'):
-                test12 = (user.find('jid').text)
-                if test12 == client_id:
-                    root.remove(user)
-            self.tree = ET.ElementTree(root)
-            # os.remove(self.roster_path)
-            # with open(self.roster_path, 'w') as f:
-            #     tree.write(f)
-
-            return (on_roster, )
+        return (1, )
 
     def ncap_tim_discover(self, ncap_id):
         """
+        The TIMs of every communication module are reported concurrently.
+        Modules which do not report within module_timeout (seconds) are
+        left out and their error code is TIMEOUT.
+
         :param ncap_id: the ncap id number
         :return:
-            error_code: the error code of type ieee1451types.Error
+            error_code: the error code of type ieee1451types.Error, the first
+                        module error if any module failed
             num_of_tim: the number of TIMs connected to the ncap (UINT16)
             tim_ids: the list of tim ids for the connected tims
+            module_ids: the list of communication module ids
+            module_error_codes: the serialized error code of each module
         """
+        key = (discovery_cache.TIM_DISCOVER, )
+        result = self.discovery_cache.get(key)
+        if result is not None:
+            return result
+
         error_code = ieee1451.Error(
             ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
             ieee1451.ErrorCode.NO_ERROR)
@@ -138,17 +311,41 @@ class DiscoveryServices(object):
         comm_ids = comrep['module_ids']
         error_code = comrep['error_code']
 
+        # one thread per module so module_timeout applies to each of them
+        tasks = [(lambda m=id: self.transducer_access.report_tims(m))
+                 for id in comm_ids]
+        reports = worker_pool.run_concurrently(tasks, len(tasks),
+                                               self.module_timeout)
+
         tim_ids = []
-        for id in comm_ids:
-            timrep = self.transducer_access.report_tims(id)
-            error_code = timrep['error_code']
-            tim_ids = tim_ids + timrep['tim_ids']
+        module_error_codes = []
+        for report in reports:
+            if report.done and report.exception is None:
+                timrep = report.value
+                module_error = timrep['error_code']
+                tim_ids.extend(timrep['tim_ids'])
+            else:
+                code = ieee1451.ErrorCode.TIMEOUT
+                if report.exception is not None:
+                    code = ieee1451.ErrorCode.NETWORK_FAILURE
+                module_error = ieee1451.Error(
+                    ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0, code)
+            module_error_codes.append(module_error.serializable()['Error'])
+            if getattr(error_code, 'code', None) == \
+                    ieee1451.ErrorCode.NO_ERROR:
+                error_code = module_error
 
         num_of_tim = len(tim_ids)
 
         result = {'error_code': error_code,
                   'num_of_tim': num_of_tim,
-                  'tim_ids': tim_ids}
+                  'tim_ids': tim_ids,
+                  'module_ids': list(comm_ids),
+                  'module_error_codes': module_error_codes}
+
+        if getattr(error_code, 'code', None) == ieee1451.ErrorCode.NO_ERROR:
+            self.discovery_cache.put(key, result)
+            self.discovery_feed.update_tims(tim_ids)
 
         return result
 
@@ -164,6 +361,11 @@ class DiscoveryServices(object):
             transducer_channel_ids: the list of transducer channel ids for the queried tim
             transducer_channel_names: the list of transducer channel names for the queried tim
         """
+        key = (discovery_cache.TRANSDUCER_DISCOVER, tim_id)
+        result = self.discovery_cache.get(key)
+        if result is not None:
+            return result
+
         error_code = ieee1451.Error(
             ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
             ieee1451.ErrorCode.NO_ERROR)
@@ -182,4 +384,55 @@ class DiscoveryServices(object):
                   'trans_channel_ids': trans_channel_ids,
                   'trans_channel_names': channel_names}
 
+        if getattr(error_code, 'code', None) == ieee1451.ErrorCode.NO_ERROR:
+            self.discovery_cache.put(key, result)
+            self.discovery_feed.update_channels(tim_id, trans_channel_ids)
+
+        return result
+
+    def ncap_discovery_subscribe(self, ncap_id, client_id, last_seq=None):
+        """Subscribe a client to the discovery change feed. This is an
+        ncaplite extension to the 1451.1 discovery services.
+
+        Deltas published afterwards are pushed to the client by the NCAP.
+
+        :param ncap_id: the ncap id number
+        :param client_id: the JID of the client, set by the NCAP to the JID
+            of the sender of the request
+        :param last_seq: optional sequence number of the last delta the
+            client saw, the deltas after it are returned
+        :return:
+            error_code: the error code of type ieee1451types.Error
+            seq: the sequence number of the latest delta
+            deltas: the list of serialized deltas after last_seq
+            resync: True if deltas after last_seq are no longer kept and
+                    the client has to run a full discovery
+        """
+        error_code = ieee1451.Error(
+            ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+            ieee1451.ErrorCode.NO_ERROR)
+
+        seq, deltas = self.discovery_feed.subscribe(client_id, last_seq)
+
+        result = {'error_code': error_code,
+                  'seq': seq,
+                  'deltas': [d.serializable() for d in deltas or []],
+                  'resync': deltas is None}
+
         return result
+
+    def ncap_discovery_unsubscribe(self, ncap_id, client_id):
+        """Unsubscribe a client from the discovery change feed.
+
+        :param ncap_id: the ncap id number
+        :param client_id: the JID of the client
+        :return:
+            error_code: the error code of type ieee1451types.Error
+        """
+        error_code = ieee1451.Error(
+            ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+            ieee1451.ErrorCode.NO_ERROR)
+
+        self.discovery_feed.unsubscribe(client_id)
+
+        return {'error_code': error_code}
@@ -31,6 +31,10 @@ class TimeRepresentation(object):
         """Return the TimeInstance in a serializable format"""
         return {type(self).__name__: self.__dict__}
 
+    def total_seconds(self):
+        """Return the represented time in seconds as a float"""
+        return self.secs + self.nsecs * 1e-9
+
     @staticmethod
     def from_serializable(s):
         """Initialize the object from the serializable format"""
@@ -185,14 +189,25 @@ class Argument(object):
         return str(self.__dict__)
 
     def serializable(self):
-        """Return the Argument in a serializable format"""
-        return {'type_code': str(self.type_code), 'value': self.value}
+        """Return the Argument in a serializable format. Values which are
+        themselves IEEE1451 types, e.g. a nested ArgumentArray, are
+        converted as well."""
+        val = self.value
+        serializable = getattr(val, "serializable", None)
+        if callable(serializable):
+            val = serializable()
+        return {'type_code': str(self.type_code), 'value': val}
 
     @staticmethod
     def from_serializable(s):
         """Initialize an argument from it's serializable format"""
         tc = TypeCode[s['type_code']]
         val = s['value']
+        if isinstance(val, dict) and len(val) == 1:
+            c = globals().get(str(list(val.keys())[0]))
+            from_serializable = getattr(c, "from_serializable", None)
+            if callable(from_serializable):
+                val = from_serializable(val)
         return Argument(type_code=tc, value=val)
 
 
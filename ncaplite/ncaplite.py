@@ -14,8 +14,16 @@
 # throughout SleekXMPP, we will set the default encoding
 # ourselves to UTF-8.
 import logging
+import os
 import xml.etree.ElementTree as ET
 import thread
+import ieee1451types as ieee1451
+import operation_table
+import session_pool
+import teds_cache
+import teds_repository
+import teds_support
+import teds_warmup
 
 logger = logging.getLogger(__name__)
 
@@ -46,7 +54,46 @@ class NCAP(object):
         self.server_list = {}
         self.server_client_join_list = {}
         self.roster_file_path = 'roster.xml'
+        # write joins and unjoins back to the roster file, see
+        # DiscoveryServices.enable_roster_persistence
+        self.roster_persistence = True
+        self.roster_flush_interval = 1.0
+        self.roster_max_pending = 100
+        self.roster_journal_path = None
+        # share open trans_comm_ids between requests, see
+        # session_pool.SessionPool
+        self.session_pool_enabled = True
+        self.max_open_per_tim = 4
+        self.session_idle_timeout = 60.0
+        self.session_pools = []
         self.message_handlers = {}
+        # the name of the request argument set to the JID of the sender,
+        # keyed by message ID, for services pushing to or owned by clients
+        self.sender_arguments = {}
+        self.discovery_service = None
+        self.teds_access = None
+        self.teds_warmup = None
+        self.warmup_enabled = True
+        self.warmup_workers_per_module = 4
+        self.warmup_timeout = 5
+        # sqlite file of the persistent TEDS cache, None keeps the TEDS
+        # cache in memory only
+        self.teds_cache_path = None
+        self.teds_cache_ttl = None
+        self.teds_cache = None
+        # (path, tim_id, channel_id) of the TEDS XML files served instead
+        # of the TEDS of the TIMs
+        self.teds_files = []
+        self.teds_repository = None
+        # (tim_id, channel_id, capacity, sampling_rate) of the channels
+        # whose sample history is kept from start
+        self.sample_history_channels = []
+        # seconds between discovery runs feeding the discovery feed, for
+        # backends which do not report topology changes, None disables it
+        self.topology_poll_interval = None
+        # seconds a communication module may take to report its TIMs, None
+        # keeps the default of the discovery service
+        self.discovery_module_timeout = None
 
     def load_config(self, config_file_path='ncapconfig.xml'):
         """
@@ -70,6 +117,68 @@ class NCAP(object):
                                  find('serial_number').text)
         self.manufacturer_id = int(root.find('ncap_identification').
                                    find('manufacturer_id').text)
+        warmup = root.find('teds_warmup')
+        if warmup is not None:
+            self.warmup_enabled = warmup.get('enabled', 'true') == 'true'
+            workers = warmup.find('max_workers_per_module')
+            if workers is not None:
+                self.warmup_workers_per_module = int(workers.text)
+            timeout = warmup.find('timeout')
+            if timeout is not None:
+                self.warmup_timeout = int(timeout.text)
+        persistence = root.find('roster_persistence')
+        if persistence is not None:
+            self.roster_persistence = \
+                persistence.get('enabled', 'true') == 'true'
+            flush_interval = persistence.find('flush_interval')
+            if flush_interval is not None:
+                self.roster_flush_interval = float(flush_interval.text)
+            max_pending = persistence.find('max_pending')
+            if max_pending is not None:
+                self.roster_max_pending = int(max_pending.text)
+            journal_path = persistence.find('journal_path')
+            if journal_path is not None:
+                self.roster_journal_path = journal_path.text
+        pool = root.find('session_pool')
+        if pool is not None:
+            self.session_pool_enabled = pool.get('enabled', 'true') == 'true'
+            max_open = pool.find('max_open_per_tim')
+            if max_open is not None:
+                self.max_open_per_tim = int(max_open.text)
+            idle_timeout = pool.find('idle_timeout')
+            if idle_timeout is not None:
+                self.session_idle_timeout = float(idle_timeout.text)
+        cache = root.find('teds_cache')
+        if cache is not None:
+            self.teds_cache_path = cache.find('db_path').text
+            ttl = cache.find('ttl')
+            if ttl is not None:
+                self.teds_cache_ttl = float(ttl.text)
+        watch = root.find('topology_watch')
+        if watch is not None:
+            poll_interval = watch.find('poll_interval')
+            if poll_interval is not None:
+                self.topology_poll_interval = float(poll_interval.text)
+        discovery = root.find('discovery')
+        if discovery is not None:
+            module_timeout = discovery.find('module_timeout')
+            if module_timeout is not None:
+                self.discovery_module_timeout = float(module_timeout.text)
+        files = root.find('teds_files')
+        if files is not None:
+            for teds_file in files.findall('file'):
+                self.teds_files.append((teds_file.text,
+                                        int(teds_file.get('tim_id', 0)),
+                                        int(teds_file.get('channel_id', 0))))
+        history = root.find('sample_history')
+        if history is not None:
+            for channel in history.findall('channel'):
+                rate = channel.get('sampling_rate')
+                self.sample_history_channels.append(
+                            (int(channel.get('tim_id')),
+                             int(channel.get('channel_id')),
+                             int(channel.get('capacity')),
+                             float(rate) if rate else None))
 
     def register_network_interface(self, network_interface):
         """Register a NetworkInterface object with the NCAP
@@ -83,6 +192,8 @@ class NCAP(object):
                             "session_start", self.on_network_if_session_start)
         self.network_interface.add_event_handler(
                                         "message", self.on_network_if_message)
+        self.network_interface.add_event_handler(
+                    "presence_unavailable", self.on_network_if_unavailable)
 
     def register_discovery_service(self, discovery):
         """Register a DiscoveryService object with the NCAP
@@ -93,9 +204,36 @@ class NCAP(object):
         logger.debug('NCAP.register_network_interface')
         self.discovery_service = discovery
         self.message_handlers[7108] = self.discovery_service.ncap_client_join
-        self.message_handlers[7109] = self.discovery_service.ncap_client_unjoin
+        self.message_handlers[7109] = self.ncap_client_unjoin
         self.message_handlers[716] = self.discovery_service.ncap_tim_discover
         self.message_handlers[717] = self.discovery_service.ncap_transducer_discover
+        self.message_handlers[718] = \
+            self.discovery_service.ncap_discovery_subscribe
+        self.message_handlers[719] = \
+            self.discovery_service.ncap_discovery_unsubscribe
+        self.discovery_service.discovery_feed.sender = \
+            self.send_discovery_deltas
+        self.sender_arguments[718] = 'client_id'
+        self.sender_arguments[719] = 'client_id'
+        self.share_tim_discovery()
+
+    def send_discovery_deltas(self, client_id, deltas, seq):
+        """Push discovery feed deltas to a subscribed client as a 720
+        message.
+
+        :param client_id: the JID of the client
+        :param deltas: the list of discovery_feed.DiscoveryDelta
+        :param seq: the sequence number of the latest delta
+        :return:
+        """
+        logger.debug('NCAP.send_discovery_deltas')
+        # pushed as 720, 718 being the reply to the subscription
+        response = [720, {'ncap_id': self.id,
+                          'seq': seq,
+                          'deltas': [d.serializable() for d in deltas]}]
+        msg = self.network_interface.parse_outbound(response)
+        self.network_interface.send_message(mto=str(client_id), mbody=msg,
+                                            mtype='chat')
 
     def register_transducer_data_access_service(self, transducer_access):
         """Register a TransducerDataAccessService object with the NCAP
@@ -106,9 +244,83 @@ class NCAP(object):
         logger.debug('NCAP.register_transducer_data_access_service')
         self.transducer_access = transducer_access
         self.message_handlers[7211] = self.transducer_access.\
-            read_transducer_sample_data_from_a_channel_of_a_tim
+            start_read_transducer_sample_data_from_a_channel_of_a_tim
+        self.message_handlers[7212] = self.transducer_access.\
+            read_transducer_block_data_from_a_channel_of_a_tim
+        self.message_handlers[7213] = self.transducer_access.\
+            read_transducer_sample_data_from_multiple_channels_of_a_tim
+        self.message_handlers[7214] = self.transducer_access.\
+            read_transducer_block_data_from_multiple_channels_of_multiple_tims
         self.message_handlers[7217] = self.transducer_access.\
-            write_transducer_sample_data_to_a_channel_of_a_tim
+            start_write_transducer_sample_data_to_a_channel_of_a_tim
+        self.message_handlers[7218] = self.transducer_access.\
+            write_transducer_block_data_to_a_channel_of_a_tim
+        # ncaplite extensions following block operations by operation_id
+        self.message_handlers[7240] = self.transducer_access.\
+            report_block_operation
+        self.message_handlers[7241] = self.transducer_access.\
+            cancel_block_operation
+        self.message_handlers[7250] = self.transducer_access.\
+            subscribe_transducer_stream
+        self.message_handlers[7251] = self.transducer_access.\
+            unsubscribe_transducer_stream
+        self.message_handlers[7260] = self.transducer_access.\
+            read_sample_history
+        self.message_handlers[7261] = self.transducer_access.\
+            aggregate_sample_data
+        self.message_handlers[7262] = self.transducer_access.\
+            downsample_sample_data
+        self.message_handlers[7263] = self.transducer_access.\
+            enable_sample_history
+        self.message_handlers[7264] = self.transducer_access.\
+            disable_sample_history
+        self.message_handlers[7431] = self.transducer_access.\
+            subscribe_sensor_alert
+        self.message_handlers[7432] = self.transducer_access.\
+            unsubscribe_sensor_alert
+        self.sender_arguments[7250] = 'client_id'
+        self.sender_arguments[7251] = 'client_id'
+        self.sender_arguments[7431] = 'sensor_alert_subscriber'
+        self.sender_arguments[7432] = 'client_id'
+        self.transducer_access.stream_manager.sender = \
+            self.send_stream_samples
+        self.transducer_access.sensor_alerts.sender = self.send_sensor_alert
+
+    def send_sensor_alert(self, client_id, alert):
+        """Send a sensor alert to a subscribed client as a 7433 message.
+
+        :param client_id: the JID of the client
+        :param alert: the alert dictionary of sensor_alerts.AlertRule
+        :return:
+        """
+        logger.debug('NCAP.send_sensor_alert')
+        args = dict(alert)
+        args['ncap_id'] = self.id
+        # sent as 7433, 7431 being the reply to the subscription
+        msg = self.network_interface.parse_outbound([7433, args])
+        self.network_interface.send_message(mto=str(client_id), mbody=msg,
+                                            mtype='chat')
+
+    def send_stream_samples(self, client_id, tim_id, channel_id, samples):
+        """Push a batch of stream measurements to a subscribed client
+        as a 7252 message.
+
+        :param client_id: the JID of the client
+        :param tim_id: the TIM of the stream
+        :param channel_id: the channel of the stream
+        :param samples: the list of measurement ArgumentArrays
+        :return:
+        """
+        logger.debug('NCAP.send_stream_samples')
+        # pushed as 7252, 7250 being the reply to the subscription
+        response = [7252, {'ncap_id': self.id,
+                           'tim_id': tim_id,
+                           'channel_id': channel_id,
+                           'samples': [getattr(s, 'serializable', lambda: s)()
+                                       for s in samples]}]
+        msg = self.network_interface.parse_outbound(response)
+        self.network_interface.send_message(mto=str(client_id), mbody=msg,
+                                            mtype='chat')
 
     def register_teds_access_service(self, teds_access):
         """Register a TedsAccessService object with the NCAP
@@ -122,14 +334,204 @@ class NCAP(object):
             read_transducer_channel_teds
         self.message_handlers[733] = self.teds_access.\
             read_user_transducer_name_teds
+        self.message_handlers[734] = self.teds_access.\
+            read_bulk_teds
+        self.share_tim_discovery()
+
+    def share_tim_discovery(self):
+        """Register the TimDiscovery service of the discovery service with
+        the TEDS access service, which lists the channels of the TIMs for
+        bulk TEDS reads with it.
+
+        :return:
+        """
+        tim_discovery = getattr(self.discovery_service, 'transducer_access',
+                                None)
+        if self.teds_access is not None and tim_discovery is not None and \
+                self.teds_access.tim_discovery is None:
+            self.teds_access.register_tim_discovery_service(tim_discovery)
+
+    def start_roster_persistence(self):
+        """Open the roster file if the discovery service has no roster yet
+        and persist the joins and unjoins to it.
+
+        :return: the roster_store.RosterStore, None if there is no roster
+            file
+        """
+        logger.debug('NCAP.start_roster_persistence')
+        discovery = self.discovery_service
+        if discovery.tree is None:
+            if not os.path.exists(self.roster_file_path):
+                logger.error('NCAP.start_roster_persistence: no roster '
+                             'file at %s', self.roster_file_path)
+                return None
+            discovery.open_roster(self.roster_file_path)
+        return discovery.enable_roster_persistence(
+                            self.roster_flush_interval,
+                            self.roster_max_pending,
+                            self.roster_journal_path)
+
+    def start_session_pools(self):
+        """Register a session pool with the transducer data access and TEDS
+        access services which have none. Services using the same
+        TransducerAccess object share one pool.
+
+        :return: the list of session_pool.SessionPool objects created
+        """
+        logger.debug('NCAP.start_session_pools')
+        pools = {}
+        for service in (getattr(self, 'transducer_access', None),
+                        self.teds_access):
+            backend = getattr(service, 'transducer_access', None)
+            if backend is None or service.session_pool is not None:
+                continue
+            pool = pools.get(id(backend))
+            if pool is None:
+                pool = session_pool.SessionPool(
+                            backend, self.max_open_per_tim,
+                            self.session_idle_timeout)
+                pools[id(backend)] = pool
+            service.register_session_pool(pool)
+        self.session_pools = list(pools.values())
+        return self.session_pools
+
+    def start_teds_cache(self):
+        """Serve the TEDS stored by the previous run from the persistent
+        TEDS cache and revalidate them against the TIMs in the background.
+
+        :return: the teds_cache.PersistentTEDSCache object
+        """
+        logger.debug('NCAP.start_teds_cache')
+        self.teds_cache = teds_cache.PersistentTEDSCache(
+                            self.teds_cache_path, self.teds_cache_ttl)
+        self.teds_access.register_teds_cache(self.teds_cache)
+        self.teds_access.start_cache_revalidation(
+                            ieee1451.TimeDuration(self.warmup_timeout, 0))
+        return self.teds_cache
+
+    def start_teds_repository(self):
+        """Serve the TEDS of the files listed in the teds_files element of
+        the NCAP configuration.
+
+        :return: the teds_repository.TEDSRepository object
+        """
+        logger.debug('NCAP.start_teds_repository')
+        self.teds_repository = teds_repository.TEDSRepository()
+        for path, tim_id, channel_id in self.teds_files:
+            self.teds_repository.add_file(path, tim_id, channel_id)
+        self.teds_access.register_teds_repository(self.teds_repository)
+        return self.teds_repository
+
+    def start_teds_warmup(self):
+        """Discover the TIMs and prefetch their TEDS in the background.
+
+        :return: the started TEDSWarmup object
+        """
+        logger.debug('NCAP.start_teds_warmup')
+        self.teds_warmup = teds_warmup.TEDSWarmup(
+                    self.discovery_service, self.teds_access,
+                    teds_types=[teds_support.TEDSType.CHAN_TEDS,
+                                teds_support.TEDSType.XDCR_NAME,
+                                teds_support.TEDSType.CAL_TEDS],
+                    max_workers_per_module=self.warmup_workers_per_module,
+                    timeout=ieee1451.TimeDuration(self.warmup_timeout, 0),
+                    on_progress=self.on_teds_warmup_progress,
+                    on_teds=self.on_teds_warmup_read)
+        self.teds_warmup.start()
+        return self.teds_warmup
+
+    def on_teds_warmup_progress(self, progress):
+        """
+        Callback for progress of the TEDS warm-up
+        :return:
+        """
+        logger.debug('NCAP.on_teds_warmup_progress: '+str(progress))
+
+    def on_teds_warmup_read(self, tim_id, channel_id, teds_type, rtres):
+        """
+        Callback for every TEDS read by the TEDS warm-up, applies the
+        Calibration TEDS to the values read from the channel
+        :return:
+        """
+        if teds_type != teds_support.TEDSType.CAL_TEDS or \
+                getattr(self, 'transducer_access', None) is None:
+            return
+        try:
+            self.transducer_access.load_calibration(
+                            tim_id, channel_id, rtres['teds'],
+                            rtres.get('version'))
+        except Exception as e:
+            logger.error('NCAP.on_teds_warmup_read: Calibration TEDS of '
+                         '%s/%s not applied: %s', tim_id, channel_id, e)
+
+    def start_sample_history(self):
+        """Keep the sample history of the channels listed in the
+        sample_history element of the NCAP configuration.
+
+        :return: the list of enable_sample_history results
+        """
+        logger.debug('NCAP.start_sample_history')
+        results = []
+        for tim_id, channel_id, capacity, rate in \
+                self.sample_history_channels:
+            result = self.transducer_access.enable_sample_history(
+                            self.id, tim_id, channel_id, capacity, rate)
+            if getattr(result['error_code'], 'code',
+                       ieee1451.ErrorCode.NO_ERROR) != \
+                    ieee1451.ErrorCode.NO_ERROR:
+                logger.error('NCAP.start_sample_history: channel %s of TIM '
+                             '%s failed: %s', channel_id, tim_id,
+                             result['error_code'])
+            results.append(result)
+        return results
 
     def start(self):
         logger.debug('NCAP.start')
+        self.share_tim_discovery()
+        if self.discovery_service is not None and \
+                self.discovery_module_timeout is not None:
+            self.discovery_service.module_timeout = \
+                self.discovery_module_timeout
+        if self.type == "server" and self.roster_persistence and \
+                self.discovery_service is not None and \
+                self.discovery_service.roster_store is None:
+            self.start_roster_persistence()
+        if self.type == "server" and self.session_pool_enabled:
+            self.start_session_pools()
+        if self.type == "server" and self.teds_cache_path and \
+                self.teds_access is not None:
+            self.start_teds_cache()
+        if self.type == "server" and self.teds_files and \
+                self.teds_access is not None:
+            self.start_teds_repository()
+        if self.type == "server" and self.warmup_enabled and \
+                self.discovery_service is not None and \
+                self.teds_access is not None:
+            self.start_teds_warmup()
+        if self.type == "server" and \
+                getattr(self, 'transducer_access', None) is not None:
+            self.start_sample_history()
+        if self.type == "server" and self.topology_poll_interval and \
+                self.discovery_service is not None and \
+                getattr(self.discovery_service, 'transducer_access',
+                        None) is not None:
+            self.discovery_service.start_topology_watch(
+                                                self.topology_poll_interval)
         self.network_interface.run()
 
     def stop(self):
         logger.debug('NCAP.stop')
+        if self.discovery_service is not None:
+            self.discovery_service.stop_topology_watch()
         self.network_interface.disconnect()
+        if self.discovery_service is not None:
+            self.discovery_service.close_roster()
+        for pool in self.session_pools:
+            pool.close_all()
+        self.session_pools = []
+        if self.teds_cache is not None:
+            self.teds_cache.close()
+            self.teds_cache = None
 
     def on_network_if_message(self, msg):
         """
@@ -141,6 +543,40 @@ class NCAP(object):
             if self.type == "server":
                 self.handle_message(msg)
 
+    def on_network_if_unavailable(self, presence):
+        """
+        Callback for a client going offline on the network interface
+        :return:
+        """
+        logger.debug('NCAP.on_network_if_unavailable')
+        self.client_left(str(presence['from']))
+
+    def client_left(self, client_id):
+        """Drop the subscriptions of a client which unjoined or went
+        offline.
+
+        :param client_id: the JID of the client, a bare JID also drops the
+            subscriptions of its resources
+        :return:
+        """
+        logger.debug('NCAP.client_left: '+client_id)
+        transducer_access = getattr(self, 'transducer_access', None)
+        if transducer_access is not None:
+            transducer_access.client_left(client_id)
+        if self.discovery_service is not None:
+            self.discovery_service.discovery_feed.unsubscribe_client(
+                                                                client_id)
+
+    def ncap_client_unjoin(self, client_id):
+        """Unjoin a client and drop its subscriptions.
+
+        :param client_id: the JID of the client
+        :return: the result of DiscoveryServices.ncap_client_unjoin
+        """
+        result = self.discovery_service.ncap_client_unjoin(client_id)
+        self.client_left(client_id)
+        return result
+
     def on_network_if_session_start(self, event):
         """
         Callback for start of new session on the network interface
@@ -168,6 +604,52 @@ class NCAP(object):
                                  self.message_handlers[request[0]])
                                 )
 
+    def encode_response(self, message_id, result, encode):
+        """Encode the response to a request.
+
+        Results served from the discovery cache are encoded once per codec
+        and the encoded message is reused for later requests.
+
+        Args:
+            message_id: The message ID of the request
+            result:     The result returned by the 1451-1 service
+            encode:     A callable which encodes the response
+        """
+        cache = getattr(self.discovery_service, 'discovery_cache', None)
+        if cache is None:
+            return encode()
+        codec = getattr(self.network_interface, 'codec', None)
+        return cache.encoded(result, message_id, codec, encode)
+
+    def send_response(self, request, result, sender_info):
+        """Encode the result of a 1451-1 service and send it to the
+        client.
+
+        Args:
+            request:     The request passed down from handle_message
+            result:      The result returned by the 1451-1 service
+            sender_info: The information about where to send the reply
+                         via the network interface.
+        """
+        try:
+            if type(request) == list:
+                response = [request[0], result]
+                msg = self.encode_response(
+                    request[0], result,
+                    lambda: self.network_interface.parse_outbound(response))
+            else:
+                msg = self.encode_response(
+                    request[0], result,
+                    lambda: str(request[0]) + ',' +
+                    self.network_interface.parse_outbound(result))
+
+            logger.debug('NCAP.handler_thread response: '+str(msg))
+
+            self.network_interface.send_message(
+                            mto=str(sender_info[1]), mbody=msg, mtype='chat')
+        except Exception as e:
+            logger.error("NCAP.send_response Exception: "+str(e))
+
     def handler_thread(self, request, sender_info, function):
         """handler_thread generalizes the actions taken by the thread
         created by the handle_message function. We call the appropriate
@@ -175,6 +657,10 @@ class NCAP(object):
         returns a response, we parse the reponse into an outgoing message
         for the network interface and send a reply to the client.
 
+        Services which complete later return an
+        operation_table.DeferredResult; the reply is then sent by its
+        callback and the thread returns at once.
+
         Args:
             request:     The request passed down from handle_message
             sender_info: The information about where to send the reply
@@ -186,17 +672,20 @@ class NCAP(object):
             logger.debug('NCAP.handler_thread')
 
             if type(request) == list:
-                result = function(**request[1])
-                response = [request[0], result]
-                msg = self.network_interface.parse_outbound(response)
+                args = request[1]
+                name = self.sender_arguments.get(request[0])
+                if name is not None:
+                    args = dict(args)
+                    args[name] = str(sender_info[1])
+                result = function(**args)
             else:
-                response = function(*request[1:])
-                msg = str(request[0]) + \
-                    ',' + self.network_interface.parse_outbound(response)
+                result = function(*request[1:])
 
-            logger.debug('NCAP.handler_thread response: '+str(msg))
+            if isinstance(result, operation_table.DeferredResult):
+                result.add_callback(
+                    lambda res: self.send_response(request, res, sender_info))
+                return
 
-            self.network_interface.send_message(
-                            mto=str(sender_info[1]), mbody=msg, mtype='chat')
+            self.send_response(request, result, sender_info)
         except Exception as e:
            logger.error("NCAP.handler_thread Exception: "+str(e))
@@ -0,0 +1,236 @@
+"""
+.. module:: operation_table
+   :platform: Unix, Windows
+   :synopsis: Defines the table of pending non-blocking 1451.0 operations
+   and the deferred results completed by their callbacks.
+
+.. moduleauthor:: James Ethridge <jeethridge@gmail.com>
+
+"""
+# -*- coding: utf-8 -*-
+import heapq
+import logging
+import threading
+import ieee1451types as ieee1451
+import transducer_services_base
+from timeutil import clock
+
+logger = logging.getLogger(__name__)
+
+
+def status_error(status):
+    """Convert the status passed to an AppCallback to an Error object."""
+    if isinstance(status, ieee1451.Error):
+        return status
+    code = ieee1451.ErrorCode.NO_ERROR
+    if status:
+        try:
+            code = ieee1451.ErrorCode(status)
+        except ValueError:
+            code = ieee1451.ErrorCode.NETWORK_FAILURE
+    return ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0, code)
+
+
+class DeferredResult(object):
+    """The result of a service which completes later.
+
+    Callbacks added with add_callback are called with the result once it
+    is resolved, or at once if it already is.
+    """
+
+    def __init__(self):
+        self.result = None
+        self.callbacks = []
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def add_callback(self, callback):
+        """Call callback(result) once the result is resolved."""
+        with self.lock:
+            if not self.done.is_set():
+                self.callbacks.append(callback)
+                return
+        callback(self.result)
+
+    def resolve(self, result):
+        """Set the result and call the callbacks.
+
+        :return: False if the result was already resolved
+        """
+        with self.lock:
+            if self.done.is_set():
+                return False
+            self.result = result
+            callbacks = self.callbacks
+            self.callbacks = []
+            self.done.set()
+        for callback in callbacks:
+            try:
+                callback(result)
+            except Exception as e:
+                logger.error('DeferredResult: callback failed: %s', e)
+        return True
+
+    def wait(self, timeout=None):
+        """Block until the result is resolved.
+
+        :return: the result, None if timeout expired first
+        """
+        self.done.wait(timeout)
+        return self.result
+
+
+class PendingOperation(object):
+    """Defines a started operation waiting for its callback."""
+
+    def __init__(self, operation_id, deadline, complete, on_timeout):
+        self.operation_id = operation_id
+        self.deadline = deadline
+        self.complete = complete
+        self.on_timeout = on_timeout
+
+
+class OperationTable(transducer_services_base.ApiCallbackBase):
+    """Table of operations started with start_read_data or
+    start_write_data.
+
+    The table is the AppCallback passed to the start_* calls. The
+    measurement_update or actuation_complete callback of an operation
+    calls its complete function with the values and an Error object,
+    after which the operation is dropped. An operation whose callback
+    has not arrived by its deadline gets on_timeout called instead, from
+    the table's timeout thread.
+
+    A callback may arrive before the start_* call returns the operation
+    ID; it is then kept until add is called for that ID, or dropped after
+    early_ttl seconds, which also disposes of callbacks arriving after
+    their operation timed out.
+    """
+
+    def __init__(self, early_ttl=5.0):
+        """Initialize the OperationTable object.
+
+        :param early_ttl: seconds a callback without a pending operation
+            is kept
+        """
+        self.early_ttl = early_ttl
+        self.pending = {}
+        self.early = {}
+        self.deadlines = []
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.thread = None
+
+    def add(self, operation_id, timeout, complete, on_timeout):
+        """Track a started operation.
+
+        :param operation_id: the ID returned by the start_* call
+        :param timeout: seconds to wait for the callback
+        :param complete: callable taking the values and an Error object
+        :param on_timeout: callable taking no arguments
+        :return: False if an operation with the same ID is still pending,
+            in which case the operation is not tracked
+        """
+        with self.lock:
+            if operation_id in self.pending:
+                return False
+            early = self.early.pop(operation_id, None)
+            if early is None:
+                self._start_thread()
+                deadline = clock() + timeout
+                self.pending[operation_id] = PendingOperation(
+                                operation_id, deadline, complete, on_timeout)
+                heapq.heappush(self.deadlines, (deadline, operation_id))
+                self.changed.notify()
+        if early is not None:
+            complete(early[0], early[1])
+        return True
+
+    def _start_thread(self):
+        """Start the timeout thread if needed, the lock must be held."""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _complete(self, operation_id, values, status):
+        with self.lock:
+            operation = self.pending.pop(operation_id, None)
+            if operation is None:
+                self._start_thread()
+                deadline = clock() + self.early_ttl
+                self.early[operation_id] = (values, status_error(status),
+                                            deadline)
+                heapq.heappush(self.deadlines, (deadline, operation_id))
+                self.changed.notify()
+                return
+            # lets the timeout thread exit once the table is empty
+            self.changed.notify()
+        operation.complete(values, status_error(status))
+
+    def size(self):
+        """Return the number of pending operations."""
+        with self.lock:
+            return len(self.pending)
+
+    def expire(self):
+        """Time out the operations past their deadline.
+
+        :return: the number of operations timed out
+        """
+        expired = []
+        with self.lock:
+            now = clock()
+            while self.deadlines and self.deadlines[0][0] <= now:
+                deadline, operation_id = heapq.heappop(self.deadlines)
+                operation = self.pending.get(operation_id)
+                if operation is not None and operation.deadline == deadline:
+                    del self.pending[operation_id]
+                    expired.append(operation)
+                early = self.early.get(operation_id)
+                if early is not None and early[2] == deadline:
+                    del self.early[operation_id]
+        for operation in expired:
+            try:
+                operation.on_timeout()
+            except Exception as e:
+                logger.error('OperationTable: timeout of %s failed: %s',
+                             operation.operation_id, e)
+        return len(expired)
+
+    def run(self):
+        """Timeout loop run by the background thread, which exits once no
+        operation is pending."""
+        while True:
+            with self.lock:
+                if not self.pending and not self.early:
+                    # the deadlines left belong to completed operations
+                    self.deadlines = []
+                    self.thread = None
+                    return
+                self.changed.wait(max(0.0, self.deadlines[0][0] - clock()))
+            self.expire()
+
+    def measurement_update(self, operation_id, meas_values, status):
+        """Complete a read started with start_read_data. Called by the
+        IEEE 1451.0 layer."""
+        self._complete(operation_id, meas_values, status)
+        return {'error_code': status_error(None)}
+
+    def actuation_complete(self, operation_id, status):
+        """Complete a write started with start_write_data. Called by the
+        IEEE 1451.0 layer."""
+        self._complete(operation_id, None, status)
+        return {'error_code': status_error(None)}
+
+    def status_change(self, operation_id, status):
+        """Not used by the operation table."""
+        return {'error_code': status_error(None)}
+
+    def command_complete(self, operation_id, out_args, status):
+        """Not used by the operation table."""
+        return {'error_code': status_error(None)}
+
+    def trigger_complete(self, operation_id, status):
+        """Not used by the operation table."""
+        return {'error_code': status_error(None)}
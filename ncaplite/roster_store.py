@@ -0,0 +1,220 @@
+"""
+.. module:: roster_store
+   :platform: Unix, Windows
+   :synopsis: Defines the write-behind persistence of the client roster
+   used by the Discovery Services.
+
+.. moduleauthor:: James Ethridge <jeethridge@gmail.com>
+
+"""
+# -*- coding: utf-8 -*-
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+JOIN = '+'
+UNJOIN = '-'
+
+
+def replace_file(src, dst):
+    """Atomically replace dst with src."""
+    replace = getattr(os, 'replace', None)
+    if replace is not None:
+        replace(src, dst)
+        return
+    try:
+        os.rename(src, dst)
+    except OSError:
+        # os.rename does not overwrite an existing file on Windows
+        os.remove(dst)
+        os.rename(src, dst)
+
+
+def write_atomic(path, data):
+    """Write data to a temporary file next to path and rename it over path,
+    so readers see either the old or the new file but never a partial one.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    replace_file(tmp_path, path)
+
+
+def read_journal(journal_path):
+    """Return the (op, jid) records of a journal, oldest first.
+
+    A partially written last line, e.g. after a crash, is ignored.
+    """
+    records = []
+    if journal_path is None or not os.path.exists(journal_path):
+        return records
+    with open(journal_path, 'r') as f:
+        for line in f:
+            if not line.endswith('\n') or line[0] not in (JOIN, UNJOIN):
+                continue
+            records.append((line[0], line[1:-1]))
+    return records
+
+
+class RosterStore(object):
+    """Write-behind store for the roster XML file.
+
+    Roster changes are only counted, and optionally appended to a journal,
+    on the join and unjoin path. A background thread writes a snapshot of
+    the roster atomically once flush_interval seconds have passed since the
+    first unsaved change or max_pending changes have accumulated.
+
+    Snapshots are taken by calling the snapshot callable, which must return
+    the serialized roster and call rotate_journal while holding the lock
+    that also guards record, so no change can fall between the snapshot and
+    the journal rotation. Journal records are idempotent so the journals
+    left by an interrupted flush can be replayed safely over any later
+    snapshot, see journal_records.
+    """
+
+    def __init__(self, roster_path, snapshot, flush_interval=1.0,
+                 max_pending=100, journal_path=None):
+        """Initialize the RosterStore object.
+
+        :param roster_path: the path of the roster XML file
+        :param snapshot: callable returning the serialized roster
+        :param flush_interval: maximum number of seconds a change stays
+            unsaved
+        :param max_pending: number of unsaved changes which triggers a flush
+        :param journal_path: optional path of an append-only journal of the
+            changes since the last snapshot
+        """
+        self.roster_path = roster_path
+        self.snapshot = snapshot
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.journal_path = journal_path
+        self.journal = None
+        self.pending = 0
+        self.rotated = 0
+        self.flushes = 0
+        self.running = False
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.flush_lock = threading.Lock()
+        self.thread = None
+        if journal_path is not None:
+            self.journal = open(journal_path, 'a')
+
+    def journal_records(self):
+        """Return the journal records to replay over the roster file, those
+        of an interrupted flush first."""
+        if self.journal_path is None:
+            return []
+        return read_journal(self.journal_path + '.old') + \
+            read_journal(self.journal_path)
+
+    def record(self, op, jid):
+        """Record a roster change.
+
+        :param op: JOIN or UNJOIN
+        :param jid: the JID of the client
+        """
+        with self.lock:
+            if self.journal is not None:
+                self.journal.write(op + jid + '\n')
+                self.journal.flush()
+            self.pending += 1
+            if self.pending == 1 or self.pending >= self.max_pending:
+                self.changed.notify()
+
+    def rotate_journal(self):
+        """Move the current journal aside, to be removed once the snapshot
+        taken together with it is on disk. Called from the snapshot
+        callable."""
+        with self.lock:
+            # given back by flush if the snapshot is not written
+            self.rotated = self.pending
+            self.pending = 0
+            if self.journal is None:
+                return
+            self.journal.close()
+            old_path = self.journal_path + '.old'
+            if os.path.exists(old_path):
+                # a previous flush failed, keep its records in order
+                with open(old_path, 'a') as old:
+                    with open(self.journal_path, 'r') as cur:
+                        old.write(cur.read())
+                os.remove(self.journal_path)
+            else:
+                os.rename(self.journal_path, old_path)
+            self.journal = open(self.journal_path, 'a')
+
+    def flush(self):
+        """Write a snapshot of the roster now.
+
+        :return: True if the roster was written
+        """
+        with self.flush_lock:
+            data = self.snapshot()
+            try:
+                write_atomic(self.roster_path, data)
+            except Exception:
+                with self.lock:
+                    self.pending += self.rotated
+                    self.rotated = 0
+                raise
+            self.rotated = 0
+            if self.journal_path is not None and \
+                    os.path.exists(self.journal_path + '.old'):
+                os.remove(self.journal_path + '.old')
+            self.flushes += 1
+        return True
+
+    def run(self):
+        """Flush loop run by the background thread."""
+        while True:
+            with self.lock:
+                while self.running and not self.pending:
+                    self.changed.wait()
+                if not self.running:
+                    return
+                if self.pending < self.max_pending:
+                    self.changed.wait(self.flush_interval)
+                if not self.running:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error('RosterStore: flushing %s failed: %s',
+                             self.roster_path, e)
+                with self.lock:
+                    self.changed.wait(self.flush_interval)
+
+    def start(self):
+        """Start the background flush thread.
+
+        :return: the started threading.Thread
+        """
+        with self.lock:
+            self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.thread
+
+    def close(self):
+        """Stop the background thread and write any unsaved changes."""
+        with self.lock:
+            self.running = False
+            self.changed.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        with self.lock:
+            pending = self.pending
+        if pending:
+            self.flush()
+        with self.lock:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
@@ -0,0 +1,158 @@
+"""
+.. module:: sample_history
+   :platform: Unix, Windows
+   :synopsis: Defines the fixed size per channel history of samples kept
+   by the NCAP.
+
+.. moduleauthor:: James Ethridge <jeethridge@gmail.com>
+
+"""
+# -*- coding: utf-8 -*-
+import threading
+from array import array
+import ieee1451types as ieee1451
+
+
+class SampleHistory(object):
+    """Ring buffer of the last capacity (timestamp, value) samples of a
+    channel, stored in two preallocated array('d').
+
+    Samples are numbered by a sequence number which keeps growing; sample
+    seq lives at position seq % capacity as long as seq >= first_seq().
+    Timestamps must not decrease, which keeps them sorted for the binary
+    searches of query.
+    """
+
+    def __init__(self, capacity):
+        """Initialize the SampleHistory object.
+
+        :param capacity: the number of samples kept, at least 1
+        """
+        if capacity < 1:
+            raise ValueError('SampleHistory: capacity must be at least 1')
+        self.capacity = capacity
+        self.timestamps = array('d', [0.0]) * capacity
+        self.values = array('d', [0.0]) * capacity
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def first_seq(self):
+        """Return the sequence number of the oldest sample kept."""
+        return max(0, self.total - self.capacity)
+
+    def append(self, timestamp, value):
+        """Store a sample, overwriting the oldest one when full.
+
+        :param timestamp: the time of the sample in seconds since the epoch
+        :param value: the value, samples which are not numbers are skipped
+        :return: True if the sample was stored
+        """
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return False
+        with self.lock:
+            if self.total and \
+                    timestamp < self.timestamps[(self.total - 1) %
+                                                self.capacity]:
+                return False
+            pos = self.total % self.capacity
+            self.timestamps[pos] = timestamp
+            self.values[pos] = value
+            self.total += 1
+        return True
+
+    def _bisect(self, timestamp, right):
+        """Return the sequence number of the first sample later than
+        timestamp (right) or not earlier than timestamp (not right). The
+        lock must be held."""
+        lo = self.first_seq()
+        hi = self.total
+        while lo < hi:
+            mid = (lo + hi) // 2
+            t = self.timestamps[mid % self.capacity]
+            if t < timestamp or (right and t == timestamp):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def query(self, start=None, end=None, last_n=None):
+        """Select the samples of a time range.
+
+        :param start: optional earliest timestamp, in seconds since the
+            epoch
+        :param end: optional latest timestamp
+        :param last_n: optional maximum number of samples, the latest ones
+            are kept
+        :return: a HistoryView of the samples
+        """
+        with self.lock:
+            lo = self.first_seq()
+            hi = self.total
+            if start is not None:
+                lo = self._bisect(start, False)
+            if end is not None:
+                hi = self._bisect(end, True)
+        if last_n is not None:
+            lo = max(lo, hi - last_n)
+        return HistoryView(self, lo, max(lo, hi))
+
+
+class HistoryView(object):
+    """A range of samples of a SampleHistory.
+
+    Nothing is copied until the view is encoded; samples overwritten in
+    the meantime are left out.
+    """
+
+    def __init__(self, history, lo, hi):
+        self.history = history
+        self.lo = lo
+        self.hi = hi
+
+    def __len__(self):
+        return self.hi - self.lo
+
+    def arrays(self):
+        """Return the timestamps and values still in the history as two
+        array('d')."""
+        history = self.history
+        cap = history.capacity
+        with history.lock:
+            lo = max(self.lo, history.first_seq())
+            if lo >= self.hi:
+                return array('d'), array('d')
+            start = lo % cap
+            end = start + (self.hi - lo)
+            if end <= cap:
+                timestamps = history.timestamps[start:end]
+                values = history.values[start:end]
+            else:
+                timestamps = history.timestamps[start:] + \
+                    history.timestamps[:end - cap]
+                values = history.values[start:] + \
+                    history.values[:end - cap]
+        return timestamps, values
+
+    def copy(self):
+        """Return the timestamps and values still in the history as two
+        lists."""
+        timestamps, values = self.arrays()
+        return timestamps.tolist(), values.tolist()
+
+    def to_argument_array(self):
+        """Return the samples as an ArgumentArray holding "samples" and
+        "timestamps" Arguments."""
+        timestamps, values = self.copy()
+        aa = ieee1451.ArgumentArray()
+        aa.put_by_name('samples', ieee1451.Argument(
+                            ieee1451.TypeCode.FLOAT64_ARRAY_TC, values))
+        aa.put_by_name('timestamps', ieee1451.Argument(
+                            ieee1451.TypeCode.FLOAT64_ARRAY_TC, timestamps))
+        return aa
+
+    def serializable(self):
+        """Return the samples in the serializable format of an
+        ArgumentArray"""
+        return self.to_argument_array().serializable()
@@ -0,0 +1,346 @@
+"""
+.. module:: sample_scheduler
+   :platform: Unix, Windows
+   :synopsis: Defines the deadline scheduler and typed sample buffers used
+   by the block data access services.
+
+.. moduleauthor:: James Ethridge <jeethridge@gmail.com>
+
+"""
+# -*- coding: utf-8 -*-
+import threading
+import time
+from array import array
+import ieee1451types as ieee1451
+from timeutil import clock
+
+# time.sleep overshoots by up to a scheduler tick, so the last part of a
+# wait is spent polling the clock, yielding to other threads in between
+SPIN_THRESHOLD = 0.002
+# longest time a cancellable wait goes without checking for cancellation
+CANCEL_POLL_INTERVAL = 0.01
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+CANCELLED = 'cancelled'
+FAILED = 'failed'
+
+
+def wait_until(deadline, cancelled=None):
+    """Block until the monotonic clock reaches deadline.
+
+    :param cancelled: optional threading.Event which ends the wait early
+    :return: False if the wait was cancelled, True otherwise
+    """
+    while True:
+        remaining = deadline - clock()
+        if remaining <= SPIN_THRESHOLD:
+            break
+        if cancelled is None:
+            time.sleep(remaining - SPIN_THRESHOLD)
+            break
+        # Event.wait overshoots badly on python 2, poll it instead
+        if cancelled.is_set():
+            return False
+        time.sleep(min(remaining - SPIN_THRESHOLD, CANCEL_POLL_INTERVAL))
+    while clock() < deadline:
+        if cancelled is not None and cancelled.is_set():
+            return False
+        time.sleep(0)
+    return True
+
+
+def start_deadline(start_time):
+    """Convert a TimeInstance start time to a monotonic clock deadline.
+
+    :param start_time: the TimeInstance at which to start, None or
+        secs == 0, nsecs == 0 mean start immediately
+    :return: the deadline on the clock() time scale
+    """
+    now = clock()
+    if start_time is None:
+        return now
+    start = start_time.total_seconds()
+    if start == 0:
+        return now
+    return now + max(0.0, start - time.time())
+
+
+def sample_value(result):
+    """Extract the reading from a read_data result.
+
+    :param result: the "result" of TransducerAccess.read_data, usually an
+        ArgumentArray holding a "result" Argument
+    :return: the value of the reading
+    """
+    if isinstance(result, ieee1451.ArgumentArray):
+        if 'result' in result.indicies:
+            return result.get_by_name('result').value
+        return result.get_by_index(0).value
+    return result
+
+
+def block_values(sample_data):
+    """Extract the list of values to write from block sample data.
+
+    :param sample_data: an ArgumentArray holding a "samples" Argument, or
+        the values at index 0, or the values themselves
+    :return: a tuple of the values and the TypeCode of a single value
+    """
+    tc = ieee1451.TypeCode.UNKNOWN_TC
+    if isinstance(sample_data, ieee1451.ArgumentArray):
+        if 'samples' in sample_data.indicies:
+            arg = sample_data.get_by_name('samples')
+        else:
+            arg = sample_data.get_by_index(0)
+        if arg.type_code == ieee1451.TypeCode.FLOAT64_ARRAY_TC:
+            tc = ieee1451.TypeCode.FLOAT64_TC
+        sample_data = arg.value
+    return list(sample_data), tc
+
+
+def none_if_nan(value):
+    """Map the NaN marking an empty slot to None for the response."""
+    if value != value:
+        return None
+    return value
+
+
+class SampleBuffer(object):
+    """Preallocated buffer of samples and their timestamps.
+
+    Samples are stored in a typed array('d') as long as they are numbers;
+    the buffer switches to a list when the first non numeric sample is
+    stored. Each sample keeps the index of the scheduled sample it was
+    taken for, see aligned.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.count = 0
+        self.dropped = 0
+        self.values = array('d', [0.0]) * size
+        self.timestamps = array('d', [0.0]) * size
+        self.indices = array('l', [0]) * size
+
+    def put(self, value, timestamp, index=None):
+        """Append a sample taken at timestamp (seconds since the epoch).
+
+        :param index: the index k of the scheduled sample, defaults to the
+            position of the sample in the buffer
+        """
+        if isinstance(self.values, array):
+            try:
+                self.values[self.count] = value
+            except TypeError:
+                self.values = self.values.tolist()
+                self.values[self.count] = value
+        else:
+            self.values[self.count] = value
+        self.timestamps[self.count] = timestamp
+        self.indices[self.count] = self.count if index is None else index
+        self.count += 1
+
+    def aligned(self, size):
+        """Place the samples in the slots of their scheduled indices.
+
+        Slots are given by the index passed to put, never by timestamp, so
+        a late sample cannot shift the samples after it. Samples whose
+        index is outside the slots, or already filled, are counted in the
+        dropped attribute of the result. Empty slots hold NaN, or None once
+        the buffer holds non numeric samples.
+
+        :param size: the number of slots
+        :return: a SampleBuffer with size slots, its timestamps holding the
+            actual time each sample was taken
+        """
+        out = SampleBuffer(0)
+        out.size = size
+        empty = float('nan')
+        out.timestamps = array('d', [empty]) * size
+        if isinstance(self.values, array):
+            out.values = array('d', [empty]) * size
+        else:
+            out.values = [None] * size
+        filled = [False] * size
+        for i in range(self.count):
+            slot = self.indices[i]
+            if slot < 0 or slot >= size or filled[slot]:
+                out.dropped += 1
+                continue
+            filled[slot] = True
+            out.values[slot] = self.values[i]
+            out.timestamps[slot] = self.timestamps[i]
+        out.count = size
+        return out
+
+    def to_argument_array(self):
+        """Return the samples and timestamps stored so far as an
+        ArgumentArray holding "samples" and "timestamps" Arguments."""
+        values = [none_if_nan(v) for v in self.values[:self.count]]
+        timestamps = [none_if_nan(t) for t in self.timestamps[:self.count]]
+        if isinstance(self.values, array):
+            tc = ieee1451.TypeCode.FLOAT64_ARRAY_TC
+        else:
+            tc = ieee1451.TypeCode.UNKNOWN_TC
+        aa = ieee1451.ArgumentArray()
+        aa.put_by_name('samples', ieee1451.Argument(tc, values))
+        aa.put_by_name('timestamps', ieee1451.Argument(
+                            ieee1451.TypeCode.FLOAT64_ARRAY_TC, timestamps))
+        return aa
+
+
+class TimingStats(object):
+    """Accumulates how late scheduled actions started."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.max_lateness = 0.0
+
+    def record(self, lateness):
+        """Record the lateness of an action in seconds."""
+        self.count += 1
+        self.total += lateness
+        self.total_sq += lateness * lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+
+    def serializable(self):
+        """Return the count, mean and maximum lateness and the jitter
+        (standard deviation of the lateness) in seconds."""
+        mean = self.total / self.count if self.count else 0.0
+        variance = self.total_sq / self.count - mean * mean \
+            if self.count else 0.0
+        return {'count': self.count,
+                'mean_lateness': mean,
+                'max_lateness': self.max_lateness,
+                'jitter': max(0.0, variance) ** 0.5}
+
+
+class DeadlineScheduler(object):
+    """Runs an action at fixed intervals from a start deadline.
+
+    The deadline of sample k is start + k * interval, computed from the
+    start rather than from the previous sample, so the time spent in the
+    action and any sleep overshoot never accumulate. A sample whose
+    deadline has already passed runs at once; when it is more than one
+    interval late it is counted as an overrun.
+    """
+
+    def __init__(self, interval, start=None):
+        """Initialize the DeadlineScheduler object.
+
+        :param interval: the interval between samples in seconds
+        :param start: the clock() deadline of the first sample, defaults to
+            now
+        """
+        self.interval = interval
+        self.start = clock() if start is None else start
+        self.overruns = 0
+        self.stats = TimingStats()
+        # maps clock() readings to seconds since the epoch
+        self.epoch_offset = time.time() - clock()
+
+    def deadline(self, k):
+        """Return the deadline of sample k."""
+        return self.start + k * self.interval
+
+    def now(self):
+        """Return the current time in seconds since the epoch."""
+        return clock() + self.epoch_offset
+
+    def wait(self, k, cancelled=None):
+        """Wait for the deadline of sample k.
+
+        :param cancelled: optional threading.Event which ends the wait early
+        :return: the time the wait ended in seconds since the epoch, None if
+            the wait was cancelled
+        """
+        deadline = self.deadline(k)
+        if clock() > deadline + self.interval:
+            self.overruns += 1
+        if not wait_until(deadline, cancelled):
+            return None
+        now = clock()
+        self.stats.record(now - deadline)
+        return now + self.epoch_offset
+
+
+class ScheduledOperation(object):
+    """A block operation running on its own thread.
+
+    target is called as target(operation) on the thread; it reports its
+    progress through completed and error_code, stores the scheduler whose
+    timing statistics are reported in scheduler and should stop once
+    cancelled is set.
+    """
+
+    def __init__(self, operation_id, target, total=0):
+        """Initialize the ScheduledOperation object.
+
+        :param operation_id: the ID of the operation
+        :param target: callable running the operation
+        :param total: the number of steps of the operation
+        """
+        self.operation_id = operation_id
+        self.target = target
+        self.total = total
+        self.completed = 0
+        self.state = PENDING
+        self.error_code = ieee1451.Error(
+                            ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                            ieee1451.ErrorCode.NO_ERROR)
+        self.scheduler = None
+        self.cancelled = threading.Event()
+        self.finished = threading.Event()
+        self.thread = None
+
+    def run(self):
+        """Run the operation, called by the operation thread."""
+        self.state = RUNNING
+        try:
+            self.target(self)
+        except Exception:
+            self.error_code = ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                ieee1451.ErrorCode.NETWORK_FAILURE)
+        if self.cancelled.is_set():
+            self.state = CANCELLED
+        elif getattr(self.error_code, 'code', None) not in \
+                (None, ieee1451.ErrorCode.NO_ERROR):
+            self.state = FAILED
+        else:
+            self.state = DONE
+        self.finished.set()
+
+    def start(self):
+        """Start the operation thread.
+
+        :return: the started threading.Thread
+        """
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.thread
+
+    def cancel(self):
+        """Ask the operation to stop.
+
+        :return: False if the operation had already finished
+        """
+        if self.finished.is_set():
+            return False
+        self.cancelled.set()
+        return True
+
+    def status(self):
+        """Return a dictionary containing the state, the number of completed
+        and total steps and the timing statistics of the operation."""
+        stats = TimingStats() if self.scheduler is None \
+            else self.scheduler.stats
+        return {'state': self.state,
+                'completed': self.completed,
+                'total': self.total,
+                'timing': stats.serializable()}
@@ -0,0 +1,244 @@
+"""
+.. module:: sensor_alerts
+   :platform: Unix, Windows
+   :synopsis: Defines the threshold engine behind the sensor alert
+   subscriptions of the NCAP.
+
+.. moduleauthor:: James Ethridge <jeethridge@gmail.com>
+
+"""
+# -*- coding: utf-8 -*-
+import bisect
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+NORMAL = 'normal'
+HIGH = 'high'
+LOW = 'low'
+
+
+class AlertRule(object):
+    """Defines a min / max threshold of a subscriber on a channel.
+
+    A value above maximum moves the rule to HIGH and a value below minimum
+    to LOW. The rule returns to NORMAL once the value is back inside the
+    thresholds by at least hysteresis, so a noisy value hovering at a
+    threshold does not flood the subscriber with alerts.
+    """
+
+    def __init__(self, subscription_id, client_id, tim_id, channel_id,
+                 minimum=None, maximum=None, hysteresis=0.0):
+        self.subscription_id = subscription_id
+        self.client_id = client_id
+        self.tim_id = tim_id
+        self.channel_id = channel_id
+        self.minimum = minimum
+        self.maximum = maximum
+        self.hysteresis = hysteresis
+        self.state = NORMAL
+
+    def points(self):
+        """Return the values at which the state of the rule can change."""
+        points = []
+        if self.maximum is not None:
+            points.extend([self.maximum, self.maximum - self.hysteresis])
+        if self.minimum is not None:
+            points.extend([self.minimum, self.minimum + self.hysteresis])
+        return points
+
+    def next_state(self, value):
+        """Return the state of the rule after value."""
+        if self.state == HIGH:
+            if self.minimum is not None and value < self.minimum:
+                return LOW
+            if value <= self.maximum - self.hysteresis:
+                return NORMAL
+            return HIGH
+        if self.state == LOW:
+            if self.maximum is not None and value > self.maximum:
+                return HIGH
+            if value >= self.minimum + self.hysteresis:
+                return NORMAL
+            return LOW
+        if self.maximum is not None and value > self.maximum:
+            return HIGH
+        if self.minimum is not None and value < self.minimum:
+            return LOW
+        return NORMAL
+
+    def alert(self, value):
+        """Return the alert sent when the rule changes state."""
+        return {'subscription_id': self.subscription_id,
+                'tim_id': self.tim_id,
+                'channel_id': self.channel_id,
+                'state': self.state,
+                'value': value,
+                'minimum': self.minimum,
+                'maximum': self.maximum}
+
+
+class ChannelAlerts(object):
+    """The rules of a channel and the sorted values at which they can
+    change state.
+
+    A rule can only change state when a new value lies on the other side
+    of one of its points than the previous value, so only the rules with a
+    point between the two values are evaluated. Finding them is a binary
+    search in the sorted points, which keeps a sample cheap however many
+    rules the channel has.
+    """
+
+    def __init__(self):
+        self.rules = {}
+        self.points = []
+        self.keys = []
+        self.last_value = None
+
+    def add(self, rule):
+        """Add a rule, its state set from the last value."""
+        if self.last_value is not None:
+            rule.state = rule.next_state(self.last_value)
+        self.rules[rule.subscription_id] = rule
+        for value in rule.points():
+            point = (value, rule.subscription_id)
+            idx = bisect.bisect_left(self.points, point)
+            self.points.insert(idx, point)
+            self.keys.insert(idx, value)
+
+    def remove(self, subscription_id):
+        """Remove a rule.
+
+        :return: the removed AlertRule or None
+        """
+        rule = self.rules.pop(subscription_id, None)
+        if rule is not None:
+            for value in rule.points():
+                idx = bisect.bisect_left(self.points,
+                                         (value, subscription_id))
+                del self.points[idx]
+                del self.keys[idx]
+        return rule
+
+    def candidates(self, value):
+        """Return the rules which may change state with value."""
+        if self.last_value is None:
+            return self.rules.values()
+        low, high = sorted((self.last_value, value))
+        start = bisect.bisect_left(self.keys, low)
+        end = bisect.bisect_right(self.keys, high)
+        ids = set(p[1] for p in self.points[start:end])
+        return [self.rules[i] for i in ids]
+
+
+class AlertEngine(object):
+    """Evaluates the sensor alert rules of every channel.
+
+    Values are passed to feed, whether from single reads, a sampler or a
+    measurement stream. Only state changes are reported, as
+    sender(client_id, alert) for each rule which changed.
+    """
+
+    def __init__(self):
+        """Initialize the AlertEngine object."""
+        self.channels = {}
+        self.next_subscription_id = 1
+        self.sender = None
+        self.lock = threading.Lock()
+        # held while a value is evaluated and its alerts sent so every
+        # subscriber gets the alerts in order
+        self.publish_lock = threading.Lock()
+
+    def add_rule(self, client_id, tim_id, channel_id, minimum=None,
+                 maximum=None, hysteresis=0.0):
+        """Add a threshold rule.
+
+        :param client_id: the subscriber passed to the sender
+        :param minimum: optional lower threshold
+        :param maximum: optional upper threshold
+        :param hysteresis: the distance a value has to move back inside a
+            threshold before the rule returns to NORMAL
+        :return: the new AlertRule
+        """
+        with self.lock:
+            rule = AlertRule(self.next_subscription_id, client_id, tim_id,
+                             channel_id, minimum, maximum, abs(hysteresis))
+            self.next_subscription_id += 1
+            key = (tim_id, channel_id)
+            self.channels.setdefault(key, ChannelAlerts()).add(rule)
+        return rule
+
+    def remove_rule(self, subscription_id, client_id=None):
+        """Remove a rule.
+
+        :param client_id: optional client the rule must belong to
+        :return: the removed AlertRule or None
+        """
+        with self.lock:
+            for key, channel in self.channels.items():
+                rule = channel.rules.get(subscription_id)
+                if rule is None:
+                    continue
+                if client_id is not None and rule.client_id != client_id:
+                    return None
+                channel.remove(subscription_id)
+                if not channel.rules:
+                    del self.channels[key]
+                return rule
+        return None
+
+    def remove_client(self, client_id):
+        """Remove every rule of a client.
+
+        :param client_id: the client, a bare JID also removes the rules of
+            the resources of that JID
+        :return: the list of removed AlertRule
+        """
+        prefix = client_id + '/'
+        with self.lock:
+            ids = [r.subscription_id for c in self.channels.values()
+                   for r in c.rules.values()
+                   if r.client_id == client_id or
+                   str(r.client_id).startswith(prefix)]
+        return [r for r in map(self.remove_rule, ids) if r is not None]
+
+    def has_rules(self, tim_id, channel_id):
+        """Return True if a channel has rules."""
+        return (tim_id, channel_id) in self.channels
+
+    def feed(self, tim_id, channel_id, value):
+        """Evaluate the rules of a channel against a new value.
+
+        :return: the list of (client_id, alert) sent
+        """
+        if (tim_id, channel_id) not in self.channels:
+            return []
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return []
+        if value != value:
+            return []
+
+        alerts = []
+        with self.publish_lock:
+            with self.lock:
+                channel = self.channels.get((tim_id, channel_id))
+                if channel is None:
+                    return alerts
+                for rule in channel.candidates(value):
+                    state = rule.next_state(value)
+                    if state != rule.state:
+                        rule.state = state
+                        alerts.append((rule.client_id, rule.alert(value)))
+                channel.last_value = value
+                sender = self.sender
+            if sender is not None:
+                for client_id, alert in alerts:
+                    try:
+                        sender(client_id, alert)
+                    except Exception as e:
+                        logger.error('AlertEngine: sending to %s failed: %s',
+                                     client_id, e)
+        return alerts
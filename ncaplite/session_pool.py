@@ -0,0 +1,277 @@
+"""
+.. module:: session_pool
+   :platform: Unix, Windows
+   :synopsis: Defines a pool of open transducer communication sessions
+   (trans_comm_ids) shared by the NCAP services.
+
+.. moduleauthor:: James Ethridge <jeethridge@gmail.com>
+
+"""
+# -*- coding: utf-8 -*-
+import threading
+import ieee1451types as ieee1451
+from timeutil import clock
+
+# errors after which a session is closed instead of being reused
+BROKEN_SESSION_ERRORS = (ieee1451.ErrorCode.INVALID_COMMID,
+                         ieee1451.ErrorCode.NETWORK_FAILURE,
+                         ieee1451.ErrorCode.NETWORK_CORRUPTION,
+                         ieee1451.ErrorCode.LOCK_BROKEN)
+
+
+class PooledSession(object):
+    """Book-keeping for a single open trans_comm_id."""
+
+    def __init__(self, tim_id, channel_id, trans_comm_id):
+        self.tim_id = tim_id
+        self.channel_id = channel_id
+        self.trans_comm_id = trans_comm_id
+        self.last_used = clock()
+        self.last_checked = self.last_used
+
+
+class SessionPool(object):
+    """Pool of trans_comm_ids kept open per (tim_id, channel_id).
+
+    acquire hands out an idle session of the channel or opens a new one and
+    release returns it for reuse, so repeated requests skip the open and
+    close handshakes. A session is used by one request at a time.
+
+    At most max_open_per_tim sessions are open on a TIM; acquire waits for
+    one to be released, or closes an idle session of another channel of
+    the TIM, when the limit is reached, giving up after acquire_timeout
+    seconds. Sessions idle for longer than idle_timeout seconds are closed
+    by an eviction thread started when the first session is released.
+    When a health_check callable is given, idle sessions not checked for
+    check_interval seconds are checked before they are handed out and
+    closed if the check fails.
+    """
+
+    def __init__(self, transducer_access, max_open_per_tim=4,
+                 idle_timeout=60.0, health_check=None, check_interval=10.0,
+                 acquire_timeout=30.0):
+        """Initialize the SessionPool object.
+
+        :param transducer_access: the TransducerAccess object used to open
+            and close sessions
+        :param max_open_per_tim: maximum number of open sessions per TIM
+        :param idle_timeout: seconds after which an idle session is closed,
+            None keeps idle sessions open
+        :param health_check: optional callable taking a trans_comm_id and
+            returning True if the session is usable
+        :param check_interval: seconds between health checks of a session
+        :param acquire_timeout: default seconds acquire waits for a session,
+            None waits forever
+        """
+        self.transducer_access = transducer_access
+        self.max_open_per_tim = max_open_per_tim
+        self.idle_timeout = idle_timeout
+        self.health_check = health_check
+        self.check_interval = check_interval
+        self.acquire_timeout = acquire_timeout
+        self.idle = {}
+        self.in_use = {}
+        self.open_count = {}
+        self.closed = False
+        self.lock = threading.Lock()
+        self.released = threading.Condition(self.lock)
+        self.eviction_stopped = threading.Event()
+        self.eviction_thread = None
+
+    def _close(self, session):
+        """Close a session which is no longer counted by the pool."""
+        try:
+            self.transducer_access.close(session.trans_comm_id)
+        except Exception:
+            pass
+
+    def _forget(self, tim_id):
+        """Drop a session of a TIM from the open count, the lock must be
+        held."""
+        self.open_count[tim_id] -= 1
+        if not self.open_count[tim_id]:
+            del self.open_count[tim_id]
+        self.released.notify_all()
+
+    def _take_idle(self, key, now):
+        """Pop an idle session of a channel, closing expired ones. The lock
+        must be held; returns the session and the sessions to close."""
+        expired = []
+        idle = self.idle.get(key)
+        while idle:
+            session = idle.pop()
+            if self.idle_timeout is not None and \
+                    now - session.last_used > self.idle_timeout:
+                self._forget(session.tim_id)
+                expired.append(session)
+                continue
+            return session, expired
+        return None, expired
+
+    def _steal_idle(self, tim_id):
+        """Remove the least recently used idle session of another channel of
+        a TIM to make room for a new one. The lock must be held."""
+        oldest = None
+        for key, idle in self.idle.items():
+            if key[0] == tim_id and idle and \
+                    (oldest is None or idle[0].last_used < oldest.last_used):
+                oldest = idle[0]
+        if oldest is None:
+            return None
+        self.idle[(oldest.tim_id, oldest.channel_id)].remove(oldest)
+        self._forget(oldest.tim_id)
+        return oldest
+
+    def acquire(self, tim_id, channel_id, timeout=None):
+        """Borrow a session for a channel.
+
+        :param tim_id: the TIM ID
+        :param channel_id: the Transducer Channel ID
+        :param timeout: optional seconds to wait when the TIM has
+            max_open_per_tim sessions in use, defaults to acquire_timeout
+        :return: a dictionary containing:
+            error_code: an ErrorCode object
+            trans_comm_id: the session to pass to release
+        """
+        key = (tim_id, channel_id)
+        if timeout is None:
+            timeout = self.acquire_timeout
+        deadline = None if timeout is None else clock() + timeout
+        to_close = []
+        with self.lock:
+            while True:
+                now = clock()
+                session, expired = self._take_idle(key, now)
+                to_close.extend(expired)
+                if session is not None:
+                    break
+                if self.open_count.get(tim_id, 0) < self.max_open_per_tim:
+                    self.open_count[tim_id] = \
+                        self.open_count.get(tim_id, 0) + 1
+                    break
+                stolen = self._steal_idle(tim_id)
+                if stolen is not None:
+                    to_close.append(stolen)
+                    continue
+                if deadline is not None and now >= deadline:
+                    error = ieee1451.Error(
+                            ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                            ieee1451.ErrorCode.NETWORK_RESOURCE_EXCEEDED)
+                    session = False
+                    break
+                self.released.wait(None if deadline is None
+                                   else deadline - now)
+
+        for expired in to_close:
+            self._close(expired)
+
+        if session is False:
+            return {'error_code': error, 'trans_comm_id': None}
+
+        if session is not None and self.health_check is not None and \
+                clock() - session.last_checked >= self.check_interval:
+            healthy = False
+            try:
+                healthy = self.health_check(session.trans_comm_id)
+            except Exception:
+                pass
+            if not healthy:
+                self._close(session)
+                session = None
+            else:
+                session.last_checked = clock()
+
+        if session is None:
+            try:
+                opened = self.transducer_access.open(tim_id, channel_id)
+            except Exception:
+                with self.lock:
+                    self._forget(tim_id)
+                raise
+            error = opened['error_code']
+            if getattr(error, 'code', ieee1451.ErrorCode.NO_ERROR) != \
+                    ieee1451.ErrorCode.NO_ERROR:
+                with self.lock:
+                    self._forget(tim_id)
+                return opened
+            session = PooledSession(tim_id, channel_id,
+                                    opened['trans_comm_id'])
+
+        with self.lock:
+            self.in_use[session.trans_comm_id] = session
+        error = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                               ieee1451.ErrorCode.NO_ERROR)
+        return {'error_code': error, 'trans_comm_id': session.trans_comm_id}
+
+    def release(self, trans_comm_id, error=None):
+        """Return a borrowed session to the pool.
+
+        :param trans_comm_id: the session returned by acquire
+        :param error: optional ErrorCode object of the last operation on the
+            session; sessions broken by the error are closed
+        """
+        with self.lock:
+            session = self.in_use.pop(trans_comm_id, None)
+            if session is None:
+                return
+            broken = self.closed or \
+                getattr(error, 'code', None) in BROKEN_SESSION_ERRORS
+            if broken:
+                self._forget(session.tim_id)
+            else:
+                session.last_used = clock()
+                key = (session.tim_id, session.channel_id)
+                self.idle.setdefault(key, []).append(session)
+                self.released.notify_all()
+                self._start_eviction()
+        if broken:
+            self._close(session)
+
+    def _start_eviction(self):
+        """Start the eviction thread if needed, the lock must be held."""
+        if self.eviction_thread is None and self.idle_timeout is not None:
+            self.eviction_thread = threading.Thread(target=self.run_eviction)
+            self.eviction_thread.daemon = True
+            self.eviction_thread.start()
+
+    def run_eviction(self):
+        """Eviction loop run by the background thread: closes the expired
+        idle sessions every idle_timeout seconds until the pool is
+        closed."""
+        while not self.eviction_stopped.wait(self.idle_timeout):
+            self.evict_idle()
+
+    def evict_idle(self):
+        """Close every session idle for longer than idle_timeout.
+
+        :return: the number of sessions closed
+        """
+        if self.idle_timeout is None:
+            return 0
+        now = clock()
+        expired = []
+        with self.lock:
+            for key, idle in self.idle.items():
+                keep = [s for s in idle
+                        if now - s.last_used <= self.idle_timeout]
+                for session in idle:
+                    if now - session.last_used > self.idle_timeout:
+                        self._forget(session.tim_id)
+                        expired.append(session)
+                self.idle[key] = keep
+        for session in expired:
+            self._close(session)
+        return len(expired)
+
+    def close_all(self):
+        """Close every idle session. Sessions in use are closed when they
+        are released."""
+        with self.lock:
+            sessions = [s for idle in self.idle.values() for s in idle]
+            self.idle = {}
+            for session in sessions:
+                self._forget(session.tim_id)
+            self.closed = True
+        self.eviction_stopped.set()
+        for session in sessions:
+            self._close(session)
@@ -0,0 +1,343 @@
+"""
+.. module:: stream_manager
+   :platform: Unix, Windows
+   :synopsis: Defines the subscription manager which shares backend
+   measurement streams between the clients of the NCAP.
+
+.. moduleauthor:: James Ethridge <jeethridge@gmail.com>
+
+"""
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import ieee1451types as ieee1451
+import transducer_services_base
+from timeutil import clock
+
+logger = logging.getLogger(__name__)
+
+
+class StreamSubscriber(object):
+    """Defines a client subscribed to a stream and its pending batch."""
+
+    def __init__(self, client_id, batch_size=1, max_latency=None):
+        self.client_id = client_id
+        self.batch_size = max(1, batch_size)
+        self.max_latency = max_latency
+        self.pending = []
+        self.first_pending = None
+
+    def add(self, meas_values):
+        """Queue a measurement.
+
+        :return: the batch to send if it is full, otherwise None
+        """
+        if not self.pending:
+            self.first_pending = clock()
+        self.pending.append(meas_values)
+        if len(self.pending) >= self.batch_size:
+            return self.take()
+        return None
+
+    def take(self):
+        """Remove and return the pending batch."""
+        batch = self.pending
+        self.pending = []
+        self.first_pending = None
+        return batch
+
+    def due(self, now):
+        """Return True if the pending batch has waited max_latency."""
+        return self.pending and self.max_latency is not None and \
+            now - self.first_pending >= self.max_latency
+
+
+class Stream(object):
+    """Defines a backend measurement stream of a channel."""
+
+    def __init__(self, tim_id, channel_id, trans_comm_id, operation_id):
+        self.tim_id = tim_id
+        self.channel_id = channel_id
+        self.trans_comm_id = trans_comm_id
+        self.operation_id = operation_id
+        self.subscribers = {}
+
+
+class StreamManager(transducer_services_base.ApiCallbackBase):
+    """Shares one backend measurement stream per channel between clients.
+
+    The first subscriber of a channel opens a session and starts a stream
+    on it with TransducerAccess.start_stream, passing this object as the
+    AppCallback. Every measurement_update is queued for each subscriber of
+    the stream and sent as sender(client_id, tim_id, channel_id, batch)
+    once batch_size measurements are queued, or by the flush thread
+    max_latency seconds after the first of them. The stream is
+    cancelled and its session closed when the last subscriber leaves.
+
+    Subscribers within the NCAP register their own sender in
+    local_senders under their client_id.
+    """
+
+    def __init__(self, transducer_access=None, flush_interval=0.05):
+        """Initialize the StreamManager object.
+
+        :param transducer_access: the TransducerAccess object providing
+            the streams
+        :param flush_interval: seconds between checks for batches which
+            reached their max_latency
+        """
+        self.transducer_access = transducer_access
+        self.flush_interval = flush_interval
+        self.sender = None
+        # senders of subscribers inside the NCAP, keyed by client_id
+        self.local_senders = {}
+        self.streams = {}
+        self.by_operation = {}
+        self.next_operation_id = 1
+        self.lock = threading.Lock()
+        # serializes starting and stopping streams
+        self.control_lock = threading.Lock()
+        # held while batches are taken and sent so each subscriber gets
+        # the measurements in order
+        self.send_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def _send(self, batches):
+        """Send batches of (client_id, tim_id, channel_id, batch), the send
+        lock must be held."""
+        for client_id, tim_id, channel_id, batch in batches:
+            sender = self.local_senders.get(client_id, self.sender)
+            if sender is None:
+                continue
+            try:
+                sender(client_id, tim_id, channel_id, batch)
+            except Exception as e:
+                logger.error('StreamManager: sending to %s failed: %s',
+                             client_id, e)
+
+    def _start_stream(self, tim_id, channel_id):
+        """Open a session and start a backend stream on it, the control
+        lock must be held.
+
+        :return: the error code and the started Stream or None
+        """
+        opened = self.transducer_access.open(tim_id, channel_id)
+        error = opened['error_code']
+        if getattr(error, 'code', ieee1451.ErrorCode.NO_ERROR) != \
+                ieee1451.ErrorCode.NO_ERROR:
+            return error, None
+        trans_comm_id = opened['trans_comm_id']
+
+        with self.lock:
+            operation_id = self.next_operation_id
+            self.next_operation_id += 1
+            stream = Stream(tim_id, channel_id, trans_comm_id, operation_id)
+            # updates may arrive before start_stream returns
+            self.by_operation[operation_id] = stream
+
+        try:
+            started = self.transducer_access.start_stream(trans_comm_id,
+                                                          self, operation_id)
+        except Exception:
+            with self.lock:
+                del self.by_operation[operation_id]
+            self.transducer_access.close(trans_comm_id)
+            raise
+        error = started['error_code']
+        if getattr(error, 'code', ieee1451.ErrorCode.NO_ERROR) != \
+                ieee1451.ErrorCode.NO_ERROR:
+            with self.lock:
+                del self.by_operation[operation_id]
+            self.transducer_access.close(trans_comm_id)
+            return error, None
+
+        backend_id = started.get('operation_id')
+        with self.lock:
+            if backend_id and backend_id != operation_id:
+                stream.operation_id = backend_id
+                self.by_operation[backend_id] = stream
+        return error, stream
+
+    def _stop_stream(self, stream):
+        """Cancel a backend stream and close its session."""
+        with self.lock:
+            for operation_id in [k for k, s in self.by_operation.items()
+                                 if s is stream]:
+                del self.by_operation[operation_id]
+        try:
+            self.transducer_access.cancel(stream.operation_id)
+        finally:
+            self.transducer_access.close(stream.trans_comm_id)
+
+    def subscribe(self, client_id, tim_id, channel_id, batch_size=1,
+                  max_latency=None):
+        """Subscribe a client to the measurements of a channel. A client
+        already subscribed to the channel has its pending batch sent and
+        its batch_size and max_latency replaced.
+
+        :param client_id: the subscriber passed to the sender
+        :param batch_size: the number of measurements sent at once
+        :param max_latency: optional seconds after which a partial batch
+            is sent
+        :return: a dictionary containing:
+            error_code: an ErrorCode object
+            operation_id: the operation ID of the stream
+        """
+        error = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                               ieee1451.ErrorCode.NO_ERROR)
+        key = (tim_id, channel_id)
+        with self.control_lock:
+            with self.lock:
+                stream = self.streams.get(key)
+            if stream is None:
+                error, stream = self._start_stream(tim_id, channel_id)
+                if stream is None:
+                    return {'error_code': error, 'operation_id': None}
+            with self.send_lock:
+                with self.lock:
+                    self.streams[key] = stream
+                    previous = stream.subscribers.get(client_id)
+                    stream.subscribers[client_id] = StreamSubscriber(
+                                        client_id, batch_size, max_latency)
+                # a client subscribing again gets the measurements queued
+                # under its previous subscription first
+                if previous is not None and previous.pending:
+                    self._send([(client_id, tim_id, channel_id,
+                                 previous.take())])
+            if max_latency is not None and self.thread is None:
+                self.start()
+        return {'error_code': error, 'operation_id': stream.operation_id}
+
+    def unsubscribe(self, client_id, tim_id, channel_id):
+        """Unsubscribe a client from a channel, sending its pending batch.
+        The stream is stopped when its last subscriber leaves.
+
+        :return: True if the client was subscribed
+        """
+        key = (tim_id, channel_id)
+        with self.control_lock:
+            with self.send_lock:
+                with self.lock:
+                    stream = self.streams.get(key)
+                    if stream is None or \
+                            client_id not in stream.subscribers:
+                        return False
+                    subscriber = stream.subscribers.pop(client_id)
+                    if not stream.subscribers:
+                        del self.streams[key]
+                    else:
+                        stream = None
+                if subscriber.pending:
+                    self._send([(client_id, tim_id, channel_id,
+                                 subscriber.take())])
+            if stream is not None:
+                self._stop_stream(stream)
+        return True
+
+    def unsubscribe_client(self, client_id):
+        """Unsubscribe a client from every channel, e.g. when it leaves.
+
+        :param client_id: the subscriber, a bare JID also unsubscribes the
+            resources of that JID
+        :return: the number of subscriptions removed
+        """
+        prefix = client_id + '/'
+        with self.lock:
+            subscriptions = [(c, k) for k, s in self.streams.items()
+                             for c in s.subscribers
+                             if c == client_id or str(c).startswith(prefix)]
+        return len([k for c, k in subscriptions
+                    if self.unsubscribe(c, *k)])
+
+    def subscriptions(self):
+        """Return a dictionary mapping (tim_id, channel_id) to the list of
+        subscribed clients."""
+        with self.lock:
+            return dict((k, sorted(s.subscribers))
+                        for k, s in self.streams.items())
+
+    def measurement_update(self, operation_id, meas_values, status):
+        """Queue a stream measurement for every subscriber of the stream.
+        Called by the IEEE 1451.0 layer."""
+        with self.send_lock:
+            batches = []
+            with self.lock:
+                stream = self.by_operation.get(operation_id)
+                if stream is not None and meas_values is not None:
+                    for subscriber in stream.subscribers.values():
+                        batch = subscriber.add(meas_values)
+                        if batch is not None:
+                            batches.append((subscriber.client_id,
+                                            stream.tim_id,
+                                            stream.channel_id, batch))
+            self._send(batches)
+        return {'error_code': ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                ieee1451.ErrorCode.NO_ERROR)}
+
+    def flush_due(self):
+        """Send the partial batches which reached their max_latency.
+
+        :return: the number of batches sent
+        """
+        with self.send_lock:
+            now = clock()
+            batches = []
+            with self.lock:
+                for stream in self.streams.values():
+                    for subscriber in stream.subscribers.values():
+                        if subscriber.due(now):
+                            batches.append((subscriber.client_id,
+                                            stream.tim_id,
+                                            stream.channel_id,
+                                            subscriber.take()))
+            self._send(batches)
+        return len(batches)
+
+    def run(self):
+        """Flush loop run by the background thread."""
+        while not self.stopped.wait(self.flush_interval):
+            self.flush_due()
+
+    def start(self):
+        """Start the background flush thread.
+
+        :return: the started threading.Thread
+        """
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        """Stop the background flush thread."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def actuation_complete(self, operation_id, status):
+        """Not used by streams."""
+        return {'error_code': ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                ieee1451.ErrorCode.NO_ERROR)}
+
+    def status_change(self, operation_id, status):
+        """Not used by streams."""
+        return {'error_code': ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                ieee1451.ErrorCode.NO_ERROR)}
+
+    def command_complete(self, operation_id, out_args, status):
+        """Not used by streams."""
+        return {'error_code': ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                ieee1451.ErrorCode.NO_ERROR)}
+
+    def trigger_complete(self, operation_id, status):
+        """Not used by streams."""
+        return {'error_code': ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                ieee1451.ErrorCode.NO_ERROR)}
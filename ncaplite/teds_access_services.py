@@ -7,8 +7,12 @@
 
 """
 # -*- coding: utf-8 -*-
+import threading
 import ieee1451types as ieee1451
+import binary_teds
 import teds_support
+import teds_cache
+import worker_pool
 
 class TEDSAccessServices(object):
 
@@ -16,88 +20,421 @@ class TEDSAccessServices(object):
         """Initialize the TEDSAccessServices object."""
         self.transducer_access = None
         self.teds_manager = None
+        self.teds_cache = teds_cache.TEDSCache()
+        # TEDS read from files instead of the TIMs, e.g. virtual TEDS
+        self.teds_repository = None
+        self.tim_discovery = None
+        self.max_workers = 8
+        self.session_pool = None
 
     def register_transducer_access_service(self, transducer_access):
         """Register an object that implements the TransducerAccess interface with the TEDSAccessService"""
         self.transducer_access = transducer_access
 
+    def register_session_pool(self, session_pool):
+        """Register a session_pool.SessionPool object with the
+        TEDSAccessServices object. Sessions are then borrowed from the
+        pool instead of being opened and closed for every request."""
+        self.session_pool = session_pool
+
+    def open_session(self, tim_id, channel_id):
+        """Open a session to a channel, or borrow one from the session pool.
+
+        :return: a dictionary containing error_code and trans_comm_id
+        """
+        if self.session_pool is not None:
+            return self.session_pool.acquire(tim_id, channel_id)
+        return self.transducer_access.open(tim_id, channel_id)
+
+    def close_session(self, trans_comm_id, error=None):
+        """Close a session opened by open_session, or return it to the
+        session pool.
+
+        :param error: the ErrorCode object of the last operation on the
+            session
+        """
+        if self.session_pool is not None:
+            self.session_pool.release(trans_comm_id, error)
+        else:
+            self.transducer_access.close(trans_comm_id)
 
     def register_teds_manager(self, teds_manager):
         """Register an object that implements the TEDSManager interface with the TEDSAccessService"""
         self.teds_manager = teds_manager
 
-    def read_transducer_channel_teds(self, ncap_id, tim_id, channel_id, timeout):
-        """
+    def register_teds_cache(self, cache):
+        """Register a TEDSCache object with the TEDSAccessService"""
+        self.teds_cache = cache
+
+    def register_teds_repository(self, repository):
+        """Register a teds_repository.TEDSRepository with the
+        TEDSAccessService. The TEDS it holds are served instead of being
+        read from the TIMs."""
+        self.teds_repository = repository
+
+    def _read_teds_from_repository(self, tim_id, channel_id, teds_type):
+        """Return the read_teds result of a TEDS held by the TEDS
+        repository, None if it holds no such TEDS."""
+        if self.teds_repository is None:
+            return None
+        record = self.teds_repository.get(tim_id, channel_id, teds_type)
+        if record is None:
+            return None
+        return {'error_code': ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                ieee1451.ErrorCode.NO_ERROR),
+                'teds': record.teds,
+                'version': record.version}
+
+    def register_tim_discovery_service(self, tim_discovery):
+        """Register an object that implements the TimDiscovery interface with
+        the TEDSAccessService. It is used to list the channels of a TIM for
+        bulk reads."""
+        self.tim_discovery = tim_discovery
+
+    def read_teds(self, tim_id, channel_id, timeout, teds_type, max_age=None):
+        """Read a TEDS through the NCAP TEDS cache.
+
+        TEDS held by the TEDS repository are served from it. Otherwise the
+        TIM is only accessed when the cache holds no fresh copy of the TEDS
+        or when the client asks for a max_age of zero.
 
-        :param ncap_id: the NCAP ID
         :param tim_id:  the TIM ID
         :param channel_id: the Transducer Channel ID
         :param timeout: TimeDuration indicating the timeout duration
+        :param teds_type: the teds_support.TEDSType to read
+        :param max_age: optional TimeDuration giving the oldest cached copy
+            the client will accept
         :return: a dictionary containing:
             error_code: an ErrorCode object
-            transducer_channel_teds: An ArgumentArray containing the TransducerChannelTEDS information
+            teds: An ArgumentArray containing the TEDS information
+            version: the version tag of the TEDS, None if it was not read
         """
+        rtres = self._read_teds_from_repository(tim_id, channel_id,
+                                                teds_type)
+        if rtres is not None:
+            return rtres
+
+        if max_age is not None:
+            max_age = max_age.total_seconds()
+
+        entry = None
+        if max_age != 0:
+            entry = self.teds_cache.get_entry(tim_id, channel_id, teds_type,
+                                              max_age)
 
-        error_code = ieee1451.Error(
-                            ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
-                            ieee1451.ErrorCode.NO_ERROR)
+        if entry is not None:
+            error = ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                ieee1451.ErrorCode.NO_ERROR)
+            return {'error_code': error, 'teds': entry.teds,
+                    'version': entry.version}
+
+        return self._read_teds_from_tim(tim_id, channel_id, timeout,
+                                        teds_type)
 
-        opened = self.transducer_access.open(tim_id,
-                                             channel_id)
+    def _read_teds_from_tim(self, tim_id, channel_id, timeout, teds_type):
+        """Read a TEDS from the TIM and store it in the TEDS cache.
+
+        :return: the read_teds result dictionary
+        """
+        opened = self.open_session(tim_id, channel_id)
 
         trans_comm_id = opened['trans_comm_id']
         error = opened['error_code']
-
-        teds_type = teds_support.TEDSType.CHAN_TEDS
+        if getattr(error, 'code', ieee1451.ErrorCode.NO_ERROR) != \
+                ieee1451.ErrorCode.NO_ERROR:
+            return {'error_code': error, 'teds': None, 'version': None}
 
         utcres = self.teds_manager.update_teds_cache(trans_comm_id, timeout, teds_type)
         error = utcres['error_code']
 
         rtres = self.teds_manager.read_teds(trans_comm_id, timeout, teds_type)
         error = rtres['error_code']
-        transducer_channel_teds = rtres['teds']
+        teds = rtres['teds']
 
-        self.transducer_access.close(trans_comm_id)
+        self.close_session(trans_comm_id, error)
 
-        result = {'error_code': error,
-                  'transducer_channel_teds': transducer_channel_teds}
+        version = None
+        if getattr(error, 'code', None) == ieee1451.ErrorCode.NO_ERROR:
+            version = self.teds_cache.put(tim_id, channel_id, teds_type, teds)
 
-        return result
+        return {'error_code': error, 'teds': teds, 'version': version}
 
-    def read_user_transducer_name_teds(self, ncap_id, tim_id, channel_id, timeout):
-            """
+    def read_binary_teds(self, tim_id, channel_id, timeout, teds_type):
+        """Read a TEDS from the TIM in its binary IEEE 1451.0 form,
+        bypassing the TEDS caches.
+
+        The fields are decoded on demand, so reading a single field of the
+        returned TEDS does not decode the whole block.
+
+        :param tim_id:  the TIM ID
+        :param channel_id: the Transducer Channel ID
+        :param timeout: TimeDuration indicating the timeout duration
+        :param teds_type: the teds_support.TEDSType to read
+        :return: a dictionary containing:
+            error_code: an ErrorCode object, FATAL_TEDS_ERROR if the TEDS
+                is malformed or its checksum does not match
+            teds: the binary_teds.BinaryTEDS, None if it was not read
+        """
+        opened = self.open_session(tim_id, channel_id)
+        trans_comm_id = opened['trans_comm_id']
+        error = opened['error_code']
+        if getattr(error, 'code', ieee1451.ErrorCode.NO_ERROR) != \
+                ieee1451.ErrorCode.NO_ERROR:
+            return {'error_code': error, 'teds': None}
 
-            :param ncap_id: the NCAP ID
-            :param tim_id:  the TIM ID
-            :param channel_id: the Transducer Channel ID
-            :param timeout: TimeDuration indicating the timeout duration
-            :return: a dictionary containing:
-                error_code: an ErrorCode object
-                transducer_channel_teds: An ArgumentArray containing the TransducerChannelTEDS information
-            """
+        rtres = self.teds_manager.read_raw_teds(trans_comm_id, timeout,
+                                                teds_type)
+        error = rtres['error_code']
+        self.close_session(trans_comm_id, error)
+        if getattr(error, 'code', ieee1451.ErrorCode.NO_ERROR) != \
+                ieee1451.ErrorCode.NO_ERROR:
+            return {'error_code': error, 'teds': None}
 
-            error_code = ieee1451.Error(
+        try:
+            teds = binary_teds.BinaryTEDS(teds_type, rtres['raw_teds'])
+        except ValueError:
+            return {'error_code': ieee1451.Error(
                                 ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
-                                ieee1451.ErrorCode.NO_ERROR)
+                                ieee1451.ErrorCode.FATAL_TEDS_ERROR),
+                    'teds': None}
+        return {'error_code': error, 'teds': teds}
 
-            opened = self.transducer_access.open(tim_id,
-                                                 channel_id)
+    def conditional_response(self, rtres, teds_key, if_none_match=None):
+        """Build the response of a TEDS read service.
 
-            trans_comm_id = opened['trans_comm_id']
-            error = opened['error_code']
+        When the client already holds the current TEDS, i.e. if_none_match
+        equals its version tag, the TEDS itself is left out and not_modified
+        is set instead.
 
-            teds_type = teds_support.TEDSType.XDCR_NAME
+        :param rtres: the dictionary returned by read_teds
+        :param teds_key: the response key holding the TEDS
+        :param if_none_match: optional version tag held by the client
+        :return: a dictionary containing:
+            error_code: an ErrorCode object
+            version: the version tag of the TEDS
+            teds_key: the TEDS, only when it was modified
+            not_modified: True, only when it was not modified
+        """
+        version = rtres.get('version')
+        if if_none_match is not None and version == if_none_match:
+            return {'error_code': rtres['error_code'],
+                    'version': version,
+                    'not_modified': True}
 
-            utcres = self.teds_manager.update_teds_cache(trans_comm_id, timeout, teds_type)
-            error = utcres['error_code']
+        return {'error_code': rtres['error_code'],
+                teds_key: rtres['teds'],
+                'version': version}
 
-            rtres = self.teds_manager.read_teds(trans_comm_id, timeout, teds_type)
-            error = rtres['error_code']
-            transducer_channel_teds = rtres['teds']
+    def revalidate_teds_cache(self, timeout):
+        """Read every TEDS the cache loaded from disk again from its TIM.
 
-            self.transducer_access.close(trans_comm_id)
+        Only caches which persist TEDS, such as
+        teds_cache.PersistentTEDSCache, have entries to revalidate.
 
-            result = {'error_code': error,
-                      'transducer_name_teds': transducer_channel_teds}
+        :param timeout: TimeDuration used for each TIM access
+        :return: the number of TEDS revalidated
+        """
+        pending = getattr(self.teds_cache, 'pending_validation', None)
+        if pending is None:
+            return 0
+
+        no_age = ieee1451.TimeDuration(0, 0)
+        keys = pending()
+        for tim_id, channel_id, teds_type in keys:
+            self.read_teds(tim_id, channel_id, timeout, teds_type, no_age)
+        return len(keys)
+
+    def start_cache_revalidation(self, timeout):
+        """Run revalidate_teds_cache in a background thread so the cached
+        TEDS can be served while they are being checked.
 
-            return result
+        :return: the started threading.Thread
+        """
+        worker = threading.Thread(target=self.revalidate_teds_cache,
+                                  args=(timeout,))
+        worker.daemon = True
+        worker.start()
+        return worker
+
+    def read_transducer_channel_teds(self, ncap_id, tim_id, channel_id,
+                                     timeout, max_age=None,
+                                     if_none_match=None):
+        """
+
+        :param ncap_id: the NCAP ID
+        :param tim_id:  the TIM ID
+        :param channel_id: the Transducer Channel ID
+        :param timeout: TimeDuration indicating the timeout duration
+        :param max_age: optional TimeDuration giving the oldest cached copy
+            the client will accept, zero forces a read from the TIM
+        :param if_none_match: optional version tag of the TEDS held by the
+            client, the TEDS is left out of the response if it still matches
+        :return: a dictionary containing:
+            error_code: an ErrorCode object
+            transducer_channel_teds: An ArgumentArray containing the TransducerChannelTEDS information
+            version: the version tag of the TEDS
+            not_modified: True instead of transducer_channel_teds when the
+                TEDS matches if_none_match
+        """
+        teds_type = teds_support.TEDSType.CHAN_TEDS
+
+        rtres = self.read_teds(tim_id, channel_id, timeout, teds_type, max_age)
+
+        result = self.conditional_response(rtres, 'transducer_channel_teds',
+                                           if_none_match)
+
+        return result
+
+    def read_user_transducer_name_teds(self, ncap_id, tim_id, channel_id,
+                                       timeout, max_age=None,
+                                       if_none_match=None):
+        """
+
+        :param ncap_id: the NCAP ID
+        :param tim_id:  the TIM ID
+        :param channel_id: the Transducer Channel ID
+        :param timeout: TimeDuration indicating the timeout duration
+        :param max_age: optional TimeDuration giving the oldest cached copy
+            the client will accept, zero forces a read from the TIM
+        :param if_none_match: optional version tag of the TEDS held by the
+            client, the TEDS is left out of the response if it still matches
+        :return: a dictionary containing:
+            error_code: an ErrorCode object
+            transducer_name_teds: An ArgumentArray containing the
+                UserTransducerNameTEDS information
+            version: the version tag of the TEDS
+            not_modified: True instead of transducer_name_teds when the
+                TEDS matches if_none_match
+        """
+        teds_type = teds_support.TEDSType.XDCR_NAME
+
+        rtres = self.read_teds(tim_id, channel_id, timeout, teds_type, max_age)
+
+        result = self.conditional_response(rtres, 'transducer_name_teds',
+                                           if_none_match)
+
+        return result
+
+    def read_bulk_teds(self, ncap_id, tim_ids, timeout, teds_types=None,
+                       channel_ids=None, max_age=None):
+        """Read several TEDS types for many channels of one or more TIMs in a
+        single request. This is an ncaplite extension to the 1451.1 TEDS
+        access services.
+
+        TEDS are served from the TEDS repository and the TEDS cache where
+        possible and the misses are read from the TIMs concurrently, all
+        within a single timeout.
+
+        :param ncap_id: the NCAP ID
+        :param tim_ids: list of TIM IDs
+        :param timeout: TimeDuration indicating the timeout duration
+        :param teds_types: list of TEDSType values (or their integer codes),
+            defaults to the TransducerChannel and UserTransducerName TEDS
+        :param channel_ids: optional list of channel IDs to read on every
+            TIM, defaults to all channels reported by TimDiscovery, without
+            a registered TimDiscovery service the error is UNKNOWN_DESTID
+        :param max_age: optional TimeDuration giving the oldest cached copy
+            the client will accept, zero forces a read from the TIMs
+        :return: a dictionary containing:
+            error_code: an ErrorCode object, the first error encountered
+            tim_ids, channel_ids, teds_types: the key of each TEDS read
+            error_codes: the serialized ErrorCode of each TEDS read
+            versions: the version tag of each TEDS, None if it was not read
+            teds: An ArgumentArray holding one TEDS ArgumentArray per key,
+                  named 'tim_id/channel_id/TEDS_TYPE'
+        """
+        if not isinstance(tim_ids, (list, tuple)):
+            tim_ids = [tim_ids]
+        if teds_types is None:
+            teds_types = [teds_support.TEDSType.CHAN_TEDS,
+                          teds_support.TEDSType.XDCR_NAME]
+        elif not isinstance(teds_types, (list, tuple)):
+            teds_types = [teds_types]
+        teds_types = [teds_support.TEDSType(t) for t in teds_types]
+        if channel_ids is not None and \
+                not isinstance(channel_ids, (list, tuple)):
+            channel_ids = [channel_ids]
+
+        error = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                               ieee1451.ErrorCode.NO_ERROR)
+
+        keys = []
+        if channel_ids is None and self.tim_discovery is None:
+            error = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                   ieee1451.ErrorCode.UNKNOWN_DESTID)
+            tim_ids = []
+        for tim_id in tim_ids:
+            chans = channel_ids
+            if chans is None:
+                chanrep = self.tim_discovery.report_channels(tim_id)
+                chans = chanrep['channel_ids']
+            for channel_id in chans:
+                for teds_type in teds_types:
+                    keys.append((tim_id, channel_id, teds_type))
+
+        max_secs = None if max_age is None else max_age.total_seconds()
+        results = [None] * len(keys)
+        misses = []
+        for i, (tim_id, channel_id, teds_type) in enumerate(keys):
+            results[i] = self._read_teds_from_repository(tim_id, channel_id,
+                                                         teds_type)
+            if results[i] is not None:
+                continue
+            entry = None
+            if max_secs != 0:
+                entry = self.teds_cache.get_entry(tim_id, channel_id,
+                                                  teds_type, max_secs)
+            if entry is not None:
+                results[i] = {'error_code': error, 'teds': entry.teds,
+                              'version': entry.version}
+            else:
+                misses.append(i)
+
+        # the misses were looked up already, read them from the TIMs only
+        def fetch(key):
+            tim_id, channel_id, teds_type = key
+            return lambda: self._read_teds_from_tim(tim_id, channel_id,
+                                                    timeout, teds_type)
+
+        fetched = worker_pool.run_concurrently(
+                            [fetch(keys[i]) for i in misses],
+                            self.max_workers, timeout.total_seconds())
+
+        for i, task in zip(misses, fetched):
+            if task.done and task.exception is None:
+                results[i] = task.value
+                continue
+            code = ieee1451.ErrorCode.TIMEOUT
+            if task.exception is not None:
+                code = ieee1451.ErrorCode.FATAL_TEDS_ERROR
+            results[i] = {'error_code': ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                code),
+                          'teds': None,
+                          'version': None}
+
+        teds = ieee1451.ArgumentArray()
+        error_codes = []
+        versions = []
+        for (tim_id, channel_id, teds_type), res in zip(keys, results):
+            name = '%s/%s/%s' % (tim_id, channel_id, teds_type.name)
+            teds.put_by_name(name, ieee1451.Argument(
+                                ieee1451.TypeCode.UNKNOWN_TC, res['teds']))
+            res_error = res['error_code']
+            error_codes.append(res_error.serializable()['Error'])
+            versions.append(res.get('version'))
+            if error.code == ieee1451.ErrorCode.NO_ERROR and \
+                    res_error.code != ieee1451.ErrorCode.NO_ERROR:
+                error = res_error
+
+        result = {'error_code': error,
+                  'tim_ids': [k[0] for k in keys],
+                  'channel_ids': [k[1] for k in keys],
+                  'teds_types': [k[2].value for k in keys],
+                  'error_codes': error_codes,
+                  'versions': versions,
+                  'teds': teds}
+
+        return result
@@ -0,0 +1,254 @@
+"""
+.. module:: teds_cache
+   :platform: Unix, Windows
+   :synopsis: Defines the NCAP-level in-memory TEDS cache used by the
+   TEDS Access Services.
+
+.. moduleauthor:: James Ethridge <jeethridge@gmail.com>
+
+"""
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import sqlite3
+import threading
+import ieee1451types as ieee1451
+import teds_support
+from timeutil import clock
+
+
+def teds_to_serializable(teds):
+    """Convert a TEDS (usually an ArgumentArray) to a serializable format."""
+    serializable = getattr(teds, "serializable", None)
+    if callable(serializable):
+        return serializable()
+    return teds
+
+
+def teds_from_serializable(s):
+    """Convert a TEDS from the format returned by teds_to_serializable."""
+    if isinstance(s, dict) and len(s) == 1:
+        c = getattr(ieee1451, str(list(s.keys())[0]), None)
+        from_serializable = getattr(c, "from_serializable", None)
+        if callable(from_serializable):
+            return from_serializable(s)
+    return s
+
+
+def teds_version(teds):
+    """Compute a version tag for a TEDS: the SHA-1 of its serialized form.
+
+    :param teds: the TEDS, usually an ArgumentArray
+    :return: a hex string which changes whenever the TEDS content changes
+    """
+    text = json.dumps(teds_to_serializable(teds), sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class TEDSCacheEntry(object):
+    """Defines a single cached TEDS, its version and the time it was
+    stored."""
+
+    def __init__(self, teds, timestamp, version=None):
+        self.teds = teds
+        self.timestamp = timestamp
+        self.version = version
+
+
+class TEDSCache(object):
+    """In-memory TEDS cache keyed by (tim_id, channel_id, teds_type).
+
+    Entries older than the optional ttl (seconds) are treated as misses.
+    Hits and misses are counted so the cache effectiveness can be reported.
+    """
+
+    def __init__(self, ttl=None):
+        """Initialize the TEDSCache object.
+
+        :param ttl: optional time to live of an entry in seconds
+        """
+        self.ttl = ttl
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, tim_id, channel_id, teds_type, max_age=None):
+        """Get a TEDS from the cache.
+
+        :param tim_id: the TIM ID
+        :param channel_id: the Transducer Channel ID
+        :param teds_type: the teds_support.TEDSType of the TEDS
+        :param max_age: optional maximum acceptable age of the entry in
+            seconds, a value of 0 always misses
+        :return: the cached TEDS or None on a miss
+        """
+        entry = self.get_entry(tim_id, channel_id, teds_type, max_age)
+        return entry.teds if entry is not None else None
+
+    def get_entry(self, tim_id, channel_id, teds_type, max_age=None):
+        """Get a TEDS together with its version tag from the cache.
+
+        Takes the same arguments as get.
+
+        :return: the TEDSCacheEntry or None on a miss
+        """
+        key = (tim_id, channel_id, teds_type)
+        now = clock()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                age = now - entry.timestamp
+                if self.ttl is not None and age > self.ttl:
+                    del self.entries[key]
+                    entry = None
+                elif max_age is not None and (max_age <= 0 or age > max_age):
+                    entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            return entry
+
+    def put(self, tim_id, channel_id, teds_type, teds, version=None):
+        """Store a TEDS in the cache.
+
+        :param version: the TEDS version tag, computed by teds_version
+            when not given
+        :return: the version tag of the stored TEDS
+        """
+        if version is None:
+            version = teds_version(teds)
+        key = (tim_id, channel_id, teds_type)
+        with self.lock:
+            self.entries[key] = TEDSCacheEntry(teds, clock(), version)
+        return version
+
+    def invalidate(self, tim_id=None, channel_id=None, teds_type=None):
+        """Remove entries from the cache.
+
+        Any argument left as None acts as a wildcard, so invalidate() clears
+        the whole cache and invalidate(tim_id=1) drops every TEDS of TIM 1.
+
+        :return: the number of entries removed
+        """
+        with self.lock:
+            keys = [k for k in self.entries
+                    if (tim_id is None or k[0] == tim_id) and
+                    (channel_id is None or k[1] == channel_id) and
+                    (teds_type is None or k[2] == teds_type)]
+            for k in keys:
+                del self.entries[k]
+        return len(keys)
+
+    def stats(self):
+        """Return a dictionary containing the hit and miss counters."""
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'size': len(self.entries)}
+
+
+class PersistentTEDSCache(TEDSCache):
+    """TEDS cache backed by an sqlite database for fast NCAP cold starts.
+
+    Every put is written through to the database together with the TEDS
+    version. On start up the stored TEDS are loaded into memory and served
+    immediately; they are recorded as unvalidated until they are stored
+    again after a fresh read from the TIM, typically from the background
+    thread started by TEDSAccessServices.start_cache_revalidation.
+    """
+
+    def __init__(self, db_path, ttl=None):
+        """Initialize the PersistentTEDSCache object.
+
+        :param db_path: path to the sqlite database file
+        :param ttl: optional time to live of an entry in seconds
+        """
+        TEDSCache.__init__(self, ttl)
+        self.db_path = db_path
+        self.unvalidated = set()
+        self.db_lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        with self.db_lock:
+            self.db.execute('CREATE TABLE IF NOT EXISTS teds_cache ('
+                            'tim_id INTEGER, channel_id INTEGER, '
+                            'teds_type INTEGER, version TEXT, teds TEXT, '
+                            'PRIMARY KEY (tim_id, channel_id, teds_type))')
+            self.db.commit()
+        self.load()
+
+    def load(self):
+        """Load every stored TEDS into memory as unvalidated entries.
+
+        :return: the number of entries loaded
+        """
+        with self.db_lock:
+            rows = self.db.execute('SELECT tim_id, channel_id, teds_type, '
+                                   'version, teds FROM teds_cache').fetchall()
+        now = clock()
+        with self.lock:
+            for tim_id, channel_id, teds_type, version, teds in rows:
+                key = (tim_id, channel_id, teds_support.TEDSType(teds_type))
+                self.entries[key] = TEDSCacheEntry(
+                        teds_from_serializable(json.loads(teds)), now,
+                        str(version))
+                self.unvalidated.add(key)
+        return len(rows)
+
+    def put(self, tim_id, channel_id, teds_type, teds, version=None):
+        """Store a TEDS in memory and in the database."""
+        version = TEDSCache.put(self, tim_id, channel_id, teds_type, teds,
+                                version)
+        with self.lock:
+            self.unvalidated.discard((tim_id, channel_id, teds_type))
+        text = json.dumps(teds_to_serializable(teds))
+        with self.db_lock:
+            self.db.execute('INSERT OR REPLACE INTO teds_cache VALUES '
+                            '(?, ?, ?, ?, ?)',
+                            (tim_id, channel_id, teds_type.value, version,
+                             text))
+            self.db.commit()
+        return version
+
+    def invalidate(self, tim_id=None, channel_id=None, teds_type=None):
+        """Remove entries from memory and from the database.
+
+        Rows are matched in the database itself, so entries which already
+        expired from memory are removed as well.
+        """
+        clauses = []
+        params = []
+        for column, value in (('tim_id', tim_id),
+                              ('channel_id', channel_id),
+                              ('teds_type', getattr(teds_type, 'value',
+                                                    teds_type))):
+            if value is not None:
+                clauses.append(column + ' = ?')
+                params.append(value)
+        sql = 'DELETE FROM teds_cache'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        with self.db_lock:
+            self.db.execute(sql, params)
+            self.db.commit()
+        with self.lock:
+            self.unvalidated = set(
+                    k for k in self.unvalidated
+                    if not ((tim_id is None or k[0] == tim_id) and
+                            (channel_id is None or k[1] == channel_id) and
+                            (teds_type is None or k[2] == teds_type)))
+        return TEDSCache.invalidate(self, tim_id, channel_id, teds_type)
+
+    def pending_validation(self):
+        """Return the keys loaded from disk which are not yet revalidated."""
+        with self.lock:
+            return sorted(self.unvalidated, key=lambda k: (k[0], k[1],
+                                                           k[2].value))
+
+    def close(self):
+        """Close the database connection."""
+        with self.db_lock:
+            self.db.close()
@@ -0,0 +1,271 @@
+"""
+.. module:: teds_repository
+   :platform: Unix, Windows
+   :synopsis: Defines an indexed store of text-based TEDS which parses
+   TEDS XML files once instead of on every lookup.
+
+.. moduleauthor:: James Ethridge <jeethridge@gmail.com>
+
+"""
+# -*- coding: utf-8 -*-
+import logging
+import os
+import threading
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+import ieee1451types as ieee1451
+import teds_cache
+import teds_support
+from timeutil import clock
+
+logger = logging.getLogger(__name__)
+
+
+class TEDSRecord(object):
+    """Defines a single indexed TEDS in both of its text-based forms.
+
+    xml holds the serialized element, as returned by
+    teds_support.teds_element_from_file, and as_dict() returns the matching
+    teds_support.teds_dict_from_xml representation. The dict form, like the
+    ArgumentArray form served by TEDSAccessServices, is built on first
+    access and kept from then on.
+    """
+
+    def __init__(self, tim_id, channel_id, teds_type, xml):
+        self.tim_id = tim_id
+        self.channel_id = channel_id
+        self.teds_type = teds_type
+        self.xml = xml
+        self._dict = None
+        self._view = None
+        self._teds = None
+        self._version = None
+
+    def as_dict(self):
+        """Return the teds_support.teds_dict_from_xml form of the TEDS."""
+        if self._dict is None:
+            self._dict = teds_support.teds_dict_from_xml(self.xml)
+        return self._dict
+
+    @property
+    def teds(self):
+        """The TEDS as the ArgumentArray returned by read_teds, holding
+        the XML text at index 0."""
+        if self._teds is None:
+            teds = ieee1451.ArgumentArray()
+            teds.put_by_index(0, ieee1451.Argument(
+                                ieee1451.TypeCode.STRING_TC, self.xml))
+            self._teds = teds
+        return self._teds
+
+    @property
+    def version(self):
+        """The teds_cache.teds_version tag of the TEDS."""
+        if self._version is None:
+            self._version = teds_cache.teds_version(self.teds)
+        return self._version
+
+    @property
+    def view(self):
+        """A teds_support.TEDSView over the dict form of the TEDS.
+
+        Reloading a file replaces its records, so views never outlive the
+        TEDS they index.
+        """
+        if self._view is None:
+            self._view = teds_support.TEDSView(self.as_dict())
+        return self._view
+
+
+class TEDSFile(object):
+    """Book-keeping for a TEDS XML file registered with a TEDSRepository."""
+
+    def __init__(self, xmlpath, tim_id, channel_id):
+        self.xmlpath = xmlpath
+        self.tim_id = tim_id
+        self.channel_id = channel_id
+        self.mtime = None
+        self.keys = []
+
+
+def _id_attr(elem, names, default):
+    """Read an integer id attribute from an element."""
+    for name in names:
+        val = elem.get(name)
+        if val is not None:
+            return int(val)
+    return default
+
+
+TIM_ID_ATTRS = ('timId', 'tim_id')
+CHANNEL_ID_ATTRS = ('channelId', 'channel_id')
+
+
+def iter_teds_records(xmlpath, tim_id=0, channel_id=0):
+    """Stream the TEDS in an XML file one element at a time.
+
+    The file is read with iterparse and each TEDS element is serialized,
+    yielded as a TEDSRecord and then cleared and detached from its parent,
+    so peak memory stays proportional to a single TEDS rather than to the
+    whole file.
+
+    :param xmlpath: the path to the TEDS XML file
+    :param tim_id: the TIM ID used for elements without a timId
+    :param channel_id: the channel ID used for elements without a channelId
+    :return: a generator of TEDSRecord objects
+    """
+    # stack of (element, tim_id, channel_id, teds_type) for open elements
+    stack = []
+    teds_depth = 0
+    for event, elem in ET.iterparse(xmlpath, events=('start', 'end')):
+        if event == 'start':
+            if teds_depth:
+                stack.append((elem, None, None, None))
+                continue
+            parent_tim_id, parent_channel_id = tim_id, channel_id
+            if stack:
+                parent_tim_id, parent_channel_id = stack[-1][1], stack[-1][2]
+            teds_type = teds_support.TEDS_ELEMENT_TYPES.get(
+                                    teds_support.local_name(elem.tag))
+            if teds_type is not None:
+                teds_depth += 1
+            stack.append((elem,
+                          _id_attr(elem, TIM_ID_ATTRS, parent_tim_id),
+                          _id_attr(elem, CHANNEL_ID_ATTRS, parent_channel_id),
+                          teds_type))
+            continue
+
+        elem, elem_tim_id, elem_channel_id, teds_type = stack.pop()
+        if teds_type is not None:
+            teds_depth -= 1
+            yield TEDSRecord(elem_tim_id, elem_channel_id, teds_type,
+                             ET.tostring(elem, 'UTF-8', method='xml'))
+        elif teds_depth:
+            # children of a TEDS are kept until the TEDS is serialized
+            continue
+        elem.clear()
+        if stack:
+            stack[-1][0].remove(elem)
+
+
+class TEDSRepository(object):
+    """Indexed store of TEDS loaded from XML files.
+
+    Each registered file is parsed once, on first use, and every TEDS
+    element in it is indexed by (tim_id, channel_id, teds_type). A file may
+    hold a single SmartTransducerTEDS, whose ids are given when the file is
+    registered, or several SmartTransducerTEDS elements carrying timId and
+    channelId attributes. Files are only parsed again when their mtime
+    changes, which lookups check for at most once per check_interval.
+    """
+
+    def __init__(self, check_interval=1.0):
+        """Initialize the TEDSRepository object.
+
+        :param check_interval: minimum number of seconds between checks of
+            the registered files for changes, None disables the checks
+        """
+        self.check_interval = check_interval
+        self.files = {}
+        self.index = {}
+        self.unloaded = False
+        self.last_check = clock()
+        self.lock = threading.RLock()
+
+    def add_file(self, xmlpath, tim_id=0, channel_id=0, lazy=True):
+        """Register a TEDS XML file with the repository.
+
+        :param xmlpath: the path to the TEDS XML file
+        :param tim_id: the TIM ID used for elements without a timId
+        :param channel_id: the channel ID used for elements without a
+            channelId
+        :param lazy: defer parsing the file until the first lookup
+        """
+        with self.lock:
+            self.files[xmlpath] = TEDSFile(xmlpath, tim_id, channel_id)
+            if lazy:
+                self.unloaded = True
+            else:
+                self._load(self.files[xmlpath])
+
+    def _records(self, teds_file):
+        """Stream the TEDS records of a registered file."""
+        return iter_teds_records(teds_file.xmlpath, teds_file.tim_id,
+                                 teds_file.channel_id)
+
+    def _load(self, teds_file):
+        """(Re)load a registered file into the index. The file is parsed
+        completely before the index is changed, so a file which cannot be
+        read leaves its previous records in place."""
+        mtime = os.path.getmtime(teds_file.xmlpath)
+        records = list(self._records(teds_file))
+        for key in teds_file.keys:
+            self.index.pop(key, None)
+        teds_file.keys = []
+        for record in records:
+            key = (record.tim_id, record.channel_id, record.teds_type)
+            self.index[key] = record
+            teds_file.keys.append(key)
+        teds_file.mtime = mtime
+
+    def refresh(self):
+        """Load registered files which are new or have changed on disk.
+        Files which are missing or fail to parse keep their previous
+        records and are retried on the next refresh.
+
+        :return: the number of files loaded
+        """
+        loaded = 0
+        with self.lock:
+            for teds_file in self.files.values():
+                try:
+                    if teds_file.mtime is not None and \
+                            os.path.getmtime(teds_file.xmlpath) == \
+                            teds_file.mtime:
+                        continue
+                    self._load(teds_file)
+                    loaded += 1
+                except Exception as e:
+                    logger.error('TEDSRepository: loading %s failed: %s',
+                                 teds_file.xmlpath, e)
+            self.unloaded = False
+            self.last_check = clock()
+        return loaded
+
+    def _check(self):
+        """Refresh if files are unloaded or the check interval elapsed."""
+        if self.unloaded:
+            self.refresh()
+        elif self.check_interval is not None and \
+                clock() - self.last_check >= self.check_interval:
+            self.refresh()
+
+    def get(self, tim_id, channel_id, teds_type):
+        """Look up a TEDS.
+
+        :param tim_id: the TIM ID
+        :param channel_id: the Transducer Channel ID
+        :param teds_type: the teds_support.TEDSType of the TEDS
+        :return: the TEDSRecord or None if the TEDS is not known
+        """
+        with self.lock:
+            self._check()
+            return self.index.get((tim_id, channel_id, teds_type))
+
+    def get_xml(self, tim_id, channel_id, teds_type):
+        """Return the serialized XML of a TEDS or None."""
+        record = self.get(tim_id, channel_id, teds_type)
+        return record.xml if record is not None else None
+
+    def get_dict(self, tim_id, channel_id, teds_type):
+        """Return the dictionary form of a TEDS or None."""
+        record = self.get(tim_id, channel_id, teds_type)
+        return record.as_dict() if record is not None else None
+
+    def keys(self):
+        """Return the (tim_id, channel_id, teds_type) keys of every TEDS."""
+        with self.lock:
+            self._check()
+            return list(self.index.keys())
@@ -43,6 +43,32 @@ class TEDSType(Enum):
     UNITS_EXTENSION = 15
 
 
+# Maps the element names used in text-based TEDS files to their TEDSType
+TEDS_ELEMENT_TYPES = {
+    'MetaTEDS': TEDSType.META_TEDS,
+    'MetaIdTEDS': TEDSType.META_ID_TEDS,
+    'TransducerChannelTEDS': TEDSType.CHAN_TEDS,
+    'TransducerChannelIdTEDS': TEDSType.CHAN_ID_TEDS,
+    'CalibrationTEDS': TEDSType.CAL_TEDS,
+    'CalibrationIdTEDS': TEDSType.CAL_ID_TEDS,
+    'EndUsersApplicationSpecificTEDS': TEDSType.EUAS_TEDS,
+    'FrequencyResponseTEDS': TEDSType.FREQ_RESP_TEDS,
+    'TransferFunctionTEDS': TEDSType.TRANSFER_TEDS,
+    'CommandTEDS': TEDSType.COMMAND_TEDS,
+    'TitleTEDS': TEDSType.TITLE_TEDS,
+    'UserTransducerNameTEDS': TEDSType.XDCR_NAME,
+    'PHYTEDS': TEDSType.PHY_TEDS,
+    'GeoLocTEDS': TEDSType.GEO_LOC_TEDS,
+    'UnitsExtensionTEDS': TEDSType.UNITS_EXTENSION,
+}
+
+
+def local_name(tag):
+    """Strip the namespace from an ElementTree tag or prefixed key,
+    e.g. '{http://localhost/1451HTTPAPI}MetaTEDS' becomes 'MetaTEDS'."""
+    return tag.rsplit('}', 1)[-1].split(':')[-1]
+
+
 def teds_dict_from_file(xmlpath):
     """Get a dictionary object containing TEDS info given TEDS XML file path.
 
@@ -105,3 +131,124 @@ def subitem(key, d):
                 return item
 
 
+def strip_prefixes(d):
+    """
+    Get a copy of a TEDS dictionary with namespace prefixes removed from the
+    keys, e.g. 'ns0:TransducerChannelTEDS' becomes 'TransducerChannelTEDS'.
+    Elements serialized by teds_element_from_file carry such prefixes.
+    :param d: a TEDS dictionary as returned by teds_dict_from_xml
+    :return: an OrderedDict keyed by local element names
+    """
+    if isinstance(d, list):
+        return [strip_prefixes(v) for v in d]
+    if not isinstance(d, dict):
+        return d
+    result = OrderedDict()
+    for k, v in iter(d.items()):
+        if k.startswith('@xmlns'):
+            continue
+        result[local_name(k)] = strip_prefixes(v)
+    return result
+
+
+class TEDSView(object):
+    """
+    Flattened, read-only view of a TEDS dictionary.
+
+    Every field is indexed once by its local name and by its full '/'
+    separated path of local names, so lookups are a single dict access
+    instead of the recursive search done by subitem. Repeated elements
+    appear in paths with their list index, e.g. 'Segments/Segment/1/Offset'.
+
+    A name occurring at several depths resolves exactly as subitem does:
+    keys of a dictionary win over keys nested below it, and among nested
+    dictionaries the earlier sibling wins unless its value is None, e.g. an
+    empty element, in which case the search goes on with the later ones.
+    """
+
+    def __init__(self, teds):
+        """
+        :param teds: a TEDS dictionary as returned by teds_dict_from_xml
+        """
+        self.teds = teds
+        self._names = None
+        self._paths = None
+
+    def set_teds(self, teds):
+        """Replace the underlying TEDS, invalidating the index."""
+        self.teds = teds
+        self.invalidate()
+
+    def invalidate(self):
+        """Drop the index so it is rebuilt on the next lookup."""
+        self._names = None
+        self._paths = None
+
+    def _index(self, d, prefix, paths):
+        """Index d into paths and return its name map."""
+        names = {}
+        children = []
+        is_list = isinstance(d, list)
+        items = enumerate(d) if is_list else iter(d.items())
+        for k, v in items:
+            if is_list:
+                name = str(k)
+            elif k.startswith('@xmlns'):
+                continue
+            else:
+                name = local_name(k)
+            path = prefix + name
+            paths[path] = v
+            if not is_list and name not in names:
+                names[name] = v
+            if isinstance(v, (dict, list)):
+                children.append((v, path + '/'))
+        for v, path in children:
+            sub = self._index(v, path, paths)
+            if isinstance(v, dict):
+                for name, value in iter(sub.items()):
+                    # subitem skips a nested None and keeps searching
+                    if value is not None and name not in names:
+                        names[name] = value
+        return names
+
+    def _build(self):
+        """Build the name and path indexes."""
+        paths = {}
+        self._names = self._index(self.teds, '', paths)
+        self._paths = paths
+
+    def get(self, key, default=None):
+        """
+        Look up a field by name, e.g. 'ChanType', or by full path, e.g.
+        'TransducerChannelTEDS/TransducerChannelTEDSDataBlock/ChanType'.
+        :param key: a field name or '/' separated path
+        :param default: the value returned when the key is not found
+        :return: the field value
+        """
+        if self._names is None:
+            self._build()
+        if '/' in key:
+            return self._paths.get(key, default)
+        return self._names.get(local_name(key), default)
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def names(self):
+        """Return the indexed field names."""
+        if self._names is None:
+            self._build()
+        return list(self._names.keys())
+
+    def paths(self):
+        """Return the indexed full paths."""
+        if self._paths is None:
+            self._build()
+        return list(self._paths.keys())
@@ -0,0 +1,166 @@
+"""
+.. module:: teds_warmup
+   :platform: Unix, Windows
+   :synopsis: Defines the background warm-up which discovers the TIMs and
+   prefetches their TEDS into the NCAP TEDS cache at startup.
+
+.. moduleauthor:: James Ethridge <jeethridge@gmail.com>
+
+"""
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import ieee1451types as ieee1451
+import teds_support
+import worker_pool
+
+logger = logging.getLogger(__name__)
+
+
+class TEDSWarmup(object):
+    """Discovers every TIM and channel and prefetches their TEDS.
+
+    The warm-up runs in a daemon thread so the NCAP serves requests while it
+    runs. Each communication module gets its own thread and at most
+    max_workers_per_module TEDS reads are in flight on a module at a time,
+    so a slow 1451.X interface does not hold up the others.
+
+    Progress is available from progress() and is passed to the optional
+    on_progress callback after every TEDS read. Every TEDS read successfully
+    is passed to the optional on_teds callback.
+    """
+
+    def __init__(self, discovery, teds_access, teds_types=None,
+                 max_workers_per_module=4, timeout=None, on_progress=None,
+                 on_teds=None):
+        """Initialize the TEDSWarmup object.
+
+        :param discovery: the DiscoveryServices object
+        :param teds_access: the TEDSAccessServices object
+        :param teds_types: list of teds_support.TEDSType to prefetch,
+            defaults to the TransducerChannel and UserTransducerName TEDS
+        :param max_workers_per_module: maximum number of concurrent TEDS
+            reads per communication module
+        :param timeout: TimeDuration used for each TEDS read
+        :param on_progress: optional callable taking the progress dictionary
+        :param on_teds: optional callable taking the tim_id, channel_id,
+            teds_type and read_teds result of every TEDS read
+        """
+        if teds_types is None:
+            teds_types = [teds_support.TEDSType.CHAN_TEDS,
+                          teds_support.TEDSType.XDCR_NAME]
+        if timeout is None:
+            timeout = ieee1451.TimeDuration(5, 0)
+        self.discovery = discovery
+        self.teds_access = teds_access
+        self.teds_types = teds_types
+        self.max_workers_per_module = max_workers_per_module
+        self.timeout = timeout
+        self.on_progress = on_progress
+        self.on_teds = on_teds
+        self.lock = threading.Lock()
+        self.state = 'idle'
+        self.total = 0
+        self.completed = 0
+        self.failed = 0
+        self.thread = None
+
+    def progress(self):
+        """Return a dictionary containing:
+            state: one of idle, discovering, prefetching, done or failed
+            total: the number of TEDS to prefetch discovered so far
+            completed: the number of TEDS read successfully
+            failed: the number of TEDS reads which failed
+        """
+        with self.lock:
+            return {'state': self.state,
+                    'total': self.total,
+                    'completed': self.completed,
+                    'failed': self.failed}
+
+    def _set_state(self, state):
+        with self.lock:
+            self.state = state
+        self._report()
+
+    def _report(self):
+        if self.on_progress is not None:
+            self.on_progress(self.progress())
+
+    def _discover(self, module_id):
+        """Return the (tim_id, channel_id) pairs on a communication module."""
+        transducer_access = self.discovery.transducer_access
+        timrep = transducer_access.report_tims(module_id)
+        channels = []
+        for tim_id in timrep['tim_ids']:
+            chanrep = self.discovery.ncap_transducer_discover(0, tim_id)
+            for channel_id in chanrep['trans_channel_ids']:
+                channels.append((tim_id, channel_id))
+        return channels
+
+    def _prefetch(self, tim_id, channel_id, teds_type):
+        """Read a single TEDS into the cache and count the outcome."""
+        ok = False
+        try:
+            rtres = self.teds_access.read_teds(tim_id, channel_id,
+                                               self.timeout, teds_type)
+            ok = rtres['error_code'].code == ieee1451.ErrorCode.NO_ERROR
+            if ok and self.on_teds is not None:
+                self.on_teds(tim_id, channel_id, teds_type, rtres)
+        except Exception as e:
+            logger.error('TEDSWarmup: reading TEDS %s of %s/%s failed: %s',
+                         teds_type, tim_id, channel_id, e)
+        with self.lock:
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+        self._report()
+
+    def warm_module(self, module_id):
+        """Discover and prefetch the TEDS of one communication module."""
+        channels = self._discover(module_id)
+        tasks = []
+        for tim_id, channel_id in channels:
+            for teds_type in self.teds_types:
+                tasks.append(lambda t=tim_id, c=channel_id, ty=teds_type:
+                             self._prefetch(t, c, ty))
+        with self.lock:
+            self.total += len(tasks)
+            self.state = 'prefetching'
+        self._report()
+        worker_pool.run_concurrently(tasks, self.max_workers_per_module)
+
+    def run(self):
+        """Warm the TEDS cache of every communication module and block until
+        all of them are done.
+
+        :return: the final progress dictionary
+        """
+        self._set_state('discovering')
+        try:
+            comrep = self.discovery.transducer_access.report_comm_module()
+            module_ids = comrep['module_ids']
+        except Exception as e:
+            logger.error('TEDSWarmup: discovery failed: %s', e)
+            self._set_state('failed')
+            return self.progress()
+
+        modules = [(lambda m=module_id: self.warm_module(m))
+                   for module_id in module_ids]
+        for res in worker_pool.run_concurrently(modules, max(len(modules), 1)):
+            if res.exception is not None:
+                logger.error('TEDSWarmup: module warm-up failed: %s',
+                             res.exception)
+        self._set_state('done')
+        return self.progress()
+
+    def start(self):
+        """Run the warm-up in a background thread.
+
+        :return: the started threading.Thread
+        """
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.thread
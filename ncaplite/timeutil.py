@@ -0,0 +1,85 @@
+"""
+.. module:: timeutil
+   :platform: Unix, Windows
+   :synopsis: Defines the monotonic clock used for the deadlines, timeouts
+   and cache lifetimes of the NCAP services.
+
+.. moduleauthor:: James Ethridge <jeethridge@gmail.com>
+
+"""
+# -*- coding: utf-8 -*-
+import ctypes
+import ctypes.util
+import sys
+import time
+
+# CLOCK_MONOTONIC of the platforms whose value differs from Linux
+CLOCK_MONOTONIC_IDS = {'darwin': 6, 'freebsd': 4}
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _posix_clock():
+    """Return a clock reading clock_gettime(CLOCK_MONOTONIC) through
+    ctypes, None if it is not available."""
+    path = ctypes.util.find_library('rt') or ctypes.util.find_library('c')
+    if path is None:
+        return None
+    try:
+        clock_gettime = ctypes.CDLL(path, use_errno=True).clock_gettime
+    except (OSError, AttributeError):
+        return None
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+    clock_id = 1
+    for prefix, value in CLOCK_MONOTONIC_IDS.items():
+        if sys.platform.startswith(prefix):
+            clock_id = value
+
+    def monotonic():
+        ts = _Timespec()
+        if clock_gettime(clock_id, ctypes.byref(ts)) != 0:
+            raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+
+    try:
+        monotonic()
+    except OSError:
+        return None
+    return monotonic
+
+
+def _windows_clock():
+    """Return a clock reading QueryPerformanceCounter through ctypes."""
+    kernel32 = ctypes.windll.kernel32
+    frequency = ctypes.c_int64()
+    kernel32.QueryPerformanceFrequency(ctypes.byref(frequency))
+
+    def monotonic():
+        counter = ctypes.c_int64()
+        kernel32.QueryPerformanceCounter(ctypes.byref(counter))
+        return counter.value / float(frequency.value)
+
+    return monotonic
+
+
+def _select_clock():
+    """Return the best monotonic clock of the interpreter and whether it
+    really is monotonic."""
+    # time.monotonic is not available before Python 3.3
+    if hasattr(time, 'monotonic'):
+        return time.monotonic, True
+    if sys.platform == 'win32':
+        return _windows_clock(), True
+    posix = _posix_clock()
+    if posix is not None:
+        return posix, True
+    return time.time, False
+
+
+# clock() returns seconds on an arbitrary time scale which is not affected
+# by changes of the system time. MONOTONIC is False on the platforms where
+# no monotonic source was found and clock falls back to time.time, in
+# which case a step of the system clock moves every pending deadline.
+clock, MONOTONIC = _select_clock()
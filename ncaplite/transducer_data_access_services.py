@@ -6,7 +6,39 @@
 .. moduleauthor:: James Ethridge <jeethridge@gmail.com>
 
 """
+import collections
+import logging
+import numbers
+import threading
+import time
+from array import array
 import ieee1451types as ieee1451
+import aggregation
+import calibration_engine
+import operation_table
+import sample_history
+import sample_scheduler
+import sensor_alerts
+import stream_manager
+import worker_pool
+
+logger = logging.getLogger(__name__)
+
+# the stream_manager client_id of the channel monitoring of the NCAP,
+# which feeds the sensor alerts and the sample history
+MONITOR_CLIENT = 'ncaplite.channel_monitor'
+
+
+def is_number(value):
+    """Return True if value is a reading a Calibration TEDS applies to."""
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def corrected(evaluator, value):
+    """Correct value with evaluator, if any and if value is a number."""
+    if evaluator is None or not is_number(value):
+        return value
+    return evaluator(value)
 
 
 class TransducerDataAccessServices(object):
@@ -20,11 +52,69 @@ class TransducerDataAccessServices(object):
     def __init__(self, name="Transducer Data Access Services"):
         """Initialize the TransducerDataAccessServices object."""
         self.name = name
+        self.session_pool = None
+        self.native_block_reads = True
+        self.group_reads = True
+        self.max_workers = 8
+        # upper bound of number of samples * channels of a block read
+        self.max_block_samples = 1000000
+        self.operations = collections.OrderedDict()
+        self.operations_lock = threading.Lock()
+        self.next_operation_id = 1
+        # finished operations kept for report_block_operation
+        self.max_finished_operations = 64
+        self.stream_manager = stream_manager.StreamManager()
+        # the AppCallback of the reads and writes started with
+        # start_read_data and start_write_data
+        self.operation_table = operation_table.OperationTable()
+        # seconds allowed on top of the request timeout for the callback
+        # of a started read or write before it is timed out by the NCAP
+        self.callback_grace = 1.0
+        self.sensor_alerts = sensor_alerts.AlertEngine()
+        # the Calibration TEDS corrections applied to the values read
+        self.calibration = calibration_engine.CalibrationEngine()
+        self.sample_histories = {}
+        # the sampler operation, or None for a stream, feeding each
+        # monitored (tim_id, channel_id), the set of features using it and
+        # the sampling rate of the sampler
+        self.channel_monitors = {}
+        self.monitor_lock = threading.Lock()
+        self.stream_manager.local_senders[MONITOR_CLIENT] = \
+            self._feed_stream_batch
 
     def register_transducer_access_service(self, transducer_access):
         """Register a TimDiscovery service object with the\
         TransducerDataAccessServices object."""
         self.transducer_access = transducer_access
+        self.stream_manager.transducer_access = transducer_access
+
+    def register_session_pool(self, session_pool):
+        """Register a session_pool.SessionPool object with the
+        TransducerDataAccessServices object. Sessions are then borrowed
+        from the pool instead of being opened and closed for every
+        request."""
+        self.session_pool = session_pool
+
+    def open_session(self, tim_id, channel_id):
+        """Open a session to a channel, or borrow one from the session pool.
+
+        :return: a dictionary containing error_code and trans_comm_id
+        """
+        if self.session_pool is not None:
+            return self.session_pool.acquire(tim_id, channel_id)
+        return self.transducer_access.open(tim_id, channel_id)
+
+    def close_session(self, trans_comm_id, error=None):
+        """Close a session opened by open_session, or return it to the
+        session pool.
+
+        :param error: the ErrorCode object of the last operation on the
+            session
+        """
+        if self.session_pool is not None:
+            self.session_pool.release(trans_comm_id, error)
+        else:
+            self.transducer_access.close(trans_comm_id)
 
     def read_transducer_sample_data_from_a_channel_of_a_tim(self,
                                                             ncap_id,
@@ -55,11 +145,17 @@ class TransducerDataAccessServices(object):
                             ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
                             ieee1451.ErrorCode.NO_ERROR)
 
-        opened = self.transducer_access.open(tim_id,
-                                             channel_id)
+        opened = self.open_session(tim_id, channel_id)
 
         trans_comm_id = opened['trans_comm_id']
         error = opened['error_code']
+        if getattr(error, 'code', ieee1451.ErrorCode.NO_ERROR) != \
+                ieee1451.ErrorCode.NO_ERROR:
+            return {'error_code': error,
+                    'ncap_id': ncap_id,
+                    'tim_id': tim_id,
+                    'channel_id': channel_id,
+                    'sample_data': sample_data}
 
         read = \
                 self.transducer_access.read_data(trans_comm_id,
@@ -68,7 +164,12 @@ class TransducerDataAccessServices(object):
         error = read['error_code']
         sample_data = read['result']
 
-        self.transducer_access.close(trans_comm_id)
+        self.close_session(trans_comm_id, error)
+
+        if getattr(error, 'code', ieee1451.ErrorCode.NO_ERROR) == \
+                ieee1451.ErrorCode.NO_ERROR:
+            sample_data = self.calibrate(tim_id, channel_id, sample_data)
+            self.observe_sample(tim_id, channel_id, sample_data)
 
         result = {'error_code': error,
                   'ncap_id': ncap_id,
@@ -112,18 +213,22 @@ class TransducerDataAccessServices(object):
                             ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
                             ieee1451.ErrorCode.NO_ERROR)
 
-
-
-        opened = self.transducer_access.open(tim_id, channel_id)
+        opened = self.open_session(tim_id, channel_id)
         trans_comm_id = opened['trans_comm_id']
         error = opened['error_code']
+        if getattr(error, 'code', ieee1451.ErrorCode.NO_ERROR) != \
+                ieee1451.ErrorCode.NO_ERROR:
+            return {'error_code': error,
+                    'ncap_id': ncap_id,
+                    'tim_id': tim_id,
+                    'channel_id': channel_id}
 
         written = self.transducer_access.write_data(trans_comm_id,
                                                        timeout,
                                                        sampling_mode,
                                                        arg_array)
         error = written['error_code']
-        self.transducer_access.close(trans_comm_id)
+        self.close_session(trans_comm_id, error)
 
         result = {'error_code': error,
                   'ncap_id': ncap_id,
@@ -131,3 +236,1400 @@ class TransducerDataAccessServices(object):
                   'channel_id': channel_id}
 
         return result
+
+    def nonblocking_io(self):
+        """Return True if the TransducerAccess object completes reads and
+        writes through start_read_data and start_write_data. Backends opt
+        in with a true nonblocking_io attribute."""
+        return getattr(self.transducer_access, 'nonblocking_io', False) \
+            is True
+
+    def _start_operation(self, tim_id, channel_id, timeout, start, finish,
+                         deferred):
+        """Open a session and start a non-blocking operation on it.
+
+        The session is closed and deferred resolved with finish(values,
+        error) from the callback of the operation, or with a TIMEOUT error
+        once timeout plus callback_grace has elapsed without one. An
+        operation whose ID is still in use by a pending one is resolved
+        with a LOCKED_RESOURCE error.
+
+        :param start: callable taking the trans_comm_id and returning the
+            result of the start_* call
+        """
+        opened = self.open_session(tim_id, channel_id)
+        error = opened['error_code']
+        if getattr(error, 'code', ieee1451.ErrorCode.NO_ERROR) != \
+                ieee1451.ErrorCode.NO_ERROR:
+            deferred.resolve(finish(None, error))
+            return
+        trans_comm_id = opened['trans_comm_id']
+
+        try:
+            started = start(trans_comm_id)
+        except Exception as e:
+            logger.error('TransducerDataAccessServices: starting an '
+                         'operation failed: %s', e)
+            error = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                   ieee1451.ErrorCode.NETWORK_FAILURE)
+            self.close_session(trans_comm_id, error)
+            deferred.resolve(finish(None, error))
+            return
+        error = started['error_code']
+        if getattr(error, 'code', ieee1451.ErrorCode.NO_ERROR) != \
+                ieee1451.ErrorCode.NO_ERROR:
+            self.close_session(trans_comm_id, error)
+            deferred.resolve(finish(None, error))
+            return
+        operation_id = started['operation_id']
+
+        def complete(values, error):
+            self.close_session(trans_comm_id, error)
+            deferred.resolve(finish(values, error))
+
+        def expired():
+            error = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                   ieee1451.ErrorCode.TIMEOUT)
+            try:
+                self.transducer_access.cancel(operation_id)
+            finally:
+                self.close_session(trans_comm_id, error)
+                deferred.resolve(finish(None, error))
+
+        if not self.operation_table.add(
+                        operation_id,
+                        timeout.total_seconds() + self.callback_grace,
+                        complete, expired):
+            # the backend reused the ID of an operation still pending, the
+            # callbacks of the two could not be told apart
+            error = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                   ieee1451.ErrorCode.LOCKED_RESOURCE)
+            self.close_session(trans_comm_id, error)
+            deferred.resolve(finish(None, error))
+
+    def start_read_transducer_sample_data_from_a_channel_of_a_tim(
+            self, ncap_id, tim_id, channel_id, timeout, sampling_mode):
+        """Read a single sensor data from a channel of a TIM without
+        holding the calling thread while the read is pending.
+
+        When nonblocking_io() is true the read is started with
+        TransducerAccess.start_read_data and completed by its
+        measurement_update callback through the operation table, otherwise
+        read_transducer_sample_data_from_a_channel_of_a_tim is called.
+
+        Args:
+            ncap_id: ID of the NCAP application being queried
+            tim_id: ID of the TIM being queried
+            channel_id: the channel ID of the TIM
+            timeout: The timeout interval before reporting a timeout error_code
+            sampling_mode: The sampling mode selection
+
+        Returns: an operation_table.DeferredResult resolved with the result
+            of read_transducer_sample_data_from_a_channel_of_a_tim
+        """
+        deferred = operation_table.DeferredResult()
+        if not self.nonblocking_io():
+            deferred.resolve(
+                self.read_transducer_sample_data_from_a_channel_of_a_tim(
+                        ncap_id, tim_id, channel_id, timeout, sampling_mode))
+            return deferred
+
+        def start(trans_comm_id):
+            return self.transducer_access.start_read_data(
+                            trans_comm_id, ieee1451.TimeInstance(0, 0),
+                            timeout, sampling_mode, self.operation_table)
+
+        def finish(sample_data, error):
+            if sample_data is None:
+                sample_data = ieee1451.ArgumentArray()
+            elif getattr(error, 'code', ieee1451.ErrorCode.NO_ERROR) == \
+                    ieee1451.ErrorCode.NO_ERROR:
+                sample_data = self.calibrate(tim_id, channel_id, sample_data)
+                self.observe_sample(tim_id, channel_id, sample_data)
+            return {'error_code': error,
+                    'ncap_id': ncap_id,
+                    'tim_id': tim_id,
+                    'channel_id': channel_id,
+                    'sample_data': sample_data}
+
+        self._start_operation(tim_id, channel_id, timeout, start, finish,
+                              deferred)
+        return deferred
+
+    def start_write_transducer_sample_data_to_a_channel_of_a_tim(
+            self, ncap_id, tim_id, channel_id, timeout, sampling_mode,
+            sample_data):
+        """Write transducer sample data to a channel of a TIM without
+        holding the calling thread while the write is pending.
+
+        When nonblocking_io() is true the write is started with
+        TransducerAccess.start_write_data and completed by its
+        actuation_complete callback through the operation table, otherwise
+        write_transducer_sample_data_to_a_channel_of_a_tim is called.
+
+        Args:
+            ncap_id: ID of the NCAP application being queried
+            tim_id: ID of the TIM being queried
+            channel_id: the channel ID of the TIM
+            timeout: The timeout interval before reporting a timeout error_code
+            sampling_mode: The sampling mode selection
+            sample_data: The sample data to be written.
+
+        Returns: an operation_table.DeferredResult resolved with the result
+            of write_transducer_sample_data_to_a_channel_of_a_tim
+        """
+        deferred = operation_table.DeferredResult()
+        if not self.nonblocking_io():
+            deferred.resolve(
+                self.write_transducer_sample_data_to_a_channel_of_a_tim(
+                        ncap_id, tim_id, channel_id, timeout, sampling_mode,
+                        sample_data))
+            return deferred
+
+        if type(sample_data) is not ieee1451.ArgumentArray:
+            arg_array = ieee1451.ArgumentArray()
+            arg_array.put_by_index(0, ieee1451.Argument(value=sample_data))
+        else:
+            arg_array = sample_data
+
+        def start(trans_comm_id):
+            return self.transducer_access.start_write_data(
+                            trans_comm_id, ieee1451.TimeInstance(0, 0),
+                            timeout, sampling_mode, arg_array,
+                            self.operation_table)
+
+        def finish(values, error):
+            return {'error_code': error,
+                    'ncap_id': ncap_id,
+                    'tim_id': tim_id,
+                    'channel_id': channel_id}
+
+        self._start_operation(tim_id, channel_id, timeout, start, finish,
+                              deferred)
+        return deferred
+
+    def read_transducer_block_data_from_a_channel_of_a_tim(self,
+                                                           ncap_id,
+                                                           tim_id,
+                                                           channel_id,
+                                                           timeout,
+                                                           number_of_samples,
+                                                           sample_interval,
+                                                           start_time,
+                                                           sampling_mode=0):
+        """
+        Read a block of sensor data from a channel of a TIM
+
+        Samples are read at start_time + k * sample_interval using the
+        monotonic clock, so the interval does not drift. When the
+        TransducerAccess object offers a native read_block method and
+        native_block_reads is set, the whole block is read by the TIM
+        instead.
+
+        Args:
+            ncap_id: ID of the NCAP application being queried
+            tim_id: ID of the TIM being queried
+            channel_id: the channel ID of the TIM
+            timeout: The timeout interval of each read
+            number_of_samples: The number of samples to read
+            sample_interval: TimeDuration between samples
+            start_time: TimeInstance of the first sample, secs == 0,
+                        nsecs == 0 means start immediately
+            sampling_mode: The sampling mode selection
+
+        Returns: A dictionary containing the following:
+            error_code: an error code, MEMORY_RESOURCE_EXCEEDED when
+                        number_of_samples exceeds max_block_samples
+            ncap_id: the ncap id
+            tim_id: the id of the tim that was read
+            channel_id: the id of the channel read from the TIM
+            sample_data: an ArgumentArray holding the "samples" and their
+                         "timestamps" in seconds since the epoch
+        """
+        error = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                               ieee1451.ErrorCode.NO_ERROR)
+
+        if number_of_samples > self.max_block_samples:
+            error = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                   ieee1451.ErrorCode.MEMORY_RESOURCE_EXCEEDED)
+            return {'error_code': error,
+                    'ncap_id': ncap_id,
+                    'tim_id': tim_id,
+                    'channel_id': channel_id,
+                    'sample_data': ieee1451.ArgumentArray()}
+
+        opened = self.open_session(tim_id, channel_id)
+        trans_comm_id = opened['trans_comm_id']
+        error = opened['error_code']
+        if getattr(error, 'code', ieee1451.ErrorCode.NO_ERROR) != \
+                ieee1451.ErrorCode.NO_ERROR:
+            return {'error_code': error,
+                    'ncap_id': ncap_id,
+                    'tim_id': tim_id,
+                    'channel_id': channel_id,
+                    'sample_data': ieee1451.ArgumentArray()}
+
+        read_block = getattr(self.transducer_access, 'read_block', None)
+        if self.native_block_reads and callable(read_block):
+            read = read_block(trans_comm_id, timeout, number_of_samples,
+                              sample_interval, start_time)
+            error = read['error_code']
+            sample_data = self._calibrate_block(tim_id, channel_id,
+                                                read['result'])
+        else:
+            evaluator = self.calibration.get_evaluator(tim_id, channel_id)
+            buf = sample_scheduler.SampleBuffer(number_of_samples)
+            scheduler = sample_scheduler.DeadlineScheduler(
+                            sample_interval.total_seconds(),
+                            sample_scheduler.start_deadline(start_time))
+            for k in range(number_of_samples):
+                timestamp = scheduler.wait(k)
+                read = self.transducer_access.read_data(trans_comm_id,
+                                                        timeout,
+                                                        sampling_mode)
+                error = read['error_code']
+                if getattr(error, 'code', ieee1451.ErrorCode.NO_ERROR) != \
+                        ieee1451.ErrorCode.NO_ERROR:
+                    break
+                buf.put(corrected(evaluator, sample_scheduler.sample_value(
+                                                        read['result'])),
+                        timestamp)
+            sample_data = buf.to_argument_array()
+
+        self.close_session(trans_comm_id, error)
+
+        result = {'error_code': error,
+                  'ncap_id': ncap_id,
+                  'tim_id': tim_id,
+                  'channel_id': channel_id,
+                  'sample_data': sample_data}
+
+        return result
+
+    def _read_group(self, tim_id, channel_ids, timeout, sampling_mode):
+        """Read several channels of a TIM through a single open_group
+        session.
+
+        :return: the list of per channel results, or None if the backend
+            does not support group sessions
+        """
+        try:
+            opened = self.transducer_access.open_group(
+                                [tim_id] * len(channel_ids), channel_ids)
+        except NotImplementedError:
+            return None
+        error = opened['error_code']
+        if getattr(error, 'code', ieee1451.ErrorCode.NO_ERROR) != \
+                ieee1451.ErrorCode.NO_ERROR:
+            return None
+
+        trans_comm_id = opened['trans_comm_id']
+        try:
+            read = self.transducer_access.read_data(trans_comm_id, timeout,
+                                                    sampling_mode)
+        finally:
+            self.transducer_access.close(trans_comm_id)
+
+        error = read['error_code']
+        group = read['result']
+        # the readings of a group are nested in a "result" ArgumentArray
+        if isinstance(group, ieee1451.ArgumentArray) and \
+                'result' in group.indicies:
+            group = group.get_by_name('result').value
+
+        results = []
+        for i in range(len(channel_ids)):
+            sample_data = ieee1451.ArgumentArray()
+            if isinstance(group, ieee1451.ArgumentArray) and \
+                    i in group.arguments:
+                sample_data.put_by_name('result', group.get_by_index(i))
+            results.append({'error_code': error, 'sample_data': sample_data})
+        return results
+
+    def _read_each(self, ncap_id, tim_id, channel_ids, timeout,
+                   sampling_mode):
+        """Read several channels of a TIM concurrently, one session per
+        channel, all within the timeout.
+
+        :return: the list of per channel results
+        """
+        def read(channel_id):
+            return lambda: \
+                self.read_transducer_sample_data_from_a_channel_of_a_tim(
+                        ncap_id, tim_id, channel_id, timeout, sampling_mode)
+
+        tasks = worker_pool.run_concurrently(
+                            [read(channel_id) for channel_id in channel_ids],
+                            self.max_workers, timeout.total_seconds())
+
+        results = []
+        for task in tasks:
+            if task.done and task.exception is None:
+                results.append(task.value)
+                continue
+            code = ieee1451.ErrorCode.TIMEOUT
+            if task.exception is not None:
+                code = ieee1451.ErrorCode.NETWORK_FAILURE
+            results.append({'error_code': ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                code),
+                            'sample_data': ieee1451.ArgumentArray()})
+        return results
+
+    def read_transducer_sample_data_from_multiple_channels_of_a_tim(
+            self, ncap_id, tim_id, channel_ids, timeout, sampling_mode):
+        """
+        Read a single sensor data from several channels of a TIM
+
+        The channels are read through one open_group session when the
+        TransducerAccess object supports it and group_reads is set,
+        otherwise they are read concurrently over one session each. Either
+        way all readings are collected within timeout.
+
+        Args:
+            ncap_id: ID of the NCAP application being queried
+            tim_id: ID of the TIM being queried
+            channel_ids: the list of channel IDs of the TIM
+            timeout: The timeout interval before reporting a timeout error_code
+            sampling_mode: The sampling mode selection
+
+        Returns: A dictionary containing the following:
+            error_code: the first error code reported by a channel
+            ncap_id: the ncap id
+            tim_id: the id of the tim that was read
+            channel_ids: the ids of the channels read from the TIM
+            error_codes: the error code of each channel
+            sample_data: an ArgumentArray holding, in channel order, the
+                         sample data ArgumentArray of each channel
+        """
+        error = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                               ieee1451.ErrorCode.NO_ERROR)
+
+        results = None
+        if self.group_reads and len(channel_ids) > 1:
+            results = self._read_group(tim_id, channel_ids, timeout,
+                                       sampling_mode)
+        if results is None:
+            results = self._read_each(ncap_id, tim_id, channel_ids, timeout,
+                                      sampling_mode)
+
+        sample_data = ieee1451.ArgumentArray()
+        error_codes = []
+        for i, res in enumerate(results):
+            sample_data.put_by_index(i, ieee1451.Argument(
+                                ieee1451.TypeCode.UNKNOWN_TC,
+                                res['sample_data']))
+            res_error = res['error_code']
+            error_codes.append(res_error.serializable()['Error'])
+            if error.code == ieee1451.ErrorCode.NO_ERROR and \
+                    res_error.code != ieee1451.ErrorCode.NO_ERROR:
+                error = res_error
+
+        result = {'error_code': error,
+                  'ncap_id': ncap_id,
+                  'tim_id': tim_id,
+                  'channel_ids': channel_ids,
+                  'error_codes': error_codes,
+                  'sample_data': sample_data}
+
+        return result
+
+    def _acquire_tim_block(self, tim_id, channel_ids, timeout,
+                           number_of_samples, interval, start,
+                           sampling_mode):
+        """Read a block of samples from channels of one TIM, sample k of
+        every channel being taken at start + k * interval. The channels are
+        read one after another and every reading of sample k is stamped
+        with the time the sample was due.
+
+        :return: the list of (error_code, SampleBuffer) of each channel
+        """
+        no_error = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                  ieee1451.ErrorCode.NO_ERROR)
+        sessions = []
+        errors = []
+        for channel_id in channel_ids:
+            opened = self.open_session(tim_id, channel_id)
+            error = opened['error_code']
+            if getattr(error, 'code', ieee1451.ErrorCode.NO_ERROR) != \
+                    ieee1451.ErrorCode.NO_ERROR:
+                sessions.append(None)
+                errors.append(error)
+            else:
+                sessions.append(opened['trans_comm_id'])
+                errors.append(no_error)
+        buffers = [sample_scheduler.SampleBuffer(number_of_samples)
+                   for _ in channel_ids]
+        evaluators = [self.calibration.get_evaluator(tim_id, channel_id)
+                      for channel_id in channel_ids]
+
+        scheduler = sample_scheduler.DeadlineScheduler(interval, start)
+        try:
+            for k in range(number_of_samples):
+                if all(s is None for s in sessions):
+                    break
+                timestamp = scheduler.wait(k)
+                for i, trans_comm_id in enumerate(sessions):
+                    if trans_comm_id is None:
+                        continue
+                    read = self.transducer_access.read_data(trans_comm_id,
+                                                            timeout,
+                                                            sampling_mode)
+                    error = read['error_code']
+                    if getattr(error, 'code', ieee1451.ErrorCode.NO_ERROR) \
+                            != ieee1451.ErrorCode.NO_ERROR:
+                        errors[i] = error
+                        self.close_session(trans_comm_id, error)
+                        sessions[i] = None
+                        continue
+                    buffers[i].put(corrected(
+                                        evaluators[i],
+                                        sample_scheduler.sample_value(
+                                                        read['result'])),
+                                   timestamp, k)
+        finally:
+            for trans_comm_id in sessions:
+                if trans_comm_id is not None:
+                    self.close_session(trans_comm_id)
+
+        return list(zip(errors, buffers))
+
+    def read_transducer_block_data_from_multiple_channels_of_multiple_tims(
+            self, ncap_id, tim_ids, channel_ids, timeout, number_of_samples,
+            sample_interval, start_time, sampling_mode=0):
+        """
+        Read a synchronized block of sensor data from channels of several
+        TIMs
+
+        There is a one-to-one correspondence between the positions of the
+        tim_ids and channel_ids lists, as for TransducerAccess.open_group.
+        Each TIM is read by its own worker and every worker takes sample k
+        at start_time + k * sample_interval. The series are then placed on
+        that common time base, a sample missed by a channel leaving a null
+        slot, so the columns of the response line up.
+
+        Args:
+            ncap_id: ID of the NCAP application being queried
+            tim_ids: the list of TIM IDs
+            channel_ids: the list of channel IDs, one per TIM ID
+            timeout: The timeout interval of each read
+            number_of_samples: The number of samples to read
+            sample_interval: TimeDuration between samples
+            start_time: TimeInstance of the first sample, secs == 0,
+                        nsecs == 0 means start immediately
+            sampling_mode: The sampling mode selection
+
+        Returns: A dictionary containing the following:
+            error_code: the first error code reported by a channel
+            ncap_id: the ncap id
+            tim_ids: the ids of the TIMs read
+            channel_ids: the ids of the channels read
+            error_codes: the error code of each channel
+            time_base: the time of each sample slot in seconds since the
+                       epoch
+            sample_data: an ArgumentArray holding, in channel order, an
+                         ArgumentArray of the "samples" of each channel and
+                         the "timestamps" they were taken at
+        """
+        error = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                               ieee1451.ErrorCode.NO_ERROR)
+        result = {'error_code': error,
+                  'ncap_id': ncap_id,
+                  'tim_ids': tim_ids,
+                  'channel_ids': channel_ids,
+                  'error_codes': [],
+                  'time_base': [],
+                  'sample_data': ieee1451.ArgumentArray()}
+
+        if number_of_samples * len(channel_ids) > self.max_block_samples:
+            result['error_code'] = ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                ieee1451.ErrorCode.MEMORY_RESOURCE_EXCEEDED)
+            return result
+
+        # the channels of each TIM, in order of first appearance
+        order = []
+        channels = {}
+        for tim_id, channel_id in zip(tim_ids, channel_ids):
+            if tim_id not in channels:
+                order.append(tim_id)
+                channels[tim_id] = []
+            channels[tim_id].append(channel_id)
+
+        interval = sample_interval.total_seconds()
+        start = sample_scheduler.start_deadline(start_time)
+        time_base = sample_scheduler.DeadlineScheduler(interval, start)
+
+        def acquire(tim_id):
+            return lambda: self._acquire_tim_block(
+                                tim_id, channels[tim_id], timeout,
+                                number_of_samples, interval, start,
+                                sampling_mode)
+
+        duration = max(0.0, start - sample_scheduler.clock()) + \
+            number_of_samples * interval + timeout.total_seconds()
+        tasks = worker_pool.run_concurrently(
+                            [acquire(tim_id) for tim_id in order],
+                            len(order), duration)
+
+        per_channel = {}
+        for tim_id, task in zip(order, tasks):
+            if task.done and task.exception is None:
+                outcome = task.value
+            else:
+                code = ieee1451.ErrorCode.TIMEOUT
+                if task.exception is not None:
+                    code = ieee1451.ErrorCode.NETWORK_FAILURE
+                failure = ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                code)
+                outcome = [(failure, sample_scheduler.SampleBuffer(0))
+                           for _ in channels[tim_id]]
+            for channel_id, res in zip(channels[tim_id], outcome):
+                per_channel[(tim_id, channel_id)] = res
+
+        t0 = time_base.deadline(0) + time_base.epoch_offset
+        for i, key in enumerate(zip(tim_ids, channel_ids)):
+            res_error, buf = per_channel[key]
+            aligned = buf.aligned(number_of_samples)
+            if aligned.dropped:
+                logger.warning('TransducerDataAccessServices: dropped %d '
+                               'samples of channel %s of TIM %s outside '
+                               'the block', aligned.dropped, key[1],
+                               key[0])
+            result['sample_data'].put_by_index(i, ieee1451.Argument(
+                                ieee1451.TypeCode.UNKNOWN_TC,
+                                aligned.to_argument_array()))
+            result['error_codes'].append(res_error.serializable()['Error'])
+            if error.code == ieee1451.ErrorCode.NO_ERROR and \
+                    res_error.code != ieee1451.ErrorCode.NO_ERROR:
+                error = res_error
+
+        result['error_code'] = error
+        result['time_base'] = [t0 + k * interval
+                               for k in range(number_of_samples)]
+
+        return result
+
+    def add_operation(self, target, total=0):
+        """Create and start a sample_scheduler.ScheduledOperation, dropping
+        the oldest finished operations beyond max_finished_operations.
+
+        :return: the started operation
+        """
+        with self.operations_lock:
+            operation = sample_scheduler.ScheduledOperation(
+                                self.next_operation_id, target, total)
+            self.next_operation_id += 1
+            finished = [op_id for op_id, op in self.operations.items()
+                        if op.finished.is_set()]
+            excess = len(finished) - self.max_finished_operations
+            for op_id in finished[:max(0, excess)]:
+                del self.operations[op_id]
+            self.operations[operation.operation_id] = operation
+        operation.start()
+        return operation
+
+    def get_operation(self, operation_id):
+        """Return the operation with the given ID or None."""
+        with self.operations_lock:
+            return self.operations.get(operation_id)
+
+    def _write_block(self, operation, tim_id, channel_id, timeout, values,
+                     tc, interval, start, sampling_mode):
+        """Write values at start + k * interval, run by a block write
+        operation thread."""
+        opened = self.open_session(tim_id, channel_id)
+        error = opened['error_code']
+        if getattr(error, 'code', ieee1451.ErrorCode.NO_ERROR) != \
+                ieee1451.ErrorCode.NO_ERROR:
+            operation.error_code = error
+            return
+        trans_comm_id = opened['trans_comm_id']
+
+        scheduler = sample_scheduler.DeadlineScheduler(interval, start)
+        operation.scheduler = scheduler
+        try:
+            for k, value in enumerate(values):
+                if scheduler.wait(k, operation.cancelled) is None:
+                    break
+                arg_array = ieee1451.ArgumentArray()
+                arg_array.put_by_index(0, ieee1451.Argument(tc, value))
+                written = self.transducer_access.write_data(trans_comm_id,
+                                                            timeout,
+                                                            sampling_mode,
+                                                            arg_array)
+                error = written['error_code']
+                if getattr(error, 'code', ieee1451.ErrorCode.NO_ERROR) != \
+                        ieee1451.ErrorCode.NO_ERROR:
+                    operation.error_code = error
+                    break
+                operation.completed += 1
+        except Exception:
+            # recorded before the session is released so a broken session
+            # does not go back to the pool as healthy
+            operation.error_code = ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                ieee1451.ErrorCode.NETWORK_FAILURE)
+            raise
+        finally:
+            self.close_session(trans_comm_id, operation.error_code)
+
+    def write_transducer_block_data_to_a_channel_of_a_tim(self,
+                                                          ncap_id,
+                                                          tim_id,
+                                                          channel_id,
+                                                          timeout,
+                                                          sample_interval,
+                                                          start_time,
+                                                          sample_data,
+                                                          sampling_mode=0):
+        """
+        Write a block of data to a channel of a TIM, e.g. an actuator
+        waveform
+
+        The values are written in the background at start_time + k *
+        sample_interval on the monotonic clock and the call returns at
+        once. The operation_id of the response is passed to
+        report_block_operation to follow the write and to
+        cancel_block_operation to stop it.
+
+        Args:
+            ncap_id: ID of the NCAP application being queried
+            tim_id: ID of the TIM being written
+            channel_id: the channel ID of the TIM
+            timeout: The timeout interval of each write
+            sample_interval: TimeDuration between writes
+            start_time: TimeInstance of the first write, secs == 0,
+                        nsecs == 0 means start immediately
+            sample_data: an ArgumentArray holding the "samples" to write,
+                         typically as a FLOAT64_ARRAY_TC Argument
+            sampling_mode: The sampling mode selection
+
+        Returns: A dictionary containing the following:
+            error_code: an error code
+            ncap_id: the ncap id
+            tim_id: the id of the tim written
+            channel_id: the id of the channel written
+            operation_id: the id of the block write operation
+        """
+        error = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                               ieee1451.ErrorCode.NO_ERROR)
+
+        values, tc = sample_scheduler.block_values(sample_data)
+        interval = sample_interval.total_seconds()
+        start = sample_scheduler.start_deadline(start_time)
+
+        operation = self.add_operation(
+                            lambda op: self._write_block(
+                                op, tim_id, channel_id, timeout, values, tc,
+                                interval, start, sampling_mode),
+                            len(values))
+
+        result = {'error_code': error,
+                  'ncap_id': ncap_id,
+                  'tim_id': tim_id,
+                  'channel_id': channel_id,
+                  'operation_id': operation.operation_id}
+
+        return result
+
+    def report_block_operation(self, ncap_id, operation_id):
+        """
+        Report the progress and achieved timing of a block operation
+
+        Args:
+            ncap_id: ID of the NCAP application being queried
+            operation_id: the id returned when the operation was started
+
+        Returns: A dictionary containing the following:
+            error_code: UNKNOWN_MSGID if there is no such operation,
+                        otherwise the error code of the operation
+            ncap_id: the ncap id
+            operation_id: the id of the operation
+            state: pending, running, done, cancelled or failed
+            completed: the number of samples handled so far
+            total: the number of samples of the operation
+            timing: the count, mean_lateness, max_lateness and jitter of
+                    the samples in seconds
+        """
+        operation = self.get_operation(operation_id)
+        if operation is None:
+            return {'error_code': ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                ieee1451.ErrorCode.UNKNOWN_MSGID),
+                    'ncap_id': ncap_id,
+                    'operation_id': operation_id}
+
+        result = operation.status()
+        result.update({'error_code': operation.error_code,
+                       'ncap_id': ncap_id,
+                       'operation_id': operation_id})
+
+        return result
+
+    def cancel_block_operation(self, ncap_id, operation_id):
+        """
+        Cancel a block operation
+
+        Args:
+            ncap_id: ID of the NCAP application being queried
+            operation_id: the id returned when the operation was started
+
+        Returns: A dictionary containing the following:
+            error_code: UNKNOWN_MSGID if there is no such operation
+            ncap_id: the ncap id
+            operation_id: the id of the operation
+            cancelled: False if the operation had already finished
+        """
+        error = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                               ieee1451.ErrorCode.NO_ERROR)
+        cancelled = False
+        operation = self.get_operation(operation_id)
+        if operation is None:
+            error = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                   ieee1451.ErrorCode.UNKNOWN_MSGID)
+        else:
+            cancelled = operation.cancel()
+
+        result = {'error_code': error,
+                  'ncap_id': ncap_id,
+                  'operation_id': operation_id,
+                  'cancelled': cancelled}
+
+        return result
+
+    def subscribe_transducer_stream(self, ncap_id, tim_id, channel_id,
+                                    client_id, batch_size=1,
+                                    max_latency=None):
+        """
+        Subscribe a client to the measurement stream of a channel of a TIM.
+        This is an ncaplite extension to the 1451.1 transducer services.
+
+        All subscribers of a channel share one backend stream, see
+        stream_manager.StreamManager. Measurements are pushed to the client
+        in batches of batch_size, a partial batch being sent max_latency
+        seconds after its first measurement.
+
+        Args:
+            ncap_id: ID of the NCAP application being queried
+            tim_id: ID of the TIM
+            channel_id: the channel ID of the TIM
+            client_id: the JID the measurements are pushed to, set by the
+                       NCAP to the JID of the sender of the request
+            batch_size: the number of measurements pushed at once
+            max_latency: optional TimeDuration after which a partial batch
+                         is pushed
+
+        Returns: A dictionary containing the following:
+            error_code: an error code
+            ncap_id: the ncap id
+            tim_id: the id of the tim
+            channel_id: the id of the channel
+            operation_id: the operation id of the stream
+        """
+        if max_latency is not None:
+            max_latency = max_latency.total_seconds()
+        subscribed = self.stream_manager.subscribe(client_id, tim_id,
+                                                   channel_id, batch_size,
+                                                   max_latency)
+
+        result = {'error_code': subscribed['error_code'],
+                  'ncap_id': ncap_id,
+                  'tim_id': tim_id,
+                  'channel_id': channel_id,
+                  'operation_id': subscribed['operation_id']}
+
+        return result
+
+    def unsubscribe_transducer_stream(self, ncap_id, tim_id, channel_id,
+                                      client_id):
+        """
+        Unsubscribe a client from the measurement stream of a channel of a
+        TIM. This is an ncaplite extension to the 1451.1 transducer
+        services.
+
+        Args:
+            ncap_id: ID of the NCAP application being queried
+            tim_id: ID of the TIM
+            channel_id: the channel ID of the TIM
+            client_id: the JID of the subscriber, set by the NCAP to the
+                       JID of the sender of the request
+
+        Returns: A dictionary containing the following:
+            error_code: an error code
+            ncap_id: the ncap id
+            tim_id: the id of the tim
+            channel_id: the id of the channel
+            unsubscribed: False if the client was not subscribed
+        """
+        error = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                               ieee1451.ErrorCode.NO_ERROR)
+        unsubscribed = self.stream_manager.unsubscribe(client_id, tim_id,
+                                                       channel_id)
+
+        result = {'error_code': error,
+                  'ncap_id': ncap_id,
+                  'tim_id': tim_id,
+                  'channel_id': channel_id,
+                  'unsubscribed': unsubscribed}
+
+        return result
+
+    def load_calibration(self, tim_id, channel_id, cal_teds, version=None):
+        """Apply a Calibration TEDS to the values read from a channel.
+
+        :param cal_teds: the Calibration TEDS as XML text or dictionary, or
+            the ArgumentArray returned by read_teds
+        :param version: the TEDS version, see
+            CalibrationEngine.load_cal_teds
+        :return: the CalibrationEvaluator for the channel
+        """
+        if isinstance(cal_teds, ieee1451.ArgumentArray):
+            cal_teds = cal_teds.get_by_index(0).value
+        return self.calibration.load_cal_teds(tim_id, channel_id, cal_teds,
+                                              version)
+
+    def calibrate(self, tim_id, channel_id, sample_data):
+        """Correct the reading of a channel with its Calibration TEDS.
+
+        :param sample_data: the result of a read, an ArgumentArray holding
+            the reading or the reading itself
+        :return: sample_data with the reading corrected, sample_data itself
+            if the channel has no Calibration TEDS or the reading is not a
+            number
+        """
+        evaluator = self.calibration.get_evaluator(tim_id, channel_id)
+        if evaluator is None:
+            return sample_data
+        if not isinstance(sample_data, ieee1451.ArgumentArray):
+            return corrected(evaluator, sample_data)
+        idx = sample_data.indicies.get('result', 0)
+        if idx not in sample_data.arguments:
+            return sample_data
+        value = sample_data.get_by_index(idx).value
+        if not is_number(value):
+            return sample_data
+        # the read result may be shared with the caller, correct a copy
+        calibrated = ieee1451.ArgumentArray()
+        calibrated.arguments = dict(sample_data.arguments)
+        calibrated.indicies = dict(sample_data.indicies)
+        calibrated.arguments[idx] = ieee1451.Argument(
+                            ieee1451.TypeCode.FLOAT64_TC, evaluator(value))
+        return calibrated
+
+    def _calibrate_block(self, tim_id, channel_id, sample_data):
+        """Correct the "samples" of a block read with the Calibration TEDS
+        of the channel."""
+        evaluator = self.calibration.get_evaluator(tim_id, channel_id)
+        if evaluator is None or \
+                not isinstance(sample_data, ieee1451.ArgumentArray) or \
+                'samples' not in sample_data.indicies:
+            return sample_data
+        idx = sample_data.indicies['samples']
+        samples = [corrected(evaluator, v)
+                   for v in sample_data.get_by_index(idx).value]
+        calibrated = ieee1451.ArgumentArray()
+        calibrated.arguments = dict(sample_data.arguments)
+        calibrated.indicies = dict(sample_data.indicies)
+        calibrated.arguments[idx] = ieee1451.Argument(
+                            ieee1451.TypeCode.FLOAT64_ARRAY_TC, samples)
+        return calibrated
+
+    def observe_sample(self, tim_id, channel_id, sample_data,
+                       timestamp=None):
+        """Pass a reading of a channel to its sensor alert rules and its
+        sample history, if any.
+
+        :param sample_data: the result of a read or a stream measurement
+        :param timestamp: the time of the reading in seconds since the
+            epoch, defaults to now
+        """
+        history = self.sample_histories.get((tim_id, channel_id))
+        if history is None and \
+                not self.sensor_alerts.has_rules(tim_id, channel_id):
+            return
+        value = sample_scheduler.sample_value(sample_data)
+        if history is not None:
+            history.append(time.time() if timestamp is None else timestamp,
+                           value)
+        self.sensor_alerts.feed(tim_id, channel_id, value)
+
+    def _feed_stream_batch(self, client_id, tim_id, channel_id, batch):
+        """Pass streamed measurements of a monitored channel on."""
+        for meas_values in batch:
+            self.observe_sample(tim_id, channel_id, meas_values)
+
+    def _sample_channel(self, operation, tim_id, channel_id, interval):
+        """Read a channel every interval seconds until cancelled, run by the
+        sampler operation of a monitored channel. Each reading is observed
+        by read_transducer_sample_data_from_a_channel_of_a_tim."""
+        timeout = ieee1451.TimeDuration(int(interval),
+                                        int(interval % 1 * 1e9))
+        scheduler = sample_scheduler.DeadlineScheduler(interval)
+        operation.scheduler = scheduler
+        k = 0
+        while scheduler.wait(k, operation.cancelled) is not None:
+            self.read_transducer_sample_data_from_a_channel_of_a_tim(
+                                None, tim_id, channel_id, timeout, 0)
+            operation.completed += 1
+            k += 1
+
+    def _watch_channel(self, tim_id, channel_id, feature, sampling_rate):
+        """Start feeding the values of a channel to observe_sample, from a
+        sampler reading it sampling_rate times a second or else from a
+        shared measurement stream. The monitor lock must be held.
+
+        A channel is monitored at a single rate: a sampling_rate differing
+        from the one of the running monitor is an ILLEGAL_MODE error, while
+        no sampling_rate accepts the running monitor whatever its source.
+
+        :param feature: the name of the feature using the values
+        :return: the error code of starting the stream
+        """
+        error = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                               ieee1451.ErrorCode.NO_ERROR)
+        key = (tim_id, channel_id)
+        if key in self.channel_monitors:
+            if sampling_rate and \
+                    sampling_rate != self.channel_monitors[key][2]:
+                return ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                ieee1451.ErrorCode.ILLEGAL_MODE)
+        else:
+            operation = None
+            if sampling_rate:
+                operation = self.add_operation(
+                            lambda op: self._sample_channel(
+                                op, tim_id, channel_id, 1.0 / sampling_rate))
+            else:
+                subscribed = self.stream_manager.subscribe(
+                                        MONITOR_CLIENT, tim_id, channel_id)
+                error = subscribed['error_code']
+                if getattr(error, 'code', ieee1451.ErrorCode.NO_ERROR) != \
+                        ieee1451.ErrorCode.NO_ERROR:
+                    return error
+            self.channel_monitors[key] = (operation, set(),
+                                          sampling_rate or None)
+        self.channel_monitors[key][1].add(feature)
+        return error
+
+    def _unwatch_channel(self, tim_id, channel_id, feature):
+        """Stop feeding the values of a channel once no feature uses them.
+        The monitor lock must be held."""
+        key = (tim_id, channel_id)
+        if key not in self.channel_monitors:
+            return
+        operation, features, _ = self.channel_monitors[key]
+        features.discard(feature)
+        if features:
+            return
+        del self.channel_monitors[key]
+        if operation is not None:
+            operation.cancel()
+        else:
+            self.stream_manager.unsubscribe(MONITOR_CLIENT, tim_id,
+                                            channel_id)
+
+    def subscribe_sensor_alert(self, ncap_id, tim_id, channel_id,
+                               min_max_threshold, sensor_alert_subscriber,
+                               sampling_rate=None, hysteresis=0.0):
+        """
+        Subscribe to alerts when a channel crosses its thresholds
+
+        The first subscription of a channel starts feeding its values to
+        the alert engine: from a sampler reading the channel sampling_rate
+        times a second, or else from a shared measurement stream. Later
+        subscriptions asking for another sampling_rate fail with
+        ILLEGAL_MODE, see _watch_channel. Readings of the channel by other
+        requests are evaluated too. Alerts are sent only when the value
+        crosses a threshold.
+
+        Args:
+            ncap_id: ID of the NCAP application being queried
+            tim_id: ID of the TIM
+            channel_id: the channel ID of the TIM
+            min_max_threshold: the [minimum, maximum] thresholds, either
+                               may be None
+            sensor_alert_subscriber: the JID the alerts are sent to, set by
+                                     the NCAP to the JID of the sender of
+                                     the request
+            sampling_rate: optional number of readings per second
+            hysteresis: the distance the value has to move back inside a
+                        threshold before the alert clears
+
+        Returns: A dictionary containing the following:
+            error_code: an error code
+            ncap_id: the ncap id
+            tim_id: the id of the tim
+            channel_id: the id of the channel
+            subscription_id: the id used to unsubscribe
+            state: normal, high or low according to the last value
+            sampling_rate: the sampling rate of the channel, None when its
+                           values come from a measurement stream
+        """
+        minimum, maximum = min_max_threshold
+        result = {'error_code': ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                ieee1451.ErrorCode.NO_ERROR),
+                  'ncap_id': ncap_id,
+                  'tim_id': tim_id,
+                  'channel_id': channel_id,
+                  'subscription_id': None,
+                  'state': sensor_alerts.NORMAL,
+                  'sampling_rate': None}
+
+        with self.monitor_lock:
+            error = self._watch_channel(tim_id, channel_id, 'alerts',
+                                        sampling_rate)
+            if getattr(error, 'code', ieee1451.ErrorCode.NO_ERROR) != \
+                    ieee1451.ErrorCode.NO_ERROR:
+                result['error_code'] = error
+                return result
+            rule = self.sensor_alerts.add_rule(sensor_alert_subscriber,
+                                               tim_id, channel_id, minimum,
+                                               maximum, hysteresis)
+            result['sampling_rate'] = \
+                self.channel_monitors[(tim_id, channel_id)][2]
+
+        result['subscription_id'] = rule.subscription_id
+        result['state'] = rule.state
+
+        return result
+
+    def unsubscribe_sensor_alert(self, ncap_id, subscription_id,
+                                 client_id=None):
+        """
+        Remove a sensor alert subscription. The values of the channel stop
+        being sampled or streamed once its last subscription is removed.
+
+        Args:
+            ncap_id: ID of the NCAP application being queried
+            subscription_id: the id returned by subscribe_sensor_alert
+            client_id: optional JID the subscription must belong to, set by
+                       the NCAP to the JID of the sender of the request
+
+        Returns: A dictionary containing the following:
+            error_code: UNKNOWN_MSGID if there is no such subscription of
+                        the client
+            ncap_id: the ncap id
+            subscription_id: the id of the subscription
+        """
+        error = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                               ieee1451.ErrorCode.NO_ERROR)
+        with self.monitor_lock:
+            rule = self.sensor_alerts.remove_rule(subscription_id, client_id)
+            if rule is None:
+                error = ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                ieee1451.ErrorCode.UNKNOWN_MSGID)
+            elif not self.sensor_alerts.has_rules(rule.tim_id,
+                                                  rule.channel_id):
+                self._unwatch_channel(rule.tim_id, rule.channel_id,
+                                      'alerts')
+
+        result = {'error_code': error,
+                  'ncap_id': ncap_id,
+                  'subscription_id': subscription_id}
+
+        return result
+
+    def client_left(self, client_id):
+        """Drop the stream and sensor alert subscriptions of a client which
+        unjoined or went offline.
+
+        :param client_id: the JID of the client, a bare JID also drops the
+            subscriptions of its resources
+        """
+        self.stream_manager.unsubscribe_client(client_id)
+        with self.monitor_lock:
+            for rule in self.sensor_alerts.remove_client(client_id):
+                if not self.sensor_alerts.has_rules(rule.tim_id,
+                                                    rule.channel_id):
+                    self._unwatch_channel(rule.tim_id, rule.channel_id,
+                                          'alerts')
+
+    def enable_sample_history(self, ncap_id, tim_id, channel_id, capacity,
+                              sampling_rate=None):
+        """
+        Keep the last capacity samples of a channel for
+        read_sample_history. This is an ncaplite extension to the 1451.1
+        transducer services.
+
+        The samples come from a sampler reading the channel sampling_rate
+        times a second, or else from a shared measurement stream, as well
+        as from the reads of other requests. A history already kept for
+        the channel is left as it is.
+
+        Args:
+            ncap_id: ID of the NCAP application being queried
+            tim_id: ID of the TIM
+            channel_id: the channel ID of the TIM
+            capacity: the number of samples kept, at most
+                      max_block_samples
+            sampling_rate: optional number of readings per second
+
+        Returns: A dictionary containing the following:
+            error_code: ILLEGAL_MODE for a capacity below 1,
+                        MEMORY_RESOURCE_EXCEEDED above max_block_samples,
+                        or the error of starting the stream
+            ncap_id: the ncap id
+            tim_id: the id of the tim
+            channel_id: the id of the channel
+        """
+        result = {'error_code': ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                ieee1451.ErrorCode.NO_ERROR),
+                  'ncap_id': ncap_id,
+                  'tim_id': tim_id,
+                  'channel_id': channel_id}
+
+        if capacity < 1 or capacity > self.max_block_samples:
+            code = ieee1451.ErrorCode.ILLEGAL_MODE
+            if capacity > self.max_block_samples:
+                code = ieee1451.ErrorCode.MEMORY_RESOURCE_EXCEEDED
+            result['error_code'] = ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                code)
+            return result
+
+        key = (tim_id, channel_id)
+        with self.monitor_lock:
+            if key in self.sample_histories:
+                return result
+            error = self._watch_channel(tim_id, channel_id, 'history',
+                                        sampling_rate)
+            if getattr(error, 'code', ieee1451.ErrorCode.NO_ERROR) == \
+                    ieee1451.ErrorCode.NO_ERROR:
+                self.sample_histories[key] = \
+                    sample_history.SampleHistory(capacity)
+        result['error_code'] = error
+        return result
+
+    def disable_sample_history(self, ncap_id, tim_id, channel_id):
+        """
+        Stop keeping and drop the sample history of a channel. This is an
+        ncaplite extension to the 1451.1 transducer services.
+
+        Args:
+            ncap_id: ID of the NCAP application being queried
+            tim_id: ID of the TIM
+            channel_id: the channel ID of the TIM
+
+        Returns: A dictionary containing the following:
+            error_code: UNKNOWN_DESTID if no history is kept for the
+                        channel
+            ncap_id: the ncap id
+            tim_id: the id of the tim
+            channel_id: the id of the channel
+        """
+        error = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                               ieee1451.ErrorCode.NO_ERROR)
+        with self.monitor_lock:
+            if self.sample_histories.pop((tim_id, channel_id), None) is None:
+                error = ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                ieee1451.ErrorCode.UNKNOWN_DESTID)
+            else:
+                self._unwatch_channel(tim_id, channel_id, 'history')
+
+        result = {'error_code': error,
+                  'ncap_id': ncap_id,
+                  'tim_id': tim_id,
+                  'channel_id': channel_id}
+
+        return result
+
+    def read_sample_history(self, ncap_id, tim_id, channel_id,
+                            start_time=None, end_time=None, last_n=None):
+        """
+        Read the samples of a channel kept by the NCAP. This is an ncaplite
+        extension to the 1451.1 transducer services.
+
+        Args:
+            ncap_id: ID of the NCAP application being queried
+            tim_id: ID of the TIM
+            channel_id: the channel ID of the TIM
+            start_time: optional TimeInstance of the earliest sample
+            end_time: optional TimeInstance of the latest sample
+            last_n: optional maximum number of samples, the latest ones
+                    are returned
+
+        Returns: A dictionary containing the following:
+            error_code: UNKNOWN_DESTID if no history is kept for the
+                        channel
+            ncap_id: the ncap id
+            tim_id: the id of the tim
+            channel_id: the id of the channel
+            sample_data: a sample_history.HistoryView, encoded as an
+                         ArgumentArray holding the "samples" and their
+                         "timestamps" in seconds since the epoch
+        """
+        error = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                               ieee1451.ErrorCode.NO_ERROR)
+        sample_data = None
+
+        history = self.sample_histories.get((tim_id, channel_id))
+        if history is None:
+            error = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                   ieee1451.ErrorCode.UNKNOWN_DESTID)
+        else:
+            start = None if start_time is None else start_time.total_seconds()
+            end = None if end_time is None else end_time.total_seconds()
+            # the view is copied only when the response is encoded
+            sample_data = history.query(start, end, last_n)
+
+        result = {'error_code': error,
+                  'ncap_id': ncap_id,
+                  'tim_id': tim_id,
+                  'channel_id': channel_id,
+                  'sample_data': sample_data}
+
+        return result
+
+    def _sample_series(self, ncap_id, tim_id, channel_id, start_time,
+                       end_time, timeout, number_of_samples,
+                       sample_interval):
+        """Return the error code, timestamps and values of a series, read
+        live as a block when number_of_samples is given and from the
+        sample history of the channel otherwise.
+
+        A live read without timeout or sample_interval, or whose samples
+        are not numbers, is an ILLEGAL_MODE error; a failed live read
+        returns its error code and no samples."""
+        error = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                               ieee1451.ErrorCode.NO_ERROR)
+        illegal = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                 ieee1451.ErrorCode.ILLEGAL_MODE)
+        if number_of_samples:
+            if timeout is None or sample_interval is None:
+                return illegal, array('d'), array('d')
+            block = self.read_transducer_block_data_from_a_channel_of_a_tim(
+                                ncap_id, tim_id, channel_id, timeout,
+                                number_of_samples, sample_interval,
+                                start_time)
+            error = block['error_code']
+            if getattr(error, 'code', ieee1451.ErrorCode.NO_ERROR) != \
+                    ieee1451.ErrorCode.NO_ERROR:
+                return error, array('d'), array('d')
+            try:
+                sample_data = block['sample_data']
+                timestamps = sample_data.get_by_name('timestamps').value
+                values = sample_data.get_by_name('samples').value
+                return error, array('d', timestamps), array('d', values)
+            except (AttributeError, KeyError, TypeError):
+                return illegal, array('d'), array('d')
+
+        history = self.read_sample_history(ncap_id, tim_id, channel_id,
+                                           start_time, end_time)
+        if history['sample_data'] is None:
+            return history['error_code'], array('d'), array('d')
+        timestamps, values = history['sample_data'].arrays()
+        return error, timestamps, values
+
+    def aggregate_sample_data(self, ncap_id, tim_id, channel_id, window,
+                              start_time=None, end_time=None, timeout=None,
+                              number_of_samples=None, sample_interval=None):
+        """
+        Aggregate the samples of a channel over fixed time windows. This is
+        an ncaplite extension to the 1451.1 transducer services.
+
+        The samples are those of the sample history of the channel between
+        start_time and end_time or, when number_of_samples is given, a
+        block read live from start_time.
+
+        Args:
+            ncap_id: ID of the NCAP application being queried
+            tim_id: ID of the TIM
+            channel_id: the channel ID of the TIM
+            window: TimeDuration of a window
+            start_time: optional TimeInstance of the first sample
+            end_time: optional TimeInstance of the last history sample
+            timeout: The timeout interval of each live read, required
+                     with number_of_samples
+            number_of_samples: optional number of samples to read live
+            sample_interval: TimeDuration between live samples, required
+                             with number_of_samples
+
+        Returns: A dictionary containing the following:
+            error_code: an error code
+            ncap_id: the ncap id
+            tim_id: the id of the tim
+            channel_id: the id of the channel
+            aggregates: an ArgumentArray holding the "window_start", "min",
+                        "max", "mean", "count" and "last" of each window
+        """
+        error, timestamps, values = self._sample_series(
+                                ncap_id, tim_id, channel_id, start_time,
+                                end_time, timeout, number_of_samples,
+                                sample_interval)
+        aggregates = aggregation.aggregate_windows(timestamps, values,
+                                                   window.total_seconds())
+
+        result = {'error_code': error,
+                  'ncap_id': ncap_id,
+                  'tim_id': tim_id,
+                  'channel_id': channel_id,
+                  'aggregates': aggregates.to_argument_array()}
+
+        return result
+
+    def downsample_sample_data(self, ncap_id, tim_id, channel_id,
+                               max_points, start_time=None, end_time=None,
+                               timeout=None, number_of_samples=None,
+                               sample_interval=None):
+        """
+        Downsample the samples of a channel for plotting with the Largest
+        Triangle Three Buckets algorithm. This is an ncaplite extension to
+        the 1451.1 transducer services.
+
+        The samples are selected as for aggregate_sample_data.
+
+        Args:
+            ncap_id: ID of the NCAP application being queried
+            tim_id: ID of the TIM
+            channel_id: the channel ID of the TIM
+            max_points: the number of points returned, at least 1
+            start_time: optional TimeInstance of the first sample
+            end_time: optional TimeInstance of the last history sample
+            timeout: The timeout interval of each live read, required
+                     with number_of_samples
+            number_of_samples: optional number of samples to read live
+            sample_interval: TimeDuration between live samples, required
+                             with number_of_samples
+
+        Returns: A dictionary containing the following:
+            error_code: an error code
+            ncap_id: the ncap id
+            tim_id: the id of the tim
+            channel_id: the id of the channel
+            sample_data: an ArgumentArray holding the "samples" kept and
+                         their "timestamps"
+        """
+        if max_points is None or max_points < 1:
+            error = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                   ieee1451.ErrorCode.ILLEGAL_MODE)
+            timestamps, values = array('d'), array('d')
+        else:
+            error, timestamps, values = self._sample_series(
+                                ncap_id, tim_id, channel_id, start_time,
+                                end_time, timeout, number_of_samples,
+                                sample_interval)
+            timestamps, values = aggregation.lttb(timestamps, values,
+                                                  max_points)
+
+        sample_data = ieee1451.ArgumentArray()
+        sample_data.put_by_name('samples', ieee1451.Argument(
+                            ieee1451.TypeCode.FLOAT64_ARRAY_TC,
+                            values.tolist()))
+        sample_data.put_by_name('timestamps', ieee1451.Argument(
+                            ieee1451.TypeCode.FLOAT64_ARRAY_TC,
+                            timestamps.tolist()))
+
+        result = {'error_code': error,
+                  'ncap_id': ncap_id,
+                  'tim_id': tim_id,
+                  'channel_id': channel_id,
+                  'sample_data': sample_data}
+
+        return result
@@ -0,0 +1,91 @@
+"""
+.. module:: worker_pool
+   :platform: Unix, Windows
+   :synopsis: Defines helpers for fanning out blocking 1451.0 calls over
+   a bounded number of threads.
+
+.. moduleauthor:: James Ethridge <jeethridge@gmail.com>
+
+"""
+# -*- coding: utf-8 -*-
+import threading
+from timeutil import clock
+
+
+class TaskResult(object):
+    """Holds the outcome of a task run by run_concurrently.
+
+    done is False when the task did not finish before the deadline, in
+    which case value and exception are both None.
+    """
+
+    def __init__(self):
+        self.done = False
+        self.value = None
+        self.exception = None
+
+
+def run_concurrently(tasks, max_workers=8, timeout=None):
+    """Run callables concurrently and collect their results in order.
+
+    At most max_workers threads are started, each with a task of its own,
+    and the threads take the remaining tasks as they finish. When timeout
+    (seconds) expires the results collected so far are returned and tasks
+    not started yet are never run.
+
+    A thread can not be interrupted, so a task still running at the
+    deadline keeps its daemon thread until it returns and its result is
+    dropped. Anything it holds, e.g. a TIM session, stays open until then,
+    so tasks must release their resources themselves, in a finally block,
+    and should be given a timeout of their own no longer than timeout.
+
+    :param tasks: a list of callables taking no arguments
+    :param max_workers: the maximum number of threads to use
+    :param timeout: optional number of seconds to wait for all tasks
+    :return: a list of TaskResult objects in the order of tasks
+    """
+    results = [TaskResult() for _ in tasks]
+    if not tasks:
+        return results
+
+    lock = threading.Lock()
+    finished = threading.Condition(lock)
+    pending = list(reversed(range(len(tasks))))
+    state = {'remaining': len(tasks), 'closed': False}
+
+    def worker(idx):
+        while True:
+            outcome = TaskResult()
+            try:
+                outcome.value = tasks[idx]()
+            except Exception as e:
+                outcome.exception = e
+            outcome.done = True
+            with lock:
+                if not state['closed']:
+                    results[idx] = outcome
+                state['remaining'] -= 1
+                if state['remaining'] == 0:
+                    finished.notify_all()
+                if not pending or state['closed']:
+                    return
+                idx = pending.pop()
+
+    first = [pending.pop() for _ in range(min(max_workers, len(tasks)))]
+    for idx in first:
+        t = threading.Thread(target=worker, args=(idx,))
+        t.daemon = True
+        t.start()
+
+    deadline = None if timeout is None else clock() + timeout
+    with lock:
+        while state['remaining']:
+            if deadline is None:
+                finished.wait(1.0)
+                continue
+            left = deadline - clock()
+            if left <= 0:
+                break
+            finished.wait(left)
+        state['closed'] = True
+    return results
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_aggregation
+----------------------------------
+
+Tests for `aggregation` module.
+"""
+
+import math
+import time
+import unittest
+from array import array
+from ncaplite import aggregation
+
+
+class TestAggregation(unittest.TestCase):
+    """This class defines the test runner for the aggregation helpers"""
+
+    def test_aggregate_windows(self):
+        """ Test per window min, max, mean, count and last """
+        timestamps = [10.0, 10.5, 11.2, 11.9, 14.1]
+        values = [1, 3, 5, -1, 7]
+        agg = aggregation.aggregate_windows(timestamps, values, 1.0)
+        self.assertEqual(len(agg), 3)
+        self.assertEqual(agg.window_start.tolist(), [10.0, 11.0, 14.0])
+        self.assertEqual(agg.minimum.tolist(), [1.0, -1.0, 7.0])
+        self.assertEqual(agg.maximum.tolist(), [3.0, 5.0, 7.0])
+        self.assertEqual(agg.mean.tolist(), [2.0, 2.0, 7.0])
+        self.assertEqual(agg.count.tolist(), [2, 2, 1])
+        self.assertEqual(agg.last.tolist(), [3.0, -1.0, 7.0])
+
+        aa = agg.to_argument_array()
+        self.assertEqual(aa.get_by_name('count').value, [2, 2, 1])
+
+    def test_aggregate_empty(self):
+        """ Test aggregating an empty series """
+        agg = aggregation.aggregate_windows([], [], 1.0)
+        self.assertEqual(len(agg), 0)
+
+    def test_lttb_keeps_shape(self):
+        """ Test that LTTB keeps the ends and the peaks """
+        n = 1000
+        timestamps = array('d', range(n))
+        values = array('d', [math.sin(i / 50.0) for i in range(n)])
+        values[500] = 10.0
+        out_t, out_v = aggregation.lttb(timestamps, values, 50)
+        self.assertEqual(len(out_t), 50)
+        self.assertEqual(out_t[0], 0.0)
+        self.assertEqual(out_t[-1], n - 1.0)
+        self.assertTrue(10.0 in out_v)
+        self.assertEqual(sorted(out_t), out_t.tolist())
+
+    def test_lttb_small_threshold(self):
+        """ Test that thresholds below 3 keep the first and last points """
+        timestamps = array('d', range(50))
+        values = array('d', range(50))
+        self.assertEqual(aggregation.lttb(timestamps, values, 2)[0].tolist(),
+                         [0.0, 49.0])
+        self.assertEqual(aggregation.lttb(timestamps, values, 1)[1].tolist(),
+                         [0.0])
+        self.assertEqual(len(aggregation.lttb(timestamps, values, 0)[0]), 0)
+
+    def test_lttb_short_series(self):
+        """ Test that series shorter than the threshold are unchanged """
+        out_t, out_v = aggregation.lttb([1.0, 2.0], [3.0, 4.0], 10)
+        self.assertEqual(out_t.tolist(), [1.0, 2.0])
+        self.assertEqual(out_v.tolist(), [3.0, 4.0])
+
+    def test_large_range(self):
+        """ Test that a 1M point range reduces to 1k points """
+        n = 1000000
+        timestamps = array('d', range(n))
+        values = array('d', [0.0]) * n
+        started = time.time()
+        agg = aggregation.aggregate_windows(timestamps, values, 1000.0)
+        out_t, out_v = aggregation.lttb(timestamps, values, 1000)
+        self.assertEqual(len(agg), 1000)
+        self.assertEqual(len(out_t), 1000)
+        self.assertTrue(time.time() - started < 30)
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+test_binary_teds
+----------------------------------
+
+Tests for `binary_teds` module.
+"""
+# -*- coding: utf-8 -*-
+
+import unittest
+import mock
+from ncaplite import binary_teds
+from ncaplite import ieee1451types as ieee1451
+from ncaplite import teds_support
+
+
+class TestBinaryTEDS(unittest.TestCase):
+    """TestCase for the binary TEDS parser and encoder."""
+
+    def setUp(self):
+        tc = ieee1451.TypeCode
+        self.fields = [('TEDSID', tc.UINT8_ARRAY_TC, (0, 3, 1, 1)),
+                       ('ChanType', tc.UINT8_TC, 0),
+                       ('LowLimit', tc.FLOAT32_TC, 273.0),
+                       ('HiLimit', tc.FLOAT32_TC, 373.0),
+                       ('DatModel', tc.UINT8_TC, 0),
+                       ('SigBits', tc.UINT16_TC, 16),
+                       ('ESOption', tc.UINT8_TC, 1)]
+        self.aa = ieee1451.ArgumentArray()
+        for name, type_code, value in self.fields:
+            self.aa.put_by_name(name, ieee1451.Argument(type_code, value))
+        self.chan = teds_support.TEDSType.CHAN_TEDS
+
+    def test_encode_decode_round_trip(self):
+        """ Test that an encoded TEDS decodes to the same fields."""
+        raw = binary_teds.encode_teds(self.chan, self.aa)
+        self.assertEqual(raw[:4], bytearray(b'\x00\x00\x00\x23'))
+
+        decoded = binary_teds.decode_teds(self.chan, tuple(raw))
+        for name, type_code, value in self.fields:
+            arg = decoded.get_by_name(name)
+            self.assertEqual(arg.type_code, type_code)
+            self.assertEqual(arg.value, value)
+
+    def test_unknown_fields_keep_their_nesting(self):
+        """ Test that unknown TLVs are written back under their parent."""
+        tc = ieee1451.TypeCode
+        self.aa.put_by_name('Sample/50',
+                            ieee1451.Argument(tc.OCTET_ARRAY_TC, (9, 9)))
+        self.aa.put_by_name('60', ieee1451.Argument(tc.OCTET_ARRAY_TC, (7,)))
+        raw = binary_teds.encode_teds(self.chan, self.aa)
+        # Sample holds DatModel, SigBits and the unknown field 50
+        sample = raw.index(bytearray([18, 11]))
+        self.assertEqual(raw[sample + 9:sample + 13],
+                         bytearray([50, 2, 9, 9]))
+
+        decoded = binary_teds.decode_teds(self.chan, raw)
+        self.assertEqual(decoded.get_by_name('Sample/50').value, (9, 9))
+        self.assertEqual(decoded.get_by_name('60').value, (7,))
+        self.assertNotIn('50', decoded.indicies)
+        self.assertEqual(binary_teds.encode_teds(self.chan, decoded), raw)
+
+    def test_checksum_verified(self):
+        """ Test that a corrupted TEDS is rejected."""
+        raw = binary_teds.encode_teds(self.chan, self.aa)
+        raw[10] ^= 0xFF
+        self.assertRaises(ValueError, binary_teds.BinaryTEDS, self.chan, raw)
+        # skipping verification still allows the TEDS to be read
+        binary_teds.BinaryTEDS(self.chan, raw, verify=False)
+
+    def test_lazy_field_lookup(self):
+        """ Test that reading one field only decodes that field."""
+        raw = binary_teds.encode_teds(self.chan, self.aa)
+        teds = binary_teds.BinaryTEDS(self.chan, raw)
+        with mock.patch.object(binary_teds, 'decode_value',
+                               wraps=binary_teds.decode_value) as decode:
+            self.assertEqual(teds.get_by_name('LowLimit').value, 273.0)
+            self.assertEqual(decode.call_count, 1)
+        self.assertNotIn('ESOption', teds.offsets)
+        self.assertEqual(teds.get_by_name('SigBits').value, 16)
+        self.assertEqual(teds.get_by_name('Missing'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+test_calibration_engine
+----------------------------------
+
+Tests for `calibration_engine` module.
+"""
+# -*- coding: utf-8 -*-
+
+import unittest
+import mock
+from ncaplite import calibration_engine
+from ncaplite import teds_support
+
+
+class TestCalibrationEngine(unittest.TestCase):
+    """TestCase for the NCAP-side Calibration TEDS correction engine."""
+
+    def setUp(self):
+        xmlpath = 'tests/SmartTransducerTEDSMock.xml'
+        xmlns = {'teds': 'http://localhost/1451HTTPAPI'}
+        self.cal_teds = teds_support.teds_element_from_file(
+                                'teds:CalibrationTEDS', xmlns, xmlpath)[0]
+
+    def test_segments_from_cal_teds(self):
+        """ Test reading the correction segments from a Calibration TEDS."""
+        segs = calibration_engine.segments_from_cal_teds(self.cal_teds)
+        expected = [
+            calibration_engine.CalibrationSegment(0, 1000, 0, [273.15, 0.1]),
+            calibration_engine.CalibrationSegment(1000, 4096, 1000,
+                                                  [373.15, 0.05])]
+        self.assertEqual(segs, expected)
+
+    def test_correct_sample_and_block(self):
+        """ Test that single samples and blocks are corrected the same way."""
+        engine = calibration_engine.CalibrationEngine()
+        engine.load_cal_teds(1, 1, self.cal_teds)
+
+        self.assertAlmostEqual(engine.correct(1, 1, 500), 323.15)
+        self.assertAlmostEqual(engine.correct(1, 1, 2000), 423.15)
+
+        samples = [0, 500, 999, 1000, 2000, 5000]
+        block = engine.correct_block(1, 1, samples)
+        for sample, corrected in zip(samples, block):
+            self.assertAlmostEqual(corrected, engine.correct(1, 1, sample))
+
+        # channels without a Calibration TEDS are passed through
+        self.assertEqual(engine.correct(1, 2, 500), 500)
+        self.assertEqual(list(engine.correct_block(1, 2, [1, 2])), [1.0, 2.0])
+
+    def test_values_outside_segments_clamped(self):
+        """ Test that values beyond the segments are clamped to the limits
+        of the nearest segment."""
+        evaluator = calibration_engine.CalibrationEvaluator([
+            calibration_engine.CalibrationSegment(0, 1000, 0, [273.15, 0.1]),
+            calibration_engine.CalibrationSegment(2000, 4096, 1000,
+                                                  [373.15, 0.05])])
+
+        # above the last segment, corrected as its hi_limit
+        self.assertAlmostEqual(evaluator(5000), 527.95)
+        # below the first segment, corrected as its low_limit
+        self.assertAlmostEqual(evaluator(-10), 273.15)
+        # in the gap, corrected by the closer segment
+        self.assertAlmostEqual(evaluator(1200), 373.15)
+        self.assertAlmostEqual(evaluator(1800), 423.15)
+
+        samples = [-10, 500, 1200, 1800, 3000, 5000]
+        block = evaluator.evaluate_block(samples)
+        for sample, corrected in zip(samples, block):
+            self.assertAlmostEqual(corrected, evaluator(sample))
+
+        single = calibration_engine.CalibrationEvaluator([
+            calibration_engine.CalibrationSegment(0, 1000, 0, [273.15, 0.1])])
+        self.assertEqual(list(single.evaluate_block([-5, 2000])),
+                         [273.15, 373.15])
+
+    def test_evaluator_cached_by_version(self):
+        """ Test that the TEDS is only compiled again when its version
+        changes."""
+        engine = calibration_engine.CalibrationEngine()
+        first = engine.load_cal_teds(1, 1, self.cal_teds)
+        second = engine.load_cal_teds(1, 1, self.cal_teds)
+        self.assertIs(first, second)
+
+        third = engine.load_cal_teds(1, 1, self.cal_teds, version='6')
+        self.assertIsNot(first, third)
+        self.assertIs(engine.get_evaluator(1, 1), third)
+
+    def test_unversioned_teds_not_reused(self):
+        """ Test that a TEDS without a CheckSum is compiled again on every
+        load."""
+        engine = calibration_engine.CalibrationEngine()
+        with mock.patch.object(calibration_engine, 'cal_teds_version',
+                               return_value=None):
+            first = engine.load_cal_teds(1, 1, self.cal_teds)
+            second = engine.load_cal_teds(1, 1, self.cal_teds)
+        self.assertIsNot(first, second)
+        self.assertIs(engine.get_evaluator(1, 1), second)
+
+
+if __name__ == '__main__':
+    unittest.main()
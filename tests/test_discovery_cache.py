@@ -0,0 +1,80 @@
+"""
+test_discovery_cache
+----------------------------------
+
+Tests for `discovery_cache` module.
+"""
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import mock
+from ncaplite import discovery_cache
+
+
+class TestDiscoveryCache(unittest.TestCase):
+    """TestCase for the discovery result cache."""
+
+    tims_key = (discovery_cache.TIM_DISCOVER, )
+
+    def chans_key(self, tim_id):
+        return (discovery_cache.TRANSDUCER_DISCOVER, tim_id)
+
+    def test_invalidate(self):
+        """Test that a TIM change drops its channels and the TIM list."""
+        cache = discovery_cache.DiscoveryCache()
+        cache.put(self.tims_key, {'tim_ids': [1, 2]})
+        cache.put(self.chans_key(1), {'tim_id': 1})
+        cache.put(self.chans_key(2), {'tim_id': 2})
+
+        self.assertEqual(cache.invalidate(tim_id=1), 2)
+        self.assertEqual(cache.get(self.tims_key), None)
+        self.assertEqual(cache.get(self.chans_key(1)), None)
+        self.assertEqual(cache.get(self.chans_key(2)), {'tim_id': 2})
+        self.assertEqual(cache.invalidate(), 1)
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 2, 'size': 0})
+
+    def test_ttl(self):
+        """Test that entries expire after the cache ttl."""
+        cache = discovery_cache.DiscoveryCache(ttl=10)
+        with mock.patch.object(discovery_cache, 'clock', return_value=100.0):
+            cache.put(self.tims_key, {'tim_ids': [1]})
+        with mock.patch.object(discovery_cache, 'clock', return_value=105.0):
+            self.assertEqual(cache.get(self.tims_key), {'tim_ids': [1]})
+        with mock.patch.object(discovery_cache, 'clock', return_value=111.0):
+            self.assertEqual(cache.get(self.tims_key), None)
+
+    def test_default_ttl(self):
+        """Test that entries expire by default."""
+        cache = discovery_cache.DiscoveryCache()
+        self.assertEqual(cache.ttl, discovery_cache.DEFAULT_TTL)
+        with mock.patch.object(discovery_cache, 'clock', return_value=100.0):
+            cache.put(self.tims_key, {'tim_ids': [1]})
+        with mock.patch.object(discovery_cache, 'clock',
+                               return_value=100.0 + cache.ttl + 1):
+            self.assertEqual(cache.get(self.tims_key), None)
+
+    def test_encoded(self):
+        """Test that the response to a cached result is encoded once per
+        message and codec, and again after invalidation."""
+        cache = discovery_cache.DiscoveryCache()
+        result = {'tim_ids': [1]}
+        cache.put(self.tims_key, result)
+        encode = mock.Mock(return_value='encoded')
+
+        self.assertEqual(cache.encoded(result, 716, 'json', encode), 'encoded')
+        self.assertEqual(cache.encoded(result, 716, 'json', encode), 'encoded')
+        self.assertEqual(encode.call_count, 1)
+        cache.encoded(result, 716, 'default', encode)
+        self.assertEqual(encode.call_count, 2)
+
+        # results which are not cached are always encoded
+        cache.encoded({'tim_ids': [1]}, 716, 'json', encode)
+        self.assertEqual(encode.call_count, 3)
+
+        cache.invalidate()
+        cache.encoded(result, 716, 'json', encode)
+        self.assertEqual(encode.call_count, 4)
+
+if __name__ == '__main__':
+    unittest.main()
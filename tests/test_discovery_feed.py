@@ -0,0 +1,91 @@
+"""
+test_discovery_feed
+----------------------------------
+
+Tests for `discovery_feed` module.
+"""
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+from ncaplite import discovery_feed
+
+
+class TestDiscoveryFeed(unittest.TestCase):
+    """TestCase for the discovery change feed."""
+
+    def ops(self, deltas):
+        return [(d.op, d.tim_id, d.channel_id) for d in deltas]
+
+    def test_updates_publish_only_changes(self):
+        """Test that full reports publish the difference to the known
+        topology."""
+        feed = discovery_feed.DiscoveryFeed()
+        self.assertEqual(self.ops(feed.update_tims([1, 2])),
+                         [(discovery_feed.TIM_ADDED, 1, None),
+                          (discovery_feed.TIM_ADDED, 2, None)])
+        self.assertEqual(feed.update_tims([2, 1]), [])
+        self.assertEqual(self.ops(feed.update_channels(1, [1, 2])),
+                         [(discovery_feed.CHANNEL_ADDED, 1, 1),
+                          (discovery_feed.CHANNEL_ADDED, 1, 2)])
+        self.assertEqual(self.ops(feed.update_channels(1, [2, 3])),
+                         [(discovery_feed.CHANNEL_REMOVED, 1, 1),
+                          (discovery_feed.CHANNEL_ADDED, 1, 3)])
+        self.assertEqual(self.ops(feed.update_tims([2])),
+                         [(discovery_feed.CHANNEL_REMOVED, 1, 2),
+                          (discovery_feed.CHANNEL_REMOVED, 1, 3),
+                          (discovery_feed.TIM_REMOVED, 1, None)])
+        self.assertEqual(feed.seq, 9)
+
+    def test_notify(self):
+        """Test single changes reported by the backend."""
+        feed = discovery_feed.DiscoveryFeed()
+        self.assertEqual(self.ops(feed.notify(discovery_feed.CHANNEL_ADDED,
+                                              5, 1)),
+                         [(discovery_feed.TIM_ADDED, 5, None),
+                          (discovery_feed.CHANNEL_ADDED, 5, 1)])
+        self.assertEqual(feed.notify(discovery_feed.TIM_ADDED, 5), [])
+        self.assertEqual(self.ops(feed.notify(discovery_feed.CHANNEL_REMOVED,
+                                              5, 1)),
+                         [(discovery_feed.CHANNEL_REMOVED, 5, 1)])
+
+    def test_subscribe_resume_and_push(self):
+        """Test that subscribers resume from a sequence number and get
+        later deltas pushed."""
+        feed = discovery_feed.DiscoveryFeed(max_history=3)
+        sent = []
+        feed.sender = lambda client_id, deltas, seq: \
+            sent.append((client_id, [d.seq for d in deltas], seq))
+
+        feed.update_tims([1, 2])
+        seq, deltas = feed.subscribe('a@ncaplite.loc', last_seq=1)
+        self.assertEqual(seq, 2)
+        self.assertEqual([d.seq for d in deltas], [2])
+
+        feed.update_tims([1, 2, 3])
+        self.assertEqual(sent, [('a@ncaplite.loc', [3], 3)])
+
+        feed.update_tims([4])
+        self.assertEqual(feed.since(2), None)
+        self.assertEqual([d.seq for d in feed.since(5)], [6, 7])
+        self.assertEqual(feed.since(7), [])
+        # a client ahead of the feed, e.g. after an NCAP restart, resyncs
+        self.assertEqual(feed.since(8), None)
+
+        self.assertTrue(feed.unsubscribe('a@ncaplite.loc'))
+        self.assertFalse(feed.unsubscribe('a@ncaplite.loc'))
+        feed.update_tims([])
+        self.assertEqual(len(sent), 2)
+
+    def test_unsubscribe_client(self):
+        """Test that a leaving client is removed with its resources."""
+        feed = discovery_feed.DiscoveryFeed()
+        feed.subscribe('a@ncaplite.loc/home')
+        feed.subscribe('a@ncaplite.loc/work')
+        feed.subscribe('ab@ncaplite.loc')
+        self.assertEqual(feed.unsubscribe_client('a@ncaplite.loc'), 2)
+        self.assertEqual(feed.subscribers, set(['ab@ncaplite.loc']))
+        self.assertTrue(feed.has_subscribers())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,6 +11,7 @@ Tests for `ncaplite` module.
 import unittest
 import mock
 import os
+import threading
 
 from ncaplite import discovery_services
 from ncaplite import transducer_services_base
@@ -101,6 +102,37 @@ class TestDiscoveryServices(unittest.TestCase):
 
         assert(on_roster == 0)
 
+    def test_roster_index(self):
+        """ check that the roster index follows concurrent joins and
+            unjoins and stays consistent with the roster tree. """
+        roster_path = 'tests/testroster.xml'
+        discovery = discovery_services.DiscoveryServices()
+        discovery.open_roster(roster_path)
+        client_ids = ['client%d@ncaplite.loc' % i for i in range(200)]
+
+        threads = [threading.Thread(target=discovery.ncap_client_join,
+                                    args=(client_id,))
+                   for client_id in client_ids]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+
+        self.assertEqual(discovery.ncap_client_join(client_ids[0]), (-1, ))
+        self.assertTrue(discovery.is_client_on_roster(client_ids[0]))
+
+        for client_id in client_ids[::2]:
+            self.assertEqual(discovery.ncap_client_unjoin(client_id), (1, ))
+        self.assertEqual(discovery.ncap_client_unjoin(client_ids[0]), None)
+        self.assertFalse(discovery.is_client_on_roster(client_ids[0]))
+
+        root = discovery.tree.getroot()
+        jids = sorted(user.find('jid').text for user in root.findall('user'))
+        self.assertEqual(jids, sorted(client_ids[1::2]))
+        self.assertEqual(sorted(discovery.roster_index.keys()), jids)
+        self.assertEqual(sorted(discovery.roster_slots.values()),
+                         range(len(root)))
+        for user, slot in discovery.roster_slots.items():
+            self.assertTrue(root[slot] is user)
+
     def test_ncap_tim_discover(self):
         """ Test TIM discovery service."""
 
@@ -150,12 +182,131 @@ class TestDiscoveryServices(unittest.TestCase):
 
         expected_reposne = {'error_code': error_code,
                             'num_of_tim': num_of_tim,
-                            'tim_ids': tim_ids}
+                            'tim_ids': tim_ids,
+                            'module_ids': [1, 2],
+                            'module_error_codes': [0, 0]}
 
         result = disco.ncap_tim_discover(**request)
 
         self.assertEqual(result, expected_reposne)
 
+        # repeated discovery is served from the cache until invalidated
+        self.assertIs(disco.ncap_tim_discover(**request), result)
+        self.assertEqual(tdisco.report_comm_module.call_count, 1)
+        disco.invalidate_discovery(tim_id=3)
+        self.assertEqual(disco.ncap_tim_discover(**request), result)
+        self.assertEqual(tdisco.report_comm_module.call_count, 2)
+
+    def test_ncap_tim_discover_slow_module(self):
+        """ Test that a slow module is reported as timed out while the TIMs
+        of the other modules are returned."""
+        no_error = ieee1451.Error(
+                    ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                    ieee1451.ErrorCode.NO_ERROR)
+        timeout = ieee1451.Error(
+                    ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                    ieee1451.ErrorCode.TIMEOUT)
+        release = threading.Event()
+
+        def report_tims_mock(module_id):
+            if module_id == 2:
+                release.wait(5)
+            return {'error_code': no_error, 'tim_ids': [module_id * 10]}
+
+        tdisco = mock.Mock(spec=transducer_services_base.TimDiscoveryBase)
+        tdisco.report_comm_module.return_value = {'error_code': no_error,
+                                                  'module_ids': [1, 2, 3]}
+        tdisco.report_tims.side_effect = report_tims_mock
+
+        disco = discovery_services.DiscoveryServices()
+        disco.register_transducer_access_service(tdisco)
+        disco.module_timeout = 0.05
+
+        result = disco.ncap_tim_discover(1234)
+        release.set()
+
+        self.assertEqual(result['error_code'], timeout)
+        self.assertEqual(result['tim_ids'], [10, 30])
+        self.assertEqual(result['num_of_tim'], 2)
+        self.assertEqual(result['module_error_codes'],
+                         [0, timeout.serializable()['Error'], 0])
+
+        # partial results are not cached
+        disco.ncap_tim_discover(1234)
+        self.assertEqual(tdisco.report_comm_module.call_count, 2)
+
+    def test_ncap_discovery_subscribe(self):
+        """ Test that discovery results feed the change feed and that a
+        client can resume from the last delta it saw."""
+        no_error = ieee1451.Error(
+                    ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                    ieee1451.ErrorCode.NO_ERROR)
+        tdisco = mock.Mock(spec=transducer_services_base.TimDiscoveryBase)
+        tdisco.report_comm_module.return_value = {'error_code': no_error,
+                                                  'module_ids': [1]}
+        tdisco.report_tims.return_value = {'error_code': no_error,
+                                           'tim_ids': [1]}
+
+        disco = discovery_services.DiscoveryServices()
+        disco.register_transducer_access_service(tdisco)
+        disco.ncap_tim_discover(1234)
+
+        result = disco.ncap_discovery_subscribe(1234, 'a@ncaplite.loc', 0)
+        self.assertEqual(result, {'error_code': no_error,
+                                  'seq': 1,
+                                  'deltas': [{'seq': 1,
+                                              'op': 'tim_added',
+                                              'tim_id': 1,
+                                              'channel_id': None}],
+                                  'resync': False})
+
+        sent = []
+        disco.discovery_feed.sender = lambda c, d, s: sent.append((c, s))
+        disco.notify_topology_change('tim_added', 2)
+        self.assertEqual(sent, [('a@ncaplite.loc', 2)])
+        self.assertEqual(tdisco.report_comm_module.call_count, 1)
+        disco.ncap_tim_discover(1234)
+        self.assertEqual(tdisco.report_comm_module.call_count, 2)
+
+        disco.ncap_discovery_unsubscribe(1234, 'a@ncaplite.loc')
+        self.assertEqual(disco.discovery_feed.subscribers, set())
+
+    def test_topology_reported_by_backend(self):
+        """ Test that a backend reporting hot-plug events feeds the
+        discovery feed, and that polling refreshes it otherwise."""
+        no_error = ieee1451.Error(
+                    ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                    ieee1451.ErrorCode.NO_ERROR)
+        tdisco = mock.Mock(spec=transducer_services_base.TimDiscoveryBase)
+        tdisco.set_topology_listener = mock.Mock()
+        tdisco.report_comm_module.return_value = {'error_code': no_error,
+                                                  'module_ids': [1]}
+        tdisco.report_tims.return_value = {'error_code': no_error,
+                                           'tim_ids': [1]}
+        tdisco.report_channels.return_value = {'error_code': no_error,
+                                               'channel_ids': [1, 2],
+                                               'channel_names': ['a', 'b']}
+
+        disco = discovery_services.DiscoveryServices()
+        disco.register_transducer_access_service(tdisco)
+        listener = tdisco.set_topology_listener.call_args[0][0]
+        self.assertEqual(listener('tim_added', 5)[0].tim_id, 5)
+
+        sent = []
+        disco.discovery_feed.sender = lambda c, d, s: sent.append(
+                                            [(x.op, x.tim_id) for x in d])
+        disco.discovery_feed.subscribe('a@ncaplite.loc')
+        disco.start_topology_watch(0.01)
+        try:
+            for _ in range(100):
+                if sent:
+                    break
+                threading.Event().wait(0.01)
+        finally:
+            disco.stop_topology_watch()
+        self.assertEqual(sent[0], [('tim_removed', 5), ('tim_added', 1)])
+        self.assertEqual(sent[1], [('channel_added', 1), ('channel_added', 1)])
+
     def test_ncap_transducer_discover(self):
         """ Test transducer discover request. """
         def report_channels_mock(tim_id):
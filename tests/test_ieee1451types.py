@@ -57,6 +57,11 @@ class TestIEEE1451Types(unittest.TestCase):
         s = t.serializable()
         self.assertEqual(expected, s)
 
+    def test_timerepresentation_total_seconds(self):
+        """Test conversion of a TimeRepresentation to seconds."""
+        t = ieee1451.TimeDuration(secs=2, nsecs=500000000)
+        self.assertAlmostEqual(t.total_seconds(), 2.5)
+
     def test_argument_initializer(self):
         """Test that Agrument initialization is implemented properly."""
         tc = ieee1451.TypeCode.FLOAT32_ARRAY_TC
@@ -94,6 +99,19 @@ class TestIEEE1451Types(unittest.TestCase):
 
         self.assertEqual(expected, actual)
 
+    def test_nested_argarray_serializable(self):
+        """Test that ArgumentArrays nested in an Argument round trip."""
+        inner = ieee1451.ArgumentArray()
+        inner.put_by_name('foo', ieee1451.Argument(
+                                    ieee1451.TypeCode.UINT16_TC, 7))
+        outer = ieee1451.ArgumentArray()
+        outer.put_by_name('bar', ieee1451.Argument(
+                                    ieee1451.TypeCode.UNKNOWN_TC, inner))
+
+        s = outer.serializable()
+        self.assertEqual(s['ArgumentArray'][0]['value'], inner.serializable())
+        self.assertEqual(ieee1451.ArgumentArray.from_serializable(s), outer)
+
     def test_argarray_putget_by_index(self):
         """Test ArgumentArray put/get by index."""
 
@@ -19,6 +19,7 @@ from ncaplite import ieee1451types as ieee1451
 from ncaplite import simple_json_codec
 from ncaplite import teds_access_services
 from ncaplite import teds_support
+from ncaplite import teds_cache
 import mock
 import time
 import xml.etree.ElementTree as ET
@@ -462,7 +463,9 @@ class TestNcaplite(unittest.TestCase):
         tim_ids = [1, 2, 3]
         expected_response = [716, {'error_code': ec,
                                    'num_of_tim': num_of_tim,
-                                   'tim_ids': tim_ids}]
+                                   'tim_ids': tim_ids,
+                                   'module_ids': [1, 2],
+                                   'module_error_codes': [0, 0]}]
 
         ncap.start()
         ncap_client.start()
@@ -673,7 +676,8 @@ class TestNcaplite(unittest.TestCase):
 
         expected_response = [732, {
                                 'error_code': ec,
-                                'transducer_channel_teds': aa
+                                'transducer_channel_teds': aa,
+                                'version': teds_cache.teds_version(aa)
                                 }]
 
         msg = ncap_client.network_interface.codec.encode(request)
@@ -804,7 +808,8 @@ class TestNcaplite(unittest.TestCase):
 
         expected_response = [733, {
                                 'error_code': ec,
-                                'transducer_name_teds': aa
+                                'transducer_name_teds': aa,
+                                'version': teds_cache.teds_version(aa)
                                 }]
 
         msg = ncap_client.network_interface.codec.encode(request)
@@ -823,6 +828,275 @@ class TestNcaplite(unittest.TestCase):
 
         self.assertEqual(expected_teds_dict, actual_teds_dict)
 
+    def test_stream_subscriber_is_sender(self):
+        """ Test that streams are pushed to the sender of the request and
+        dropped when it goes offline """
+        ncap = ncaplite.NCAP()
+        ncap.network_interface = mock.Mock()
+        ncap.network_interface.parse_outbound.return_value = 'msg'
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.stream_manager = mock.Mock()
+        tdas.stream_manager.subscribe.return_value = {'error_code': 0,
+                                                      'operation_id': 1}
+        ncap.register_transducer_data_access_service(tdas)
+
+        request = [7250, {'ncap_id': 1, 'tim_id': 1, 'channel_id': 2,
+                          'client_id': 'victim@ncaplite.loc'}]
+        ncap.handler_thread(request, ('from', 'client@ncaplite.loc/r'),
+                            ncap.message_handlers[7250])
+        tdas.stream_manager.subscribe.assert_called_once_with(
+                            'client@ncaplite.loc/r', 1, 2, 1, None)
+        ncap.network_interface.send_message.assert_called_once_with(
+                            mto='client@ncaplite.loc/r', mbody='msg',
+                            mtype='chat')
+
+        # pushed samples are told apart from the subscription reply
+        ncap.send_stream_samples('client@ncaplite.loc/r', 1, 2, ['m'])
+        push = ncap.network_interface.parse_outbound.call_args[0][0]
+        self.assertEqual(push[0], 7252)
+        self.assertEqual(push[1]['samples'], ['m'])
+        ncap.send_sensor_alert('client@ncaplite.loc/r', {'rule_id': 3})
+        push = ncap.network_interface.parse_outbound.call_args[0][0]
+        self.assertEqual(push, [7433, {'rule_id': 3, 'ncap_id': ncap.id}])
+
+        ncap.on_network_if_unavailable({'from': 'client@ncaplite.loc/r'})
+        tdas.stream_manager.unsubscribe_client.assert_called_once_with(
+                            'client@ncaplite.loc/r')
+
+        tdas.sensor_alerts = mock.Mock()
+        tdas.sensor_alerts.remove_client.return_value = []
+        request = [7432, {'ncap_id': 1, 'subscription_id': 3}]
+        ncap.handler_thread(request, ('from', 'client@ncaplite.loc/r'),
+                            ncap.message_handlers[7432])
+        tdas.sensor_alerts.remove_rule.assert_called_once_with(
+                            3, 'client@ncaplite.loc/r')
+
+    def test_sample_history_from_config(self):
+        """ Test that the channels of the sample_history config element
+        have their history kept """
+        tree = ET.parse('tests/testconfig.xml')
+        history = ET.SubElement(tree.getroot(), 'sample_history')
+        ET.SubElement(history, 'channel', tim_id='1', channel_id='2',
+                      capacity='500', sampling_rate='10')
+        ET.SubElement(history, 'channel', tim_id='3', channel_id='1',
+                      capacity='20')
+        tree.write('tests/testhistoryconfig.xml')
+        try:
+            ncap = ncaplite.NCAP()
+            ncap.load_config('tests/testhistoryconfig.xml')
+        finally:
+            os.remove('tests/testhistoryconfig.xml')
+        self.assertEqual(ncap.sample_history_channels,
+                         [(1, 2, 500, 10.0), (3, 1, 20, None)])
+
+        ncap.transducer_access = mock.Mock()
+        ncap.transducer_access.enable_sample_history.return_value = {
+            'error_code': ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                ieee1451.ErrorCode.NO_ERROR)}
+        self.assertEqual(len(ncap.start_sample_history()), 2)
+        ncap.transducer_access.enable_sample_history.assert_called_with(
+                            12345, 3, 1, 20, None)
+
+    def test_persistent_teds_cache_from_config(self):
+        """ Test that the teds_cache config element gives the TEDS access
+        service a persistent cache which is revalidated on start """
+        tree = ET.parse('tests/testconfig.xml')
+        cache = ET.SubElement(tree.getroot(), 'teds_cache')
+        ET.SubElement(cache, 'db_path').text = 'tests/testncapteds.db'
+        ET.SubElement(cache, 'ttl').text = '60'
+        tree.write('tests/testcacheconfig.xml')
+        try:
+            ncap = ncaplite.NCAP()
+            ncap.load_config('tests/testcacheconfig.xml')
+        finally:
+            os.remove('tests/testcacheconfig.xml')
+        self.assertEqual(ncap.teds_cache_path, 'tests/testncapteds.db')
+        self.assertEqual(ncap.teds_cache_ttl, 60.0)
+
+        ncap.teds_access = mock.Mock()
+        ncap.network_interface = mock.Mock()
+        ncap.warmup_enabled = False
+        try:
+            ncap.start()
+            cache = ncap.teds_cache
+            self.assertIsInstance(cache, teds_cache.PersistentTEDSCache)
+            ncap.teds_access.register_teds_cache.assert_called_once_with(
+                                                                    cache)
+            self.assertTrue(ncap.teds_access.start_cache_revalidation.called)
+            ncap.stop()
+            self.assertIsNone(ncap.teds_cache)
+        finally:
+            os.remove('tests/testncapteds.db')
+
+    def test_calibration_loaded_by_warmup(self):
+        """ Test that the Calibration TEDS read by the warm-up are applied
+        to the transducer data access service """
+        ncap = ncaplite.NCAP()
+        ncap.transducer_access = mock.Mock()
+        cal = teds_support.TEDSType.CAL_TEDS
+        ncap.on_teds_warmup_read(3, 1, cal,
+                                 {'teds': 'cal', 'version': 'v1'})
+        ncap.on_teds_warmup_read(3, 1, teds_support.TEDSType.CHAN_TEDS,
+                                 {'teds': 'chan', 'version': 'v1'})
+        ncap.transducer_access.load_calibration.assert_called_once_with(
+                                                        3, 1, 'cal', 'v1')
+
+    def test_teds_files_from_config(self):
+        """ Test that the TEDS files of the teds_files config element are
+        served by the TEDS access service """
+        tree = ET.parse('tests/testconfig.xml')
+        files = ET.SubElement(tree.getroot(), 'teds_files')
+        ET.SubElement(files, 'file', tim_id='2', channel_id='1').text = \
+            'tests/SmartTransducerTEDSMock.xml'
+        tree.write('tests/testtedsfilesconfig.xml')
+        try:
+            ncap = ncaplite.NCAP()
+            ncap.load_config('tests/testtedsfilesconfig.xml')
+        finally:
+            os.remove('tests/testtedsfilesconfig.xml')
+        self.assertEqual(ncap.teds_files,
+                         [('tests/SmartTransducerTEDSMock.xml', 2, 1)])
+
+        ncap.teds_access = teds_access_services.TEDSAccessServices()
+        ncap.network_interface = mock.Mock()
+        ncap.warmup_enabled = False
+        ncap.session_pool_enabled = False
+        ncap.start()
+        self.assertIs(ncap.teds_access.teds_repository, ncap.teds_repository)
+        self.assertIsNotNone(ncap.teds_repository.get(
+                            2, 1, teds_support.TEDSType.CHAN_TEDS))
+
+    def test_roster_persisted_from_start_to_stop(self):
+        """ Test that start opens the roster file and persists joins,
+        which stop writes back """
+        tree = ET.parse('tests/testconfig.xml')
+        persistence = ET.SubElement(tree.getroot(), 'roster_persistence')
+        ET.SubElement(persistence, 'flush_interval').text = '60'
+        tree.write('tests/testrosterconfig.xml')
+        try:
+            ncap = ncaplite.NCAP()
+            ncap.load_config('tests/testrosterconfig.xml')
+        finally:
+            os.remove('tests/testrosterconfig.xml')
+        self.assertEqual(ncap.roster_flush_interval, 60.0)
+
+        ncap.network_interface = mock.Mock()
+        ncap.warmup_enabled = False
+        discovery = discovery_services.DiscoveryServices()
+        ncap.register_discovery_service(discovery)
+        ncap.start()
+        self.assertIsNotNone(discovery.roster_store)
+        discovery.ncap_client_join('client@ncaplite.loc')
+        ncap.stop()
+        self.assertIsNone(discovery.roster_store)
+
+        root = ET.parse('tests/testroster.xml').getroot()
+        self.assertEqual([user.find('jid').text
+                          for user in root.findall('user')],
+                         ['client@ncaplite.loc'])
+
+    def test_session_pool_registered_on_start(self):
+        """ Test that start shares one session pool between services using
+        the same TransducerAccess object and stop closes it """
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+        tedsvc = teds_access_services.TEDSAccessServices()
+        tedsvc.register_transducer_access_service(tdaccs)
+        ncap = ncaplite.NCAP()
+        ncap.network_interface = mock.Mock()
+        ncap.warmup_enabled = False
+        ncap.register_transducer_data_access_service(tdas)
+        ncap.register_teds_access_service(tedsvc)
+
+        ncap.start()
+        self.assertEqual(len(ncap.session_pools), 1)
+        self.assertIs(tdas.session_pool, ncap.session_pools[0])
+        self.assertIs(tedsvc.session_pool, ncap.session_pools[0])
+        pool = tdas.session_pool
+        ncap.stop()
+        self.assertTrue(pool.closed)
+        self.assertEqual(ncap.session_pools, [])
+
+    def test_teds_access_shares_tim_discovery(self):
+        """ Test that bulk TEDS reads list channels with the TimDiscovery
+        service of the discovery service """
+        tdisco = mock.Mock(spec=transducer_services_base.TimDiscoveryBase)
+        tedsvc = teds_access_services.TEDSAccessServices()
+        discovery = discovery_services.DiscoveryServices()
+        ncap = ncaplite.NCAP()
+        ncap.register_teds_access_service(tedsvc)
+        ncap.register_discovery_service(discovery)
+        self.assertIsNone(tedsvc.tim_discovery)
+
+        discovery.register_transducer_access_service(tdisco)
+        ncap.share_tim_discovery()
+        self.assertIs(tedsvc.tim_discovery, tdisco)
+
+    def test_discovery_feed_subscriber_is_sender(self):
+        """ Test that the discovery feed pushes to the sender of the
+        request and drops it when it unjoins """
+        ncap = ncaplite.NCAP()
+        ncap.network_interface = mock.Mock()
+        ncap.network_interface.parse_outbound.return_value = 'msg'
+        discovery = discovery_services.DiscoveryServices()
+        discovery.open_roster('tests/testroster.xml')
+        ncap.register_discovery_service(discovery)
+
+        request = [718, {'ncap_id': 1, 'client_id': 'victim@ncaplite.loc'}]
+        ncap.handler_thread(request, ('from', 'client@ncaplite.loc/r'),
+                            ncap.message_handlers[718])
+        self.assertEqual(discovery.discovery_feed.subscribers,
+                         set(['client@ncaplite.loc/r']))
+
+        # pushed deltas are told apart from the subscription reply
+        discovery.discovery_feed.update_tims([7])
+        push = ncap.network_interface.parse_outbound.call_args[0][0]
+        self.assertEqual(push[0], 720)
+
+        ncap.handler_thread([7109, {'client_id': 'client@ncaplite.loc'}],
+                            ('from', 'client@ncaplite.loc/r'),
+                            ncap.message_handlers[7109])
+        self.assertEqual(discovery.discovery_feed.subscribers, set())
+
+    def test_topology_watch_is_opt_in(self):
+        """ Test that topology polling only runs when configured """
+        ncap = ncaplite.NCAP()
+        ncap.load_config('tests/testconfig.xml')
+        self.assertIsNone(ncap.topology_poll_interval)
+
+        tree = ET.parse('tests/testconfig.xml')
+        watch = ET.SubElement(tree.getroot(), 'topology_watch')
+        ET.SubElement(watch, 'poll_interval').text = '30'
+        tree.write('tests/testwatchconfig.xml')
+        try:
+            ncap.load_config('tests/testwatchconfig.xml')
+        finally:
+            os.remove('tests/testwatchconfig.xml')
+        self.assertEqual(ncap.topology_poll_interval, 30.0)
+
+    def test_discovery_module_timeout_from_config(self):
+        """ Test that the discovery config element sets the time a
+        communication module may take to report its TIMs """
+        tree = ET.parse('tests/testconfig.xml')
+        discovery = ET.SubElement(tree.getroot(), 'discovery')
+        ET.SubElement(discovery, 'module_timeout').text = '2.5'
+        tree.write('tests/testdiscoveryconfig.xml')
+        try:
+            ncap = ncaplite.NCAP()
+            ncap.load_config('tests/testdiscoveryconfig.xml')
+        finally:
+            os.remove('tests/testdiscoveryconfig.xml')
+        self.assertEqual(ncap.discovery_module_timeout, 2.5)
+
+        ncap.network_interface = mock.Mock()
+        ncap.type = 'client'
+        ncap.discovery_service = discovery_services.DiscoveryServices()
+        self.assertEqual(ncap.discovery_service.module_timeout, 10.0)
+        ncap.start()
+        self.assertEqual(ncap.discovery_service.module_timeout, 2.5)
+
 if __name__ == '__main__':
     import sys
     sys.exit(unittest.main())
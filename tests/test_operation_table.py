@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_operation_table
+----------------------------------
+
+Tests for `operation_table` module.
+"""
+
+import time
+import unittest
+from ncaplite import operation_table
+from ncaplite import ieee1451types as ieee1451
+
+
+class TestOperationTable(unittest.TestCase):
+    """This class defines the test runner for the operation table"""
+
+    def setUp(self):
+        """Setup for unit tests"""
+        self.table = operation_table.OperationTable(early_ttl=0.05)
+        self.completed = []
+        self.timed_out = []
+
+    def complete(self, values, error):
+        self.completed.append((values, error.code))
+
+    def test_deferred_result(self):
+        """ Test that callbacks run on resolve or at once when resolved """
+        deferred = operation_table.DeferredResult()
+        results = []
+        deferred.add_callback(results.append)
+        self.assertTrue(deferred.resolve(1))
+        self.assertFalse(deferred.resolve(2))
+        deferred.add_callback(results.append)
+        self.assertEqual(results, [1, 1])
+        self.assertEqual(deferred.wait(0), 1)
+
+    def test_measurement_update_completes(self):
+        """ Test that a callback completes its operation once """
+        self.table.add(7, 10, self.complete, self.timed_out.append)
+        self.assertEqual(self.table.size(), 1)
+        self.table.measurement_update(7, 42, 0)
+        self.table.measurement_update(7, 43, 0)
+        self.assertEqual(self.completed,
+                         [(42, ieee1451.ErrorCode.NO_ERROR)])
+        self.assertEqual(self.table.size(), 0)
+
+    def test_duplicate_rejected(self):
+        """ Test that a pending operation ID is not overwritten """
+        self.assertTrue(self.table.add(0, 10, self.complete, None))
+        self.assertFalse(self.table.add(0, 10, None, None))
+        self.table.measurement_update(0, 1, 0)
+        self.assertEqual(self.completed, [(1, ieee1451.ErrorCode.NO_ERROR)])
+
+    def test_status_converted(self):
+        """ Test that int statuses are converted to Error objects """
+        self.table.add(1, 10, self.complete, None)
+        self.table.actuation_complete(1, 3)
+        self.assertEqual(self.completed,
+                         [(None, ieee1451.ErrorCode.TIMEOUT)])
+
+    def test_early_callback(self):
+        """ Test a callback arriving before the operation is added """
+        self.table.measurement_update(3, 5, None)
+        self.table.add(3, 10, self.complete, None)
+        self.assertEqual(self.completed, [(5, ieee1451.ErrorCode.NO_ERROR)])
+        self.assertEqual(self.table.size(), 0)
+
+    def test_timeout(self):
+        """ Test that an operation without callback times out """
+        self.table.add(9, 0.02, self.complete,
+                       lambda: self.timed_out.append(9))
+        time.sleep(0.15)
+        self.assertEqual(self.timed_out, [9])
+        self.table.actuation_complete(9, 0)
+        self.assertEqual(self.completed, [])
+
+        # the late callback is dropped after early_ttl
+        time.sleep(0.15)
+        self.assertEqual(self.table.early, {})
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
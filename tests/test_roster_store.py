@@ -0,0 +1,126 @@
+"""
+test_roster_store
+----------------------------------
+
+Tests for `roster_store` module.
+"""
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import mock
+import xml.etree.ElementTree as ET
+from ncaplite import roster_store
+from ncaplite import discovery_services
+
+
+class TestRosterStore(unittest.TestCase):
+    """TestCase for write-behind roster persistence."""
+
+    roster_path = 'tests/teststoreroster.xml'
+    journal_path = 'tests/teststoreroster.journal'
+
+    def setUp(self):
+        root = ET.Element("roster")
+        ET.ElementTree(root).write(self.roster_path)
+
+    def tearDown(self):
+        for path in (self.roster_path, self.journal_path,
+                     self.journal_path + '.old', self.roster_path + '.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def roster_jids(self):
+        root = ET.parse(self.roster_path).getroot()
+        return sorted(user.find('jid').text for user in root.findall('user'))
+
+    def test_write_atomic(self):
+        """Test that write_atomic replaces the file and leaves no temp."""
+        roster_store.write_atomic(self.roster_path, b'<roster />')
+        with open(self.roster_path, 'rb') as f:
+            self.assertEqual(f.read(), b'<roster />')
+        self.assertFalse(os.path.exists(self.roster_path + '.tmp'))
+
+    def test_read_journal_skips_partial_line(self):
+        """Test that a torn last journal line is ignored."""
+        with open(self.journal_path, 'w') as f:
+            f.write('+a@x\n-a@x\n+b@')
+        self.assertEqual(roster_store.read_journal(self.journal_path),
+                         [('+', 'a@x'), ('-', 'a@x')])
+
+    def test_flush_on_max_pending(self):
+        """Test that reaching max_pending changes writes the roster."""
+        discovery = discovery_services.DiscoveryServices()
+        discovery.open_roster(self.roster_path)
+        store = discovery.enable_roster_persistence(flush_interval=60,
+                                                    max_pending=3)
+        discovery.ncap_client_join('a@ncaplite.loc')
+        discovery.ncap_client_join('b@ncaplite.loc')
+        self.assertEqual(self.roster_jids(), [])
+        discovery.ncap_client_join('c@ncaplite.loc')
+        with store.lock:
+            while store.pending or not store.flushes:
+                store.changed.wait(0.01)
+        discovery.close_roster()
+        self.assertEqual(self.roster_jids(), ['a@ncaplite.loc',
+                                              'b@ncaplite.loc',
+                                              'c@ncaplite.loc'])
+
+    def test_close_flushes(self):
+        """Test that closing the roster writes unsaved changes."""
+        discovery = discovery_services.DiscoveryServices()
+        discovery.open_roster(self.roster_path)
+        discovery.enable_roster_persistence(flush_interval=60,
+                                            journal_path=self.journal_path)
+        discovery.ncap_client_join('a@ncaplite.loc')
+        discovery.ncap_client_join('b@ncaplite.loc')
+        discovery.ncap_client_unjoin('a@ncaplite.loc')
+        discovery.close_roster()
+        self.assertEqual(self.roster_jids(), ['b@ncaplite.loc'])
+        self.assertEqual(roster_store.read_journal(self.journal_path), [])
+
+    def test_failed_flush_keeps_changes(self):
+        """Test that changes stay pending when writing the roster fails, so
+        closing the store writes them."""
+        store = roster_store.RosterStore(self.roster_path, None,
+                                         flush_interval=60)
+        store.snapshot = lambda: (store.rotate_journal(), b'<roster />')[1]
+        store.record(roster_store.JOIN, 'a@ncaplite.loc')
+        with mock.patch.object(roster_store, 'write_atomic',
+                               side_effect=IOError('disk full')):
+            self.assertRaises(IOError, store.flush)
+        self.assertEqual(store.pending, 1)
+        with mock.patch.object(roster_store, 'write_atomic') as write:
+            store.close()
+            write.assert_called_once_with(self.roster_path, b'<roster />')
+        self.assertEqual(store.pending, 0)
+
+    def test_journal_replay(self):
+        """Test that journaled changes which were never flushed are
+        replayed when persistence is enabled again."""
+        discovery = discovery_services.DiscoveryServices()
+        discovery.open_roster(self.roster_path)
+        store = discovery.enable_roster_persistence(
+                        flush_interval=60, journal_path=self.journal_path)
+        discovery.ncap_client_join('a@ncaplite.loc')
+        discovery.ncap_client_join('b@ncaplite.loc')
+        discovery.ncap_client_unjoin('a@ncaplite.loc')
+        # simulate a crash: stop the flusher without writing the roster
+        with store.lock:
+            store.running = False
+            store.changed.notify_all()
+        store.thread.join()
+        store.journal.close()
+        self.assertEqual(self.roster_jids(), [])
+
+        discovery = discovery_services.DiscoveryServices()
+        discovery.open_roster(self.roster_path)
+        discovery.enable_roster_persistence(journal_path=self.journal_path)
+        self.assertTrue(discovery.is_client_on_roster('b@ncaplite.loc'))
+        self.assertFalse(discovery.is_client_on_roster('a@ncaplite.loc'))
+        self.assertEqual(self.roster_jids(), ['b@ncaplite.loc'])
+        discovery.close_roster()
+
+if __name__ == '__main__':
+    unittest.main()
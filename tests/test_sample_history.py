@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_sample_history
+----------------------------------
+
+Tests for `sample_history` module.
+"""
+
+import unittest
+from ncaplite import sample_history
+from ncaplite import simple_json_codec
+from ncaplite import ieee1451types as ieee1451
+
+
+class TestSampleHistory(unittest.TestCase):
+    """This class defines the test runner for the sample history"""
+
+    def setUp(self):
+        """Setup for unit tests"""
+        self.history = sample_history.SampleHistory(5)
+        for t in range(8):
+            self.history.append(100.0 + t, t * 10)
+
+    def test_ring_keeps_latest(self):
+        """ Test that only the last capacity samples are kept """
+        timestamps, values = self.history.query().copy()
+        self.assertEqual(timestamps, [103.0, 104.0, 105.0, 106.0, 107.0])
+        self.assertEqual(values, [30.0, 40.0, 50.0, 60.0, 70.0])
+
+    def test_capacity_validated(self):
+        """ Test that an empty history is refused """
+        self.assertRaises(ValueError, sample_history.SampleHistory, 0)
+
+    def test_time_range(self):
+        """ Test selecting a time range across the wrap around """
+        view = self.history.query(104.0, 106.5)
+        self.assertEqual(len(view), 3)
+        self.assertEqual(view.copy(), ([104.0, 105.0, 106.0],
+                                       [40.0, 50.0, 60.0]))
+        self.assertEqual(len(self.history.query(200.0)), 0)
+        self.assertEqual(len(self.history.query(end=50.0)), 0)
+
+    def test_last_n(self):
+        """ Test selecting the latest samples """
+        self.assertEqual(self.history.query(last_n=2).copy()[1],
+                         [60.0, 70.0])
+        self.assertEqual(self.history.query(end=105.0, last_n=2).copy()[1],
+                         [40.0, 50.0])
+
+    def test_view_skips_overwritten_samples(self):
+        """ Test that a view copies only what is still kept """
+        view = self.history.query(103.0, 104.0)
+        self.history.append(108.0, 80)
+        self.assertEqual(view.copy(), ([104.0], [40.0]))
+
+    def test_rejected_samples(self):
+        """ Test that out of order and non numeric samples are skipped """
+        self.assertFalse(self.history.append(90.0, 1))
+        self.assertFalse(self.history.append(110.0, 'on'))
+        self.assertTrue(self.history.append(110.0, 1))
+
+    def test_encoding(self):
+        """ Test that a view encodes as an ArgumentArray """
+        codec = simple_json_codec.SimpleJsonCodec()
+        msg = codec.encode([7260, {'sample_data':
+                                   self.history.query(last_n=1)}])
+        decoded = codec.decode(msg)[1]['sample_data']
+        self.assertTrue(isinstance(decoded, ieee1451.ArgumentArray))
+        self.assertEqual(decoded.get_by_name('samples').value, [70.0])
+        self.assertEqual(decoded.get_by_name('timestamps').value, [107.0])
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
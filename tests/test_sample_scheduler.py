@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_sample_scheduler
+----------------------------------
+
+Tests for `sample_scheduler` module.
+"""
+
+import threading
+import time
+import unittest
+from array import array
+from ncaplite import sample_scheduler
+from ncaplite import ieee1451types as ieee1451
+from ncaplite.timeutil import clock
+
+
+class TestSampleScheduler(unittest.TestCase):
+    """This class defines the test runner for the sample scheduler"""
+
+    def test_deadlines_do_not_drift(self):
+        """ Test that deadlines are computed from the start """
+        scheduler = sample_scheduler.DeadlineScheduler(0.01, start=100.0)
+        self.assertAlmostEqual(scheduler.deadline(0), 100.0)
+        self.assertAlmostEqual(scheduler.deadline(250), 102.5)
+
+    def test_wait_reaches_deadline(self):
+        """ Test that wait returns no earlier than each deadline, even when
+        the work between samples takes part of the interval """
+        scheduler = sample_scheduler.DeadlineScheduler(0.005)
+        for k in range(20):
+            scheduler.wait(k)
+            self.assertTrue(clock() >= scheduler.deadline(k))
+            time.sleep(0.002)
+        # a loaded machine may delay single samples, but most must be on
+        # time and the lateness must not accumulate
+        self.assertTrue(scheduler.overruns <= 5)
+        self.assertTrue(scheduler.stats.serializable()['mean_lateness'] <
+                        0.005)
+
+    def test_cancelled_wait(self):
+        """ Test that a cancelled wait returns early """
+        cancelled = threading.Event()
+        cancelled.set()
+        scheduler = sample_scheduler.DeadlineScheduler(10.0)
+        started = clock()
+        self.assertEqual(scheduler.wait(1, cancelled), None)
+        self.assertTrue(clock() - started < 1.0)
+
+    def test_timing_stats(self):
+        """ Test the lateness statistics """
+        stats = sample_scheduler.TimingStats()
+        for lateness in [0.001, 0.003]:
+            stats.record(lateness)
+        s = stats.serializable()
+        self.assertEqual(s['count'], 2)
+        self.assertAlmostEqual(s['mean_lateness'], 0.002)
+        self.assertAlmostEqual(s['max_lateness'], 0.003)
+        self.assertAlmostEqual(s['jitter'], 0.001)
+
+    def test_late_samples_are_overruns(self):
+        """ Test that samples more than an interval late are counted """
+        scheduler = sample_scheduler.DeadlineScheduler(0.001,
+                                                       start=clock() - 1.0)
+        scheduler.wait(0)
+        self.assertEqual(scheduler.overruns, 1)
+
+    def test_start_deadline(self):
+        """ Test converting a TimeInstance to a clock deadline """
+        now = clock()
+        self.assertTrue(sample_scheduler.start_deadline(None) >= now)
+        self.assertTrue(sample_scheduler.start_deadline(
+            ieee1451.TimeInstance(0, 0)) - now < 0.5)
+        later = ieee1451.TimeInstance(int(time.time()) + 10, 0)
+        self.assertTrue(sample_scheduler.start_deadline(later) - now > 8)
+
+    def test_sample_buffer(self):
+        """ Test that numeric samples stay in a typed array """
+        buf = sample_scheduler.SampleBuffer(4)
+        buf.put(1, 10.0)
+        buf.put(2.5, 11.0)
+        self.assertTrue(isinstance(buf.values, array))
+        aa = buf.to_argument_array()
+        samples = aa.get_by_name('samples')
+        self.assertEqual(samples.type_code,
+                         ieee1451.TypeCode.FLOAT64_ARRAY_TC)
+        self.assertEqual(samples.value, [1.0, 2.5])
+        self.assertEqual(aa.get_by_name('timestamps').value, [10.0, 11.0])
+
+    def test_sample_buffer_non_numeric(self):
+        """ Test that the buffer falls back to a list """
+        buf = sample_scheduler.SampleBuffer(2)
+        buf.put(1, 10.0)
+        buf.put('on', 11.0)
+        samples = buf.to_argument_array().get_by_name('samples')
+        self.assertEqual(samples.type_code, ieee1451.TypeCode.UNKNOWN_TC)
+        self.assertEqual(samples.value, [1.0, 'on'])
+
+    def test_aligned(self):
+        """ Test placing samples on a common time base """
+        buf = sample_scheduler.SampleBuffer(4)
+        # a late first sample keeps its slot and shifts nothing
+        buf.put(1.0, 100.015, 0)
+        buf.put(2.0, 100.02, 2)
+        buf.put(3.0, 100.03, 3)
+        buf.put(4.0, 100.04, 4)
+        aligned = buf.aligned(4)
+        aa = aligned.to_argument_array()
+        self.assertEqual(aa.get_by_name('samples').value,
+                         [1.0, None, 2.0, 3.0])
+        self.assertEqual(aa.get_by_name('timestamps').value,
+                         [100.015, None, 100.02, 100.03])
+        self.assertEqual(aligned.dropped, 1)
+
+    def test_sample_value(self):
+        """ Test extracting readings from read_data results """
+        aa = ieee1451.ArgumentArray()
+        aa.put_by_index(0, ieee1451.Argument(ieee1451.TypeCode.UINT32_TC, 3))
+        self.assertEqual(sample_scheduler.sample_value(aa), 3)
+        self.assertEqual(sample_scheduler.sample_value(4), 4)
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
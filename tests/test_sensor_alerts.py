@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_sensor_alerts
+----------------------------------
+
+Tests for `sensor_alerts` module.
+"""
+
+import unittest
+from ncaplite import sensor_alerts
+
+
+class TestSensorAlerts(unittest.TestCase):
+    """This class defines the test runner for the sensor alert engine"""
+
+    def setUp(self):
+        """Setup for unit tests"""
+        self.sent = []
+        self.engine = sensor_alerts.AlertEngine()
+        self.engine.sender = \
+            lambda client_id, alert: self.sent.append((client_id,
+                                                       alert['state']))
+
+    def test_only_crossings_are_sent(self):
+        """ Test that alerts are sent on crossings, with hysteresis """
+        self.engine.add_rule('a@ncap', 1, 1, minimum=10, maximum=20,
+                             hysteresis=2)
+        for value in [15, 21, 25, 19, 18.5, 18, 17, 9, 9.5, 11, 12, 15]:
+            self.engine.feed(1, 1, value)
+        self.assertEqual(self.sent, [('a@ncap', 'high'),
+                                     ('a@ncap', 'normal'),
+                                     ('a@ncap', 'low'),
+                                     ('a@ncap', 'normal')])
+
+    def test_first_value_out_of_range(self):
+        """ Test that a channel already out of range alerts at once """
+        self.engine.add_rule('a@ncap', 1, 1, maximum=5)
+        self.engine.feed(1, 1, 7)
+        self.assertEqual(self.sent, [('a@ncap', 'high')])
+
+        # a later rule takes its state from the last value silently
+        rule = self.engine.add_rule('b@ncap', 1, 1, maximum=6)
+        self.assertEqual(rule.state, sensor_alerts.HIGH)
+        self.assertEqual(len(self.sent), 1)
+
+    def test_high_to_low(self):
+        """ Test a jump over both thresholds """
+        self.engine.add_rule('a@ncap', 1, 1, minimum=0, maximum=10)
+        for value in [5, 11, -1]:
+            self.engine.feed(1, 1, value)
+        self.assertEqual([s for _, s in self.sent], ['high', 'low'])
+
+    def test_many_rules_are_evaluated_selectively(self):
+        """ Test that a sample only evaluates the rules it can change """
+        for i in range(10000):
+            self.engine.add_rule('c%d@ncap' % i, 1, 1, maximum=i)
+        self.engine.feed(1, 1, -1)
+        channel = self.engine.channels[(1, 1)]
+        self.assertEqual(len(channel.candidates(0.5)), 1)
+        self.engine.feed(1, 1, 0.5)
+        self.assertEqual(self.sent, [('c0@ncap', 'high')])
+        self.assertEqual(len(channel.candidates(0.7)), 0)
+
+    def test_remove_rules(self):
+        """ Test removing rules """
+        rule = self.engine.add_rule('a@ncap', 1, 1, maximum=5)
+        self.engine.add_rule('b@ncap', 1, 2, maximum=5)
+        self.engine.add_rule('b@ncap/home', 1, 3, maximum=5)
+        self.assertEqual(self.engine.remove_rule(rule.subscription_id,
+                                                 'b@ncap'), None)
+        self.assertTrue(self.engine.has_rules(1, 1))
+        self.assertEqual(self.engine.remove_rule(rule.subscription_id,
+                                                 'a@ncap'), rule)
+        self.assertFalse(self.engine.has_rules(1, 1))
+        self.assertEqual(self.engine.remove_rule(rule.subscription_id), None)
+        self.assertEqual(len(self.engine.remove_client('b@ncap')), 2)
+        self.assertEqual(self.engine.channels, {})
+        self.assertEqual(self.engine.feed(1, 2, 10), [])
+
+    def test_non_numeric_values_are_ignored(self):
+        """ Test that values which are not numbers are skipped """
+        self.engine.add_rule('a@ncap', 1, 1, maximum=5)
+        self.assertEqual(self.engine.feed(1, 1, 'on'), [])
+        self.assertEqual(self.engine.feed(1, 1, None), [])
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
@@ -0,0 +1,136 @@
+"""
+test_session_pool
+----------------------------------
+
+Tests for `session_pool` module.
+"""
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import mock
+import itertools
+from ncaplite import ieee1451types as ieee1451
+from ncaplite import session_pool
+from ncaplite import transducer_services_base
+
+
+class TestSessionPool(unittest.TestCase):
+    """TestCase for the trans_comm_id session pool."""
+
+    def setUp(self):
+        self.no_error = ieee1451.Error(
+                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                ieee1451.ErrorCode.NO_ERROR)
+        ids = itertools.count(1)
+        self.tdaccs = mock.Mock(
+                spec=transducer_services_base.TransducerAccessBase)
+        self.tdaccs.open.side_effect = lambda tim_id, channel_id: {
+                'error_code': self.no_error, 'trans_comm_id': next(ids)}
+        self.tdaccs.close.return_value = {'error_code': self.no_error}
+
+    def test_sessions_are_reused(self):
+        """Test that a released session is handed out again."""
+        pool = session_pool.SessionPool(self.tdaccs)
+        first = pool.acquire(1, 1)
+        self.assertEqual(first['error_code'], self.no_error)
+        pool.release(first['trans_comm_id'], self.no_error)
+        second = pool.acquire(1, 1)
+        self.assertEqual(second['trans_comm_id'], first['trans_comm_id'])
+        other = pool.acquire(1, 2)
+        self.assertNotEqual(other['trans_comm_id'], first['trans_comm_id'])
+        self.assertEqual(self.tdaccs.open.call_count, 2)
+        self.assertFalse(self.tdaccs.close.called)
+
+    def test_broken_sessions_are_closed(self):
+        """Test that a session released with a network error is closed."""
+        pool = session_pool.SessionPool(self.tdaccs)
+        first = pool.acquire(1, 1)
+        pool.release(first['trans_comm_id'], ieee1451.Error(
+                        ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                        ieee1451.ErrorCode.NETWORK_FAILURE))
+        self.tdaccs.close.assert_called_with(first['trans_comm_id'])
+        self.assertNotEqual(pool.acquire(1, 1)['trans_comm_id'],
+                            first['trans_comm_id'])
+
+    def test_max_open_per_tim(self):
+        """Test the per TIM limit: idle sessions of other channels are
+        closed to make room and acquire times out when all are in use."""
+        pool = session_pool.SessionPool(self.tdaccs, max_open_per_tim=2)
+        a = pool.acquire(1, 1)['trans_comm_id']
+        b = pool.acquire(1, 2)['trans_comm_id']
+        pool.acquire(2, 1)
+
+        busy = pool.acquire(1, 3, timeout=0.01)
+        self.assertEqual(busy['error_code'].code,
+                         ieee1451.ErrorCode.NETWORK_RESOURCE_EXCEEDED)
+
+        pool.release(a)
+        c = pool.acquire(1, 3, timeout=0.01)['trans_comm_id']
+        self.tdaccs.close.assert_called_with(a)
+        self.assertEqual(pool.open_count[1], 2)
+        pool.release(b)
+        pool.release(c)
+
+    def test_idle_eviction_and_health_check(self):
+        """Test that idle sessions expire and unhealthy ones are replaced."""
+        health = mock.Mock(return_value=True)
+        pool = session_pool.SessionPool(self.tdaccs, idle_timeout=10,
+                                        health_check=health,
+                                        check_interval=5)
+        with mock.patch.object(session_pool, 'clock', return_value=100.0):
+            first = pool.acquire(1, 1)['trans_comm_id']
+            pool.release(first)
+        with mock.patch.object(session_pool, 'clock', return_value=106.0):
+            self.assertEqual(pool.acquire(1, 1)['trans_comm_id'], first)
+            health.assert_called_once_with(first)
+            health.return_value = False
+            pool.release(first)
+        with mock.patch.object(session_pool, 'clock', return_value=112.0):
+            second = pool.acquire(1, 1)['trans_comm_id']
+            self.assertNotEqual(second, first)
+            self.tdaccs.close.assert_called_with(first)
+            pool.release(second)
+        with mock.patch.object(session_pool, 'clock', return_value=123.0):
+            self.assertEqual(pool.evict_idle(), 1)
+        self.assertEqual(pool.open_count, {})
+
+    def test_default_acquire_timeout(self):
+        """Test that acquire gives up after acquire_timeout by default."""
+        pool = session_pool.SessionPool(self.tdaccs, max_open_per_tim=1,
+                                        acquire_timeout=0.01)
+        pool.acquire(1, 1)
+        busy = pool.acquire(1, 2)
+        self.assertEqual(busy['error_code'].code,
+                         ieee1451.ErrorCode.NETWORK_RESOURCE_EXCEEDED)
+
+    def test_eviction_thread(self):
+        """Test that releasing a session schedules idle eviction, which
+        stops when the pool is closed."""
+        pool = session_pool.SessionPool(self.tdaccs, idle_timeout=0.01)
+        first = pool.acquire(1, 1)['trans_comm_id']
+        pool.release(first)
+        thread = pool.eviction_thread
+        self.assertTrue(thread is not None)
+        thread.join(0.2)
+        self.assertTrue(thread.is_alive())
+        self.tdaccs.close.assert_called_with(first)
+        self.assertEqual(pool.open_count, {})
+        pool.close_all()
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+
+    def test_close_all(self):
+        """Test that closing the pool closes idle and released sessions."""
+        pool = session_pool.SessionPool(self.tdaccs)
+        a = pool.acquire(1, 1)['trans_comm_id']
+        b = pool.acquire(1, 2)['trans_comm_id']
+        pool.release(a)
+        pool.close_all()
+        self.tdaccs.close.assert_called_with(a)
+        pool.release(b)
+        self.tdaccs.close.assert_called_with(b)
+        self.assertEqual(pool.open_count, {})
+
+if __name__ == '__main__':
+    unittest.main()
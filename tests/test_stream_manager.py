@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_stream_manager
+----------------------------------
+
+Tests for `stream_manager` module.
+"""
+
+import time
+import unittest
+import mock
+from ncaplite import stream_manager
+from ncaplite import transducer_services_base
+from ncaplite import ieee1451types as ieee1451
+
+
+class TestStreamManager(unittest.TestCase):
+    """This class defines the test runner for the stream manager"""
+
+    def setUp(self):
+        """Setup for unit tests"""
+        self.no_error = ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                ieee1451.ErrorCode.NO_ERROR)
+        self.tdaccs = mock.Mock(
+                            spec=transducer_services_base.TransducerAccessBase)
+        self.tdaccs.open.return_value = {'error_code': self.no_error,
+                                         'trans_comm_id': 5}
+        self.tdaccs.start_stream.return_value = {'error_code': self.no_error,
+                                                 'operation_id': 0}
+        self.sent = []
+        self.manager = stream_manager.StreamManager(self.tdaccs)
+        self.manager.sender = \
+            lambda client, tim, chan, batch: self.sent.append((client, batch))
+
+    def tearDown(self):
+        """Teardown for unit tests"""
+        self.manager.stop()
+
+    def test_one_stream_for_many_subscribers(self):
+        """ Test that subscribers of a channel share one backend stream """
+        for client in range(50):
+            res = self.manager.subscribe('client%d@ncap' % client, 1, 1)
+            self.assertEqual(res['error_code'], self.no_error)
+        self.assertEqual(self.tdaccs.start_stream.call_count, 1)
+        self.tdaccs.start_stream.assert_called_with(5, self.manager,
+                                                    res['operation_id'])
+
+        self.manager.measurement_update(res['operation_id'], 'm1', 0)
+        self.assertEqual(len(self.sent), 50)
+        self.assertEqual(set(batch[0] for _, batch in self.sent),
+                         set(['m1']))
+
+        for client in range(49):
+            self.manager.unsubscribe('client%d@ncap' % client, 1, 1)
+        self.assertFalse(self.tdaccs.cancel.called)
+        self.assertTrue(self.manager.unsubscribe('client49@ncap', 1, 1))
+        self.tdaccs.cancel.assert_called_with(res['operation_id'])
+        self.tdaccs.close.assert_called_with(5)
+        self.assertEqual(self.manager.subscriptions(), {})
+        self.assertFalse(self.manager.unsubscribe('client49@ncap', 1, 1))
+
+    def test_batching(self):
+        """ Test that measurements are sent in batches per subscriber """
+        res = self.manager.subscribe('a@ncap', 1, 1, batch_size=3)
+        self.manager.subscribe('b@ncap', 1, 1)
+        for value in range(4):
+            self.manager.measurement_update(res['operation_id'], value, 0)
+
+        self.assertEqual([b for c, b in self.sent if c == 'a@ncap'],
+                         [[0, 1, 2]])
+        self.assertEqual([b for c, b in self.sent if c == 'b@ncap'],
+                         [[0], [1], [2], [3]])
+
+        # the partial batch is sent when the client leaves
+        self.manager.unsubscribe('a@ncap', 1, 1)
+        self.assertEqual(self.sent[-1], ('a@ncap', [3]))
+
+    def test_resubscribe_sends_pending_batch(self):
+        """ Test that subscribing again does not drop the queued batch """
+        res = self.manager.subscribe('a@ncap', 1, 1, batch_size=3)
+        self.manager.measurement_update(res['operation_id'], 'm1', 0)
+        self.manager.subscribe('a@ncap', 1, 1, batch_size=1)
+        self.assertEqual(self.sent, [('a@ncap', ['m1'])])
+        self.manager.measurement_update(res['operation_id'], 'm2', 0)
+        self.assertEqual(self.sent[-1], ('a@ncap', ['m2']))
+        self.assertEqual(self.tdaccs.start_stream.call_count, 1)
+
+    def test_unsubscribe_client(self):
+        """ Test that a leaving client loses every subscription """
+        self.manager.subscribe('a@ncap/home', 1, 1)
+        self.manager.subscribe('a@ncap/work', 1, 2)
+        self.manager.subscribe('ab@ncap/home', 1, 2)
+        self.assertEqual(self.manager.unsubscribe_client('a@ncap'), 2)
+        self.assertEqual(self.manager.subscriptions(),
+                         {(1, 2): ['ab@ncap/home']})
+        self.assertEqual(self.manager.unsubscribe_client('ab@ncap/home'), 1)
+        self.assertEqual(self.manager.subscriptions(), {})
+
+    def test_max_latency(self):
+        """ Test that partial batches are sent after max_latency """
+        self.manager.flush_interval = 0.01
+        res = self.manager.subscribe('a@ncap', 1, 1, batch_size=100,
+                                     max_latency=0.02)
+        self.manager.measurement_update(res['operation_id'], 'm', 0)
+        deadline = time.time() + 5
+        while not self.sent and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.sent, [('a@ncap', ['m'])])
+
+    def test_failed_stream_start(self):
+        """ Test that a stream which fails to start closes its session """
+        failure = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                 ieee1451.ErrorCode.ILLEGAL_MODE)
+        self.tdaccs.start_stream.return_value = {'error_code': failure,
+                                                 'operation_id': 0}
+        res = self.manager.subscribe('a@ncap', 1, 1)
+        self.assertEqual(res['error_code'], failure)
+        self.tdaccs.close.assert_called_with(5)
+        self.assertEqual(self.manager.subscriptions(), {})
+
+    def test_raising_stream_start(self):
+        """ Test that a stream whose start raises is rolled back """
+        self.tdaccs.start_stream.side_effect = IOError('TIM gone')
+        self.assertRaises(IOError, self.manager.subscribe, 'a@ncap', 1, 1)
+        self.tdaccs.close.assert_called_with(5)
+        self.assertEqual(self.manager.by_operation, {})
+        self.assertEqual(self.manager.subscriptions(), {})
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(unittest.main())
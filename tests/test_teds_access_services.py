@@ -9,9 +9,14 @@ Tests for `teds` module.
 
 import unittest
 import mock
+import os
+import threading
 from ncaplite import ieee1451types as ieee1451
+from ncaplite import binary_teds
 from ncaplite import teds_support
 from ncaplite import teds_access_services
+from ncaplite import teds_cache
+from ncaplite import teds_repository
 from ncaplite import transducer_services_base
 
 
@@ -169,5 +174,311 @@ class TestTEDSAccessServices(unittest.TestCase):
 
         self.assertEqual(ted_dict, expected)
 
+    def test_read_teds_uses_cache(self):
+        """ Test that repeated TEDS reads are served from the NCAP cache
+        unless the client asks for a zero max_age."""
+        no_error = ieee1451.Error(
+                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                ieee1451.ErrorCode.NO_ERROR)
+        arg_array = ieee1451.ArgumentArray()
+        arg_array.put_by_index(0, ieee1451.Argument(
+                                ieee1451.TypeCode.STRING_TC, '<teds/>'))
+
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.return_value = {'error_code': no_error, 'trans_comm_id': 1}
+        tdaccs.close.return_value = {'error_code': no_error}
+
+        tedsmgr = mock.Mock(spec=transducer_services_base.TedsManagerBase)
+        tedsmgr.update_teds_cache.return_value = {'error_code': no_error}
+        tedsmgr.read_teds.return_value = {'error_code': no_error,
+                                          'teds': arg_array}
+
+        tedsvc = teds_access_services.TEDSAccessServices()
+        tedsvc.register_transducer_access_service(tdaccs)
+        tedsvc.register_teds_manager(tedsmgr)
+
+        args = {"ncap_id": 1234,
+                "tim_id": 1,
+                "channel_id": 1,
+                "timeout": ieee1451.TimeDuration(secs=1, nsecs=0)
+                }
+
+        first = tedsvc.read_transducer_channel_teds(**args)
+        second = tedsvc.read_transducer_channel_teds(**args)
+
+        self.assertEqual(first, second)
+        self.assertEqual(tedsmgr.update_teds_cache.call_count, 1)
+        self.assertEqual(tdaccs.open.call_count, 1)
+        self.assertEqual(tedsvc.teds_cache.stats()['hits'], 1)
+
+        args['max_age'] = ieee1451.TimeDuration(secs=0, nsecs=0)
+        tedsvc.read_transducer_channel_teds(**args)
+        self.assertEqual(tedsmgr.update_teds_cache.call_count, 2)
+
+        tedsvc.teds_cache.invalidate(tim_id=1)
+        del args['max_age']
+        tedsvc.read_transducer_channel_teds(**args)
+        self.assertEqual(tedsmgr.update_teds_cache.call_count, 3)
+
+    def test_revalidate_persistent_cache(self):
+        """ Test that TEDS loaded from disk are served at once and then
+        read again from the TIM by the background revalidation."""
+        no_error = ieee1451.Error(
+                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                ieee1451.ErrorCode.NO_ERROR)
+        old_teds = ieee1451.ArgumentArray()
+        old_teds.put_by_index(0, ieee1451.Argument(
+                                ieee1451.TypeCode.STRING_TC, '<old/>'))
+        new_teds = ieee1451.ArgumentArray()
+        new_teds.put_by_index(0, ieee1451.Argument(
+                                ieee1451.TypeCode.STRING_TC, '<new/>'))
+
+        db_path = 'tests/testtedscache.db'
+        cache = teds_cache.PersistentTEDSCache(db_path)
+        cache.put(1, 1, teds_support.TEDSType.CHAN_TEDS, old_teds)
+        cache.close()
+
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.return_value = {'error_code': no_error, 'trans_comm_id': 1}
+        tedsmgr = mock.Mock(spec=transducer_services_base.TedsManagerBase)
+        tedsmgr.update_teds_cache.return_value = {'error_code': no_error}
+        tedsmgr.read_teds.return_value = {'error_code': no_error,
+                                          'teds': new_teds}
+
+        tedsvc = teds_access_services.TEDSAccessServices()
+        tedsvc.register_transducer_access_service(tdaccs)
+        tedsvc.register_teds_manager(tedsmgr)
+        tedsvc.register_teds_cache(teds_cache.PersistentTEDSCache(db_path))
+
+        args = {"ncap_id": 1234,
+                "tim_id": 1,
+                "channel_id": 1,
+                "timeout": ieee1451.TimeDuration(secs=1, nsecs=0)
+                }
+        result = tedsvc.read_transducer_channel_teds(**args)
+        self.assertEqual(result['transducer_channel_teds'], old_teds)
+        self.assertFalse(tdaccs.open.called)
+
+        tedsvc.start_cache_revalidation(args['timeout']).join()
+
+        result = tedsvc.read_transducer_channel_teds(**args)
+        self.assertEqual(result['transducer_channel_teds'], new_teds)
+        self.assertEqual(tedsvc.teds_cache.pending_validation(), [])
+        tedsvc.teds_cache.close()
+        os.remove(db_path)
+
+    def test_read_teds_if_none_match(self):
+        """ Test that a client holding the current version of a TEDS gets a
+        not-modified response without the TEDS."""
+        no_error = ieee1451.Error(
+                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                ieee1451.ErrorCode.NO_ERROR)
+        arg_array = ieee1451.ArgumentArray()
+        arg_array.put_by_index(0, ieee1451.Argument(
+                                ieee1451.TypeCode.STRING_TC, '<teds/>'))
+
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.return_value = {'error_code': no_error, 'trans_comm_id': 1}
+        tdaccs.close.return_value = {'error_code': no_error}
+        tedsmgr = mock.Mock(spec=transducer_services_base.TedsManagerBase)
+        tedsmgr.update_teds_cache.return_value = {'error_code': no_error}
+        tedsmgr.read_teds.return_value = {'error_code': no_error,
+                                          'teds': arg_array}
+
+        tedsvc = teds_access_services.TEDSAccessServices()
+        tedsvc.register_transducer_access_service(tdaccs)
+        tedsvc.register_teds_manager(tedsmgr)
+
+        args = {"ncap_id": 1234,
+                "tim_id": 1,
+                "channel_id": 1,
+                "timeout": ieee1451.TimeDuration(secs=1, nsecs=0)
+                }
+
+        first = tedsvc.read_user_transducer_name_teds(**args)
+        self.assertEqual(first['transducer_name_teds'], arg_array)
+        self.assertEqual(first['version'], teds_cache.teds_version(arg_array))
+
+        args['if_none_match'] = first['version']
+        second = tedsvc.read_user_transducer_name_teds(**args)
+        self.assertEqual(second, {'error_code': no_error,
+                                  'version': first['version'],
+                                  'not_modified': True})
+
+        args['if_none_match'] = 'stale'
+        third = tedsvc.read_user_transducer_name_teds(**args)
+        self.assertEqual(third, first)
+        self.assertEqual(tedsmgr.read_teds.call_count, 1)
+
+    def test_read_bulk_teds(self):
+        """ Test reading several TEDS types for every channel of a TIM in
+        one request, with cache hits served without touching the TIM."""
+        no_error = ieee1451.Error(
+                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                ieee1451.ErrorCode.NO_ERROR)
+
+        def read_teds_mock(trans_comm_id, timeout, teds_type):
+            arg_array = ieee1451.ArgumentArray()
+            arg_array.put_by_index(0, ieee1451.Argument(
+                        ieee1451.TypeCode.STRING_TC, teds_type.name))
+            return {'error_code': no_error, 'teds': arg_array}
+
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.return_value = {'error_code': no_error, 'trans_comm_id': 1}
+        tdaccs.close.return_value = {'error_code': no_error}
+        tedsmgr = mock.Mock(spec=transducer_services_base.TedsManagerBase)
+        tedsmgr.update_teds_cache.return_value = {'error_code': no_error}
+        tedsmgr.read_teds.side_effect = read_teds_mock
+        timdisc = mock.Mock(spec=transducer_services_base.TimDiscoveryBase)
+        timdisc.report_channels.return_value = {'error_code': no_error,
+                                                'channel_ids': [1, 2],
+                                                'names': ['a', 'b']}
+
+        tedsvc = teds_access_services.TEDSAccessServices()
+        tedsvc.register_transducer_access_service(tdaccs)
+        tedsvc.register_teds_manager(tedsmgr)
+        tedsvc.register_tim_discovery_service(timdisc)
+
+        cached = ieee1451.ArgumentArray()
+        version = tedsvc.teds_cache.put(1, 2, teds_support.TEDSType.XDCR_NAME,
+                                        cached)
+
+        result = tedsvc.read_bulk_teds(
+                    ncap_id=1234, tim_ids=[1],
+                    timeout=ieee1451.TimeDuration(secs=5, nsecs=0))
+
+        self.assertEqual(result['error_code'], no_error)
+        self.assertEqual(result['tim_ids'], [1, 1, 1, 1])
+        self.assertEqual(result['channel_ids'], [1, 1, 2, 2])
+        self.assertEqual(result['teds_types'], [
+                            teds_support.TEDSType.CHAN_TEDS.value,
+                            teds_support.TEDSType.XDCR_NAME.value] * 2)
+        self.assertEqual(result['error_codes'],
+                         [no_error.serializable()['Error']] * 4)
+        self.assertEqual(tedsmgr.read_teds.call_count, 3)
+        # each key is looked up in the cache once
+        self.assertEqual(tedsvc.teds_cache.hits, 1)
+        self.assertEqual(tedsvc.teds_cache.misses, 3)
+        versions = result['versions']
+        self.assertEqual(versions[3], version)
+        self.assertEqual(versions[0], tedsvc.teds_cache.get_entry(
+                            1, 1, teds_support.TEDSType.CHAN_TEDS).version)
+        self.assertIsNotNone(versions[0])
+
+        teds = result['teds']
+        self.assertEqual(teds.size(), 4)
+        self.assertEqual(teds.get_by_name('1/2/XDCR_NAME').value, cached)
+        chan = teds.get_by_name('1/1/CHAN_TEDS').value
+        self.assertEqual(chan.get_by_index(0).value, 'CHAN_TEDS')
+
+    def test_read_bulk_teds_timeout(self):
+        """ Test that reads which miss the bulk deadline report TIMEOUT."""
+        no_error = ieee1451.Error(
+                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                ieee1451.ErrorCode.NO_ERROR)
+        release = threading.Event()
+
+        def update_teds_cache_mock(trans_comm_id, timeout, teds_type):
+            release.wait(5)
+            return {'error_code': no_error}
+
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.return_value = {'error_code': no_error, 'trans_comm_id': 1}
+        tdaccs.close.return_value = {'error_code': no_error}
+        tedsmgr = mock.Mock(spec=transducer_services_base.TedsManagerBase)
+        tedsmgr.update_teds_cache.side_effect = update_teds_cache_mock
+        tedsmgr.read_teds.return_value = {'error_code': no_error,
+                                          'teds': ieee1451.ArgumentArray()}
+
+        tedsvc = teds_access_services.TEDSAccessServices()
+        tedsvc.register_transducer_access_service(tdaccs)
+        tedsvc.register_teds_manager(tedsmgr)
+
+        result = tedsvc.read_bulk_teds(
+                    ncap_id=1234, tim_ids=[1], channel_ids=[1],
+                    teds_types=[teds_support.TEDSType.CHAN_TEDS.value],
+                    timeout=ieee1451.TimeDuration(secs=0, nsecs=50000000))
+        release.set()
+
+        self.assertEqual(result['error_code'].code,
+                         ieee1451.ErrorCode.TIMEOUT)
+        self.assertIsNone(result['teds'].get_by_name('1/1/CHAN_TEDS').value)
+
+    def test_read_bulk_teds_without_tim_discovery(self):
+        """ Test that listing channels without TimDiscovery is an error."""
+        tedsvc = teds_access_services.TEDSAccessServices()
+        result = tedsvc.read_bulk_teds(
+                    ncap_id=1234, tim_ids=[1],
+                    timeout=ieee1451.TimeDuration(secs=1, nsecs=0))
+        self.assertEqual(result['error_code'].code,
+                         ieee1451.ErrorCode.UNKNOWN_DESTID)
+        self.assertEqual(result['tim_ids'], [])
+
+    def test_read_teds_from_repository(self):
+        """ Test that TEDS held by the repository are not read from the
+        TIM."""
+        no_error = ieee1451.Error(
+                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                ieee1451.ErrorCode.NO_ERROR)
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tedsmgr = mock.Mock(spec=transducer_services_base.TedsManagerBase)
+        repo = teds_repository.TEDSRepository()
+        repo.add_file('tests/SmartTransducerTEDSMock.xml', 1, 1)
+        tedsvc = teds_access_services.TEDSAccessServices()
+        tedsvc.register_transducer_access_service(tdaccs)
+        tedsvc.register_teds_manager(tedsmgr)
+        tedsvc.register_teds_repository(repo)
+
+        chan = teds_support.TEDSType.CHAN_TEDS
+        record = repo.get(1, 1, chan)
+        result = tedsvc.read_transducer_channel_teds(
+                    1234, 1, 1, ieee1451.TimeDuration(secs=1, nsecs=0))
+        self.assertEqual(result['error_code'], no_error)
+        self.assertEqual(
+            result['transducer_channel_teds'].get_by_index(0).value,
+            record.xml)
+        self.assertEqual(result['version'], record.version)
+
+        result = tedsvc.read_bulk_teds(
+                    1234, [1], ieee1451.TimeDuration(secs=1, nsecs=0),
+                    teds_types=[chan], channel_ids=[1])
+        self.assertEqual(result['versions'], [record.version])
+        self.assertFalse(tdaccs.open.called)
+        self.assertFalse(tedsmgr.read_teds.called)
+
+    def test_read_binary_teds(self):
+        """ Test reading a binary TEDS with its fields decoded on demand."""
+        no_error = ieee1451.Error(
+                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                ieee1451.ErrorCode.NO_ERROR)
+        chan = teds_support.TEDSType.CHAN_TEDS
+        fields = ieee1451.ArgumentArray()
+        fields.put_by_name('HiLimit', ieee1451.Argument(
+                                ieee1451.TypeCode.FLOAT32_TC, 373.0))
+        raw = binary_teds.encode_teds(chan, fields)
+
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.return_value = {'error_code': no_error, 'trans_comm_id': 1}
+        tedsmgr = mock.Mock(spec=transducer_services_base.TedsManagerBase)
+        tedsmgr.read_raw_teds.return_value = {'error_code': no_error,
+                                              'raw_teds': tuple(raw)}
+        tedsvc = teds_access_services.TEDSAccessServices()
+        tedsvc.register_transducer_access_service(tdaccs)
+        tedsvc.register_teds_manager(tedsmgr)
+
+        timeout = ieee1451.TimeDuration(secs=1, nsecs=0)
+        result = tedsvc.read_binary_teds(1, 2, timeout, chan)
+        self.assertEqual(result['error_code'], no_error)
+        self.assertEqual(result['teds'].get_by_name('HiLimit').value, 373.0)
+        tedsmgr.read_raw_teds.assert_called_once_with(1, timeout, chan)
+        tdaccs.close.assert_called_once_with(1)
+
+        raw[-1] ^= 0xFF
+        tedsmgr.read_raw_teds.return_value['raw_teds'] = tuple(raw)
+        result = tedsvc.read_binary_teds(1, 2, timeout, chan)
+        self.assertEqual(result['error_code'].code,
+                         ieee1451.ErrorCode.FATAL_TEDS_ERROR)
+        self.assertIsNone(result['teds'])
+
 if __name__ == '__main__':
     unittest.main()
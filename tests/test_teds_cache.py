@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+test_teds_cache
+----------------------------------
+
+Tests for `teds_cache` module.
+"""
+# -*- coding: utf-8 -*-
+
+import unittest
+import mock
+import os
+from ncaplite import teds_cache
+from ncaplite import teds_support
+from ncaplite import ieee1451types as ieee1451
+
+
+class TestTEDSCache(unittest.TestCase):
+    """TestCase for the NCAP TEDS cache."""
+
+    def test_get_put_invalidate(self):
+        """ Test storing, reading and invalidating TEDS entries."""
+        cache = teds_cache.TEDSCache()
+        chan = teds_support.TEDSType.CHAN_TEDS
+        name = teds_support.TEDSType.XDCR_NAME
+
+        self.assertEqual(cache.get(1, 1, chan), None)
+        cache.put(1, 1, chan, 'chan')
+        cache.put(1, 1, name, 'name')
+        cache.put(2, 1, chan, 'chan2')
+
+        self.assertEqual(cache.get(1, 1, chan), 'chan')
+        self.assertEqual(cache.get(1, 1, chan, max_age=0), None)
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 2, 'size': 3})
+
+        self.assertEqual(cache.invalidate(tim_id=1), 2)
+        self.assertEqual(cache.get(1, 1, name), None)
+        self.assertEqual(cache.get(2, 1, chan), 'chan2')
+
+    def test_get_entry_version(self):
+        """ Test that entries carry a version tag which follows the TEDS."""
+        cache = teds_cache.TEDSCache()
+        chan = teds_support.TEDSType.CHAN_TEDS
+
+        version = cache.put(1, 1, chan, 'chan')
+        entry = cache.get_entry(1, 1, chan)
+        self.assertEqual(entry.teds, 'chan')
+        self.assertEqual(entry.version, version)
+        self.assertEqual(version, teds_cache.teds_version('chan'))
+        self.assertNotEqual(cache.put(1, 1, chan, 'changed'), version)
+        self.assertEqual(cache.get_entry(1, 1, chan, max_age=0), None)
+
+    def test_ttl(self):
+        """ Test that entries expire after the cache ttl."""
+        cache = teds_cache.TEDSCache(ttl=10)
+        chan = teds_support.TEDSType.CHAN_TEDS
+
+        with mock.patch.object(teds_cache, 'clock', return_value=100.0):
+            cache.put(1, 1, chan, 'chan')
+        with mock.patch.object(teds_cache, 'clock', return_value=105.0):
+            self.assertEqual(cache.get(1, 1, chan), 'chan')
+            self.assertEqual(cache.get(1, 1, chan, max_age=1), None)
+        with mock.patch.object(teds_cache, 'clock', return_value=111.0):
+            self.assertEqual(cache.get(1, 1, chan), None)
+        self.assertEqual(cache.stats()['size'], 0)
+
+
+class TestPersistentTEDSCache(unittest.TestCase):
+    """TestCase for the sqlite backed TEDS cache."""
+
+    def setUp(self):
+        self.db_path = 'tests/testtedscache.db'
+        self.teds = ieee1451.ArgumentArray()
+        self.teds.put_by_index(0, ieee1451.Argument(
+                                ieee1451.TypeCode.STRING_TC, '<teds/>'))
+
+    def tearDown(self):
+        os.remove(self.db_path)
+
+    def test_survives_restart(self):
+        """ Test that stored TEDS are served after reopening the cache."""
+        chan = teds_support.TEDSType.CHAN_TEDS
+        cache = teds_cache.PersistentTEDSCache(self.db_path)
+        version = cache.put(1, 2, chan, self.teds)
+        cache.put(1, 3, chan, self.teds)
+        cache.invalidate(channel_id=3)
+        cache.close()
+
+        cache = teds_cache.PersistentTEDSCache(self.db_path)
+        self.assertEqual(cache.get(1, 2, chan), self.teds)
+        self.assertEqual(cache.entries[(1, 2, chan)].version, version)
+        self.assertEqual(cache.get(1, 3, chan), None)
+        self.assertEqual(cache.pending_validation(), [(1, 2, chan)])
+
+        cache.put(1, 2, chan, self.teds)
+        self.assertEqual(cache.pending_validation(), [])
+        cache.close()
+
+    def test_invalidate_expired_entry(self):
+        """ Test that invalidate removes rows which expired from memory."""
+        chan = teds_support.TEDSType.CHAN_TEDS
+        cache = teds_cache.PersistentTEDSCache(self.db_path, ttl=10)
+        with mock.patch.object(teds_cache, 'clock', return_value=100.0):
+            cache.put(1, 2, chan, self.teds)
+        with mock.patch.object(teds_cache, 'clock', return_value=111.0):
+            self.assertEqual(cache.get(1, 2, chan), None)
+        cache.invalidate(tim_id=1)
+        cache.close()
+
+        cache = teds_cache.PersistentTEDSCache(self.db_path)
+        self.assertEqual(cache.get(1, 2, chan), None)
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
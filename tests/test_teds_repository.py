@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+test_teds_repository
+----------------------------------
+
+Tests for `teds_repository` module.
+"""
+# -*- coding: utf-8 -*-
+
+import unittest
+import mock
+import os
+from ncaplite import teds_repository
+from ncaplite import teds_support
+
+MULTI_TIM_TEDS = """<TEDSCollection xmlns="http://localhost/1451HTTPAPI">
+  <SmartTransducerTEDS timId="1" channelId="1">
+    <UserTransducerNameTEDS><TCName><Value>%s</Value></TCName>
+    </UserTransducerNameTEDS>
+  </SmartTransducerTEDS>
+  <SmartTransducerTEDS timId="2" channelId="3">
+    <UserTransducerNameTEDS><TCName><Value>tim2</Value></TCName>
+    </UserTransducerNameTEDS>
+  </SmartTransducerTEDS>
+</TEDSCollection>
+"""
+
+
+class TestTEDSRepository(unittest.TestCase):
+    """TestCase for the indexed TEDS store."""
+
+    def setUp(self):
+        self.multi_path = 'tests/testteds.xml'
+        with open(self.multi_path, 'w') as f:
+            f.write(MULTI_TIM_TEDS % 'tim1')
+
+    def tearDown(self):
+        os.remove(self.multi_path)
+
+    def test_lookup_matches_element_from_file(self):
+        """ Test that indexed TEDS match teds_element_from_file."""
+        xmlpath = 'tests/SmartTransducerTEDSMock.xml'
+        xmlns = {'teds': 'http://localhost/1451HTTPAPI'}
+        expected = teds_support.teds_element_from_file(
+                            'teds:TransducerChannelTEDS', xmlns, xmlpath)[0]
+
+        repo = teds_repository.TEDSRepository()
+        repo.add_file(xmlpath, tim_id=1, channel_id=1)
+
+        chan = teds_support.TEDSType.CHAN_TEDS
+        self.assertEqual(repo.get_xml(1, 1, chan), expected)
+        self.assertEqual(repo.get_dict(1, 1, chan),
+                         teds_support.teds_dict_from_xml(expected))
+        self.assertEqual(repo.get(1, 2, chan), None)
+        self.assertEqual(repo.get(1, 1, chan).view['ChanType']['ns0:Value'],
+                         '0')
+        self.assertEqual(len(repo.keys()), 5)
+
+    def test_multi_tim_file_and_reload(self):
+        """ Test ids from attributes and reloading when the mtime changes."""
+        name = teds_support.TEDSType.XDCR_NAME
+        repo = teds_repository.TEDSRepository(check_interval=0)
+        repo.add_file(self.multi_path)
+
+        tcname = teds_support.subitem('ns0:TCName', repo.get_dict(1, 1, name))
+        self.assertEqual(tcname['ns0:Value'], 'tim1')
+        self.assertNotEqual(repo.get(2, 3, name), None)
+
+        # a lookup with an unchanged mtime must not parse the file again
+        with mock.patch.object(repo, '_load') as load:
+            repo.get(1, 1, name)
+            self.assertFalse(load.called)
+
+        with open(self.multi_path, 'w') as f:
+            f.write(MULTI_TIM_TEDS % 'renamed')
+        mtime = os.path.getmtime(self.multi_path) + 10
+        os.utime(self.multi_path, (mtime, mtime))
+
+        tcname = teds_support.subitem('ns0:TCName', repo.get_dict(1, 1, name))
+        self.assertEqual(tcname['ns0:Value'], 'renamed')
+
+    def test_failed_reload_keeps_records(self):
+        """ Test that a broken or missing file keeps its indexed TEDS."""
+        name = teds_support.TEDSType.XDCR_NAME
+        repo = teds_repository.TEDSRepository(check_interval=0)
+        repo.add_file(self.multi_path)
+        self.assertNotEqual(repo.get(1, 1, name), None)
+
+        with open(self.multi_path, 'w') as f:
+            f.write(MULTI_TIM_TEDS[:200])
+        mtime = os.path.getmtime(self.multi_path) + 10
+        os.utime(self.multi_path, (mtime, mtime))
+        self.assertEqual(repo.refresh(), 0)
+        self.assertNotEqual(repo.get(1, 1, name), None)
+        self.assertNotEqual(repo.get(2, 3, name), None)
+
+        os.remove(self.multi_path)
+        self.assertEqual(repo.refresh(), 0)
+        self.assertNotEqual(repo.get(2, 3, name), None)
+        with open(self.multi_path, 'w') as f:
+            f.write(MULTI_TIM_TEDS % 'tim1')
+
+    def test_iter_teds_records_streams(self):
+        """ Test that streamed TEDS are detached from the parsed tree."""
+        iterparse = teds_repository.ET.iterparse
+        seen = []
+
+        def iterparse_spy(*args, **kwargs):
+            for event, elem in iterparse(*args, **kwargs):
+                seen.append(elem)
+                yield event, elem
+
+        with mock.patch.object(teds_repository.ET, 'iterparse',
+                               side_effect=iterparse_spy):
+            records = list(teds_repository.iter_teds_records(
+                                                    self.multi_path, 7, 7))
+
+        self.assertEqual([(r.tim_id, r.channel_id, r.teds_type)
+                          for r in records],
+                         [(1, 1, teds_support.TEDSType.XDCR_NAME),
+                          (2, 3, teds_support.TEDSType.XDCR_NAME)])
+        root = seen[0]
+        self.assertEqual(len(root), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -53,6 +53,62 @@ class TestTedsSupport(unittest.TestCase):
         self.assertEqual(channel_type.value, expected.value)
 
 
+    def test_teds_view(self):
+        """ Test the flattened TEDS view against subitem."""
+        d = OrderedDict()
+        d['a'] = 1
+        d['b'] = OrderedDict()
+        d['b']['a'] = 2
+        d['b']['c'] = OrderedDict()
+        d['b']['c']['d'] = 3
+        d['e'] = OrderedDict()
+        d['e']['d'] = 4
+        d['f'] = [OrderedDict([('g', 5)]), OrderedDict([('g', 6)])]
+
+        view = teds.TEDSView(d)
+        for key in ('a', 'b', 'c', 'd', 'e', 'f'):
+            self.assertEqual(view[key], teds.subitem(key, d))
+        self.assertEqual(view['b/a'], 2)
+        self.assertEqual(view['e/d'], 4)
+        self.assertEqual(view['f/1/g'], 6)
+        self.assertFalse('g' in view)
+        self.assertEqual(view.get('x'), None)
+        self.assertRaises(KeyError, lambda: view['x'])
+
+        view.set_teds(OrderedDict([('a', 7)]))
+        self.assertEqual(view['a'], 7)
+        self.assertEqual(view.get('b'), None)
+
+    def test_teds_view_skips_nested_none(self):
+        """ Test that the view resolves empty elements like subitem."""
+        d = OrderedDict()
+        d['b'] = OrderedDict([('x', None),
+                              ('c', OrderedDict([('x', 1)]))])
+        d['e'] = OrderedDict([('x', 2), ('y', None)])
+
+        view = teds.TEDSView(d)
+        self.assertEqual(teds.subitem('x', d), 2)
+        self.assertEqual(view['x'], teds.subitem('x', d))
+        self.assertEqual(view.get('y'), teds.subitem('y', d))
+        self.assertEqual(view['b/x'], None)
+
+        # a None at the top level is the answer, as for subitem
+        d['x'] = None
+        view.invalidate()
+        self.assertEqual(teds.subitem('x', d), None)
+        self.assertEqual(view['x'], None)
+
+    def test_teds_view_from_file(self):
+        """ Test looking up namespaced TEDS fields by name and path."""
+        xmlpath = 'tests/SmartTransducerTEDSMock.xml'
+        xmlns = {'teds': 'http://localhost/1451HTTPAPI'}
+        xml = teds.teds_element_from_file('teds:TransducerChannelTEDS',
+                                          xmlns, xmlpath)[0]
+        view = teds.TEDSView(teds.teds_dict_from_xml(xml))
+        path = 'TransducerChannelTEDS/TransducerChannelTEDSDataBlock/HiLimit'
+        self.assertEqual(view[path + '/Value'], '373')
+        self.assertEqual(view['SigBits']['ns0:Value'], '16')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,112 @@
+"""
+test_teds_warmup
+----------------------------------
+
+Tests for `teds_warmup` module.
+"""
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import mock
+import threading
+from ncaplite import ieee1451types as ieee1451
+from ncaplite import teds_support
+from ncaplite import teds_warmup
+from ncaplite import teds_access_services
+from ncaplite import discovery_services
+from ncaplite import transducer_services_base
+
+
+class TestTEDSWarmup(unittest.TestCase):
+    """TestCase for the startup TEDS cache warm-up."""
+
+    def setUp(self):
+        self.no_error = ieee1451.Error(
+                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                ieee1451.ErrorCode.NO_ERROR)
+        self.tims = {1: [1, 2], 2: [3]}
+        self.channels = {1: [1, 2], 2: [1], 3: [1, 2, 3]}
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+        def read_teds_mock(trans_comm_id, timeout, teds_type):
+            with self.lock:
+                self.active += 1
+                self.max_active = max(self.max_active, self.active)
+            arg_array = ieee1451.ArgumentArray()
+            with self.lock:
+                self.active -= 1
+            return {'error_code': self.no_error, 'teds': arg_array}
+
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.return_value = {'error_code': self.no_error,
+                                    'trans_comm_id': 1}
+        tdaccs.close.return_value = {'error_code': self.no_error}
+
+        timdisc = mock.Mock(spec=transducer_services_base.TimDiscoveryBase)
+        timdisc.report_comm_module.return_value = {
+                'error_code': self.no_error, 'module_ids': [1, 2]}
+        timdisc.report_tims.side_effect = lambda m: {
+                'error_code': self.no_error, 'tim_ids': self.tims[m]}
+        timdisc.report_channels.side_effect = lambda t: {
+                'error_code': self.no_error,
+                'channel_ids': self.channels[t],
+                'channel_names': [str(c) for c in self.channels[t]]}
+
+        tedsmgr = mock.Mock(spec=transducer_services_base.TedsManagerBase)
+        tedsmgr.update_teds_cache.return_value = {'error_code': self.no_error}
+        tedsmgr.read_teds.side_effect = read_teds_mock
+
+        self.discovery = discovery_services.DiscoveryServices()
+        self.discovery.register_transducer_access_service(timdisc)
+        self.teds_svc = teds_access_services.TEDSAccessServices()
+        self.teds_svc.register_transducer_access_service(tdaccs)
+        self.teds_svc.register_teds_manager(tedsmgr)
+        self.tedsmgr = tedsmgr
+
+    def test_prefetch_every_channel(self):
+        """Test that the TEDS of every discovered channel are cached."""
+        reports = []
+        read = []
+        warmup = teds_warmup.TEDSWarmup(
+                    self.discovery, self.teds_svc, max_workers_per_module=2,
+                    on_progress=reports.append,
+                    on_teds=lambda t, c, ty, rtres: read.append((t, c, ty)))
+        warmup.start().join(5)
+
+        self.assertEqual(warmup.progress(), {'state': 'done', 'total': 12,
+                                             'completed': 12, 'failed': 0})
+        self.assertEqual(reports[0]['state'], 'discovering')
+        self.assertEqual(reports[-1]['state'], 'done')
+        self.assertLessEqual(self.max_active, 4)
+        self.assertEqual(len(read), 12)
+        self.assertIn((3, 3, teds_support.TEDSType.XDCR_NAME), read)
+
+        cache = self.teds_svc.teds_cache
+        for tim_id, chans in self.channels.items():
+            for channel_id in chans:
+                for teds_type in (teds_support.TEDSType.CHAN_TEDS,
+                                  teds_support.TEDSType.XDCR_NAME):
+                    self.assertIsNotNone(
+                            cache.get(tim_id, channel_id, teds_type))
+
+    def test_failed_reads_are_counted(self):
+        """Test that TEDS reads which fail are reported as failed."""
+        self.tedsmgr.read_teds.side_effect = IOError('TIM gone')
+        warmup = teds_warmup.TEDSWarmup(
+                    self.discovery, self.teds_svc,
+                    teds_types=[teds_support.TEDSType.CHAN_TEDS])
+        progress = warmup.run()
+        self.assertEqual(progress, {'state': 'done', 'total': 6,
+                                    'completed': 0, 'failed': 6})
+
+    def test_discovery_failure(self):
+        """Test that the warm-up stops when discovery fails."""
+        warmup = teds_warmup.TEDSWarmup(discovery_services.DiscoveryServices(),
+                                        self.teds_svc)
+        self.assertEqual(warmup.run()['state'], 'failed')
+
+if __name__ == '__main__':
+    unittest.main()
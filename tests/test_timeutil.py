@@ -0,0 +1,40 @@
+"""
+test_timeutil
+----------------------------------
+
+Tests for `timeutil` module.
+"""
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import time
+import mock
+from ncaplite import timeutil
+
+
+class TestTimeutil(unittest.TestCase):
+    """TestCase for the monotonic clock."""
+
+    def test_clock_is_monotonic(self):
+        """Test that the clock advances and ignores the system time."""
+        self.assertTrue(timeutil.MONOTONIC)
+        first = timeutil.clock()
+        with mock.patch.object(time, 'time', return_value=0.0):
+            second = timeutil.clock()
+        time.sleep(0.01)
+        third = timeutil.clock()
+        self.assertTrue(first <= second < third)
+        self.assertTrue(third - first >= 0.009)
+
+    def test_posix_clock(self):
+        """Test the ctypes clock_gettime source used on Python 2."""
+        posix = timeutil._posix_clock()
+        if posix is None:
+            self.skipTest('clock_gettime is not available')
+        first = posix()
+        time.sleep(0.01)
+        self.assertTrue(posix() - first >= 0.009)
+
+if __name__ == '__main__':
+    unittest.main()
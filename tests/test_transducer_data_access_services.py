@@ -8,11 +8,15 @@ test_transducer_data_access_services
 Tests for `transducer_data_access_services` module.
 """
 
+import threading
+import time
 import unittest
 import mock
 from ncaplite import transducer_data_access_services
 from ncaplite import transducer_services_base
 from ncaplite import ieee1451types as ieee1451
+from ncaplite import session_pool
+from ncaplite import teds_support
 
 
 class TestTransducerDataAccessServices(unittest.TestCase):
@@ -147,6 +151,824 @@ class TestTransducerDataAccessServices(unittest.TestCase):
         self.assertEqual(expected_response, response)
         self.assertEqual(expected_output, self.result)
 
+    def test_read_with_session_pool(self):
+        """ Test that repeated reads borrow a pooled session instead of
+        opening and closing one per request """
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.return_value = {'error_code': self.no_error,
+                                    'trans_comm_id': 7}
+        tdaccs.read_data.return_value = {'error_code': self.no_error,
+                                         'result': ieee1451.ArgumentArray()}
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+        tdas.register_session_pool(session_pool.SessionPool(tdaccs))
+
+        request = {'ncap_id': 1234,
+                   'tim_id': 1,
+                   'channel_id': 1,
+                   'timeout': ieee1451.TimeDuration(0, 1000),
+                   'sampling_mode': 0}
+        for _ in range(3):
+            read = tdas.read_transducer_sample_data_from_a_channel_of_a_tim
+            response = read(**request)
+            self.assertEqual(response['error_code'], self.no_error)
+
+        self.assertEqual(tdaccs.open.call_count, 1)
+        self.assertFalse(tdaccs.close.called)
+        tdaccs.read_data.assert_called_with(7, ieee1451.TimeDuration(0, 1000),
+                                            0)
+
+    def test_failed_acquire_is_reported(self):
+        """ Test that a session the pool cannot hand out is reported
+        without touching the TIM """
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.return_value = {'error_code': self.no_error,
+                                    'trans_comm_id': 7}
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+        pool = session_pool.SessionPool(tdaccs, max_open_per_tim=1,
+                                        acquire_timeout=0.01)
+        tdas.register_session_pool(pool)
+        pool.acquire(1, 2)
+
+        timeout = ieee1451.TimeDuration(0, 1000)
+        read = tdas.read_transducer_sample_data_from_a_channel_of_a_tim(
+                                1234, 1, 1, timeout, 0)
+        written = tdas.write_transducer_sample_data_to_a_channel_of_a_tim(
+                                1234, 1, 1, timeout, 0, 5)
+        block = tdas.read_transducer_block_data_from_a_channel_of_a_tim(
+                                1234, 1, 1, timeout, 2,
+                                ieee1451.TimeDuration(0, 1000),
+                                ieee1451.TimeInstance(0, 0))
+        for response in (read, written, block):
+            self.assertEqual(response['error_code'].code,
+                             ieee1451.ErrorCode.NETWORK_RESOURCE_EXCEEDED)
+        self.assertFalse(tdaccs.read_data.called)
+        self.assertFalse(tdaccs.write_data.called)
+
+    def test_read_transducer_block_data_from_a_channel_of_a_tim(self):
+        """ Test reading a block of samples at a fixed interval """
+        self.values = [1.5, 2.5, 3.5]
+
+        def read_data_mock(trans_comm_id, timeout, sampling_mode):
+            arg_array = ieee1451.ArgumentArray()
+            arg_array.put_by_name('result', ieee1451.Argument(
+                                ieee1451.TypeCode.FLOAT64_TC,
+                                self.values.pop(0)))
+            return {'error_code': self.no_error, 'result': arg_array}
+
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.return_value = {'error_code': self.no_error,
+                                    'trans_comm_id': 1}
+        tdaccs.read_data.side_effect = read_data_mock
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+
+        response = tdas.read_transducer_block_data_from_a_channel_of_a_tim(
+                                    ncap_id=1234, tim_id=1, channel_id=1,
+                                    timeout=ieee1451.TimeDuration(0, 1000),
+                                    number_of_samples=3,
+                                    sample_interval=ieee1451.TimeDuration(
+                                        0, 10000000),
+                                    start_time=ieee1451.TimeInstance(0, 0))
+
+        self.assertEqual(response['error_code'], self.no_error)
+        self.assertEqual(response['tim_id'], 1)
+        data = response['sample_data']
+        self.assertEqual(data.get_by_name('samples').value, [1.5, 2.5, 3.5])
+        timestamps = data.get_by_name('timestamps').value
+        self.assertEqual(len(timestamps), 3)
+        self.assertTrue(timestamps[2] - timestamps[0] > 0.015)
+        tdaccs.close.assert_called_with(1)
+
+    def test_read_block_stops_on_error(self):
+        """ Test that a failed read ends the block with the samples so far """
+        failure = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                 ieee1451.ErrorCode.TIMEOUT)
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.return_value = {'error_code': self.no_error,
+                                    'trans_comm_id': 1}
+        tdaccs.read_data.side_effect = [
+            {'error_code': self.no_error, 'result': 7},
+            {'error_code': failure, 'result': None}]
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+
+        response = tdas.read_transducer_block_data_from_a_channel_of_a_tim(
+                                    1234, 1, 1, ieee1451.TimeDuration(0, 1000),
+                                    5, ieee1451.TimeDuration(0, 0),
+                                    ieee1451.TimeInstance(0, 0))
+
+        self.assertEqual(response['error_code'], failure)
+        self.assertEqual(
+            response['sample_data'].get_by_name('samples').value, [7.0])
+        self.assertEqual(tdaccs.read_data.call_count, 2)
+
+    def test_read_block_delegates_to_native_read_block(self):
+        """ Test that a backend block read is used when available """
+        block = ieee1451.ArgumentArray()
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.return_value = {'error_code': self.no_error,
+                                    'trans_comm_id': 1}
+        tdaccs.read_block = mock.Mock(return_value={
+                                'error_code': self.no_error, 'result': block})
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+
+        interval = ieee1451.TimeDuration(0, 1000000)
+        start = ieee1451.TimeInstance(0, 0)
+        response = tdas.read_transducer_block_data_from_a_channel_of_a_tim(
+                            1234, 1, 1, ieee1451.TimeDuration(0, 1000), 10,
+                            interval, start)
+
+        tdaccs.read_block.assert_called_with(
+                            1, ieee1451.TimeDuration(0, 1000), 10, interval,
+                            start)
+        self.assertFalse(tdaccs.read_data.called)
+        self.assertTrue(response['sample_data'] is block)
+
+    def test_read_multiple_channels_with_group_session(self):
+        """ Test reading several channels through one group session """
+        group = ieee1451.ArgumentArray()
+        for i, value in enumerate([10, 20, 30]):
+            group.put_by_index(i, ieee1451.Argument(
+                                ieee1451.TypeCode.UINT32_TC, value))
+        result = ieee1451.ArgumentArray()
+        result.put_by_name('result', ieee1451.Argument(
+                                ieee1451.TypeCode.UNKNOWN_TC, group))
+
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open_group.return_value = {'error_code': self.no_error,
+                                          'trans_comm_id': 9}
+        tdaccs.read_data.return_value = {'error_code': self.no_error,
+                                         'result': result}
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+
+        timeout = ieee1451.TimeDuration(1, 0)
+        response = \
+            tdas.read_transducer_sample_data_from_multiple_channels_of_a_tim(
+                                    1234, 1, [1, 2, 3], timeout, 0)
+
+        tdaccs.open_group.assert_called_with([1, 1, 1], [1, 2, 3])
+        tdaccs.read_data.assert_called_with(9, timeout, 0)
+        tdaccs.close.assert_called_with(9)
+        self.assertFalse(tdaccs.open.called)
+        self.assertEqual(response['error_code'], self.no_error)
+        self.assertEqual(response['channel_ids'], [1, 2, 3])
+        data = response['sample_data']
+        self.assertEqual(data.size(), 3)
+        for i, value in enumerate([10, 20, 30]):
+            channel = data.get_by_index(i).value
+            self.assertEqual(channel.get_by_name('result').value, value)
+
+    def test_read_multiple_channels_concurrently(self):
+        """ Test the per channel fan-out used without group sessions """
+        def open_mock(tim_id, channel_id):
+            return {'error_code': self.no_error, 'trans_comm_id': channel_id}
+
+        def read_data_mock(trans_comm_id, timeout, sampling_mode):
+            arg_array = ieee1451.ArgumentArray()
+            arg_array.put_by_name('result', ieee1451.Argument(
+                                ieee1451.TypeCode.UINT32_TC,
+                                trans_comm_id * 100))
+            return {'error_code': self.no_error, 'result': arg_array}
+
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open_group.side_effect = NotImplementedError
+        tdaccs.open.side_effect = open_mock
+        tdaccs.read_data.side_effect = read_data_mock
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+
+        response = \
+            tdas.read_transducer_sample_data_from_multiple_channels_of_a_tim(
+                            1234, 1, [3, 1, 2], ieee1451.TimeDuration(1, 0), 0)
+
+        self.assertEqual(response['error_code'], self.no_error)
+        data = response['sample_data']
+        values = [data.get_by_index(i).value.get_by_name('result').value
+                  for i in range(3)]
+        self.assertEqual(values, [300, 100, 200])
+        self.assertEqual(tdaccs.close.call_count, 3)
+
+    def test_read_multiple_channels_reports_per_channel_errors(self):
+        """ Test that a failing channel does not hide the others """
+        failure = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                 ieee1451.ErrorCode.INVALID_COMMID)
+
+        def open_mock(tim_id, channel_id):
+            if channel_id == 2:
+                raise IOError('channel gone')
+            return {'error_code': self.no_error, 'trans_comm_id': channel_id}
+
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.side_effect = open_mock
+        tdaccs.read_data.return_value = {'error_code': failure,
+                                         'result': ieee1451.ArgumentArray()}
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+        tdas.group_reads = False
+
+        response = \
+            tdas.read_transducer_sample_data_from_multiple_channels_of_a_tim(
+                            1234, 1, [1, 2], ieee1451.TimeDuration(1, 0), 0)
+
+        network_failure = ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                ieee1451.ErrorCode.NETWORK_FAILURE)
+        self.assertFalse(tdaccs.open_group.called)
+        self.assertEqual(response['error_code'], failure)
+        self.assertEqual(response['error_codes'],
+                         [failure.serializable()['Error'],
+                          network_failure.serializable()['Error']])
+
+    def test_read_block_from_multiple_tims(self):
+        """ Test a synchronized block read from channels of two TIMs """
+        failure = ieee1451.Error(ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                 ieee1451.ErrorCode.TIMEOUT)
+        self.reads = {}
+        self.threads = {}
+
+        def open_mock(tim_id, channel_id):
+            return {'error_code': self.no_error,
+                    'trans_comm_id': tim_id * 10 + channel_id}
+
+        def read_data_mock(trans_comm_id, timeout, sampling_mode):
+            self.threads.setdefault(trans_comm_id // 10, set()).add(
+                                        threading.current_thread().ident)
+            k = self.reads.get(trans_comm_id, 0)
+            self.reads[trans_comm_id] = k + 1
+            if trans_comm_id == 21 and k == 2:
+                return {'error_code': failure, 'result': None}
+            return {'error_code': self.no_error,
+                    'result': trans_comm_id + k}
+
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.side_effect = open_mock
+        tdaccs.read_data.side_effect = read_data_mock
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+
+        response = tdas.\
+            read_transducer_block_data_from_multiple_channels_of_multiple_tims(
+                            1234, [1, 2, 1], [1, 1, 2],
+                            ieee1451.TimeDuration(1, 0), 4,
+                            ieee1451.TimeDuration(0, 5000000),
+                            ieee1451.TimeInstance(0, 0))
+
+        self.assertEqual(response['error_code'], failure)
+        self.assertEqual(response['error_codes'],
+                         [self.no_error.serializable()['Error'],
+                          failure.serializable()['Error'],
+                          self.no_error.serializable()['Error']])
+        time_base = response['time_base']
+        self.assertEqual(len(time_base), 4)
+        self.assertAlmostEqual(time_base[3] - time_base[0], 0.015, places=4)
+
+        data = response['sample_data']
+        samples = [data.get_by_index(i).value.get_by_name('samples').value
+                   for i in range(3)]
+        self.assertEqual(samples, [[11.0, 12.0, 13.0, 14.0],
+                                   [21.0, 22.0, None, None],
+                                   [12.0, 13.0, 14.0, 15.0]])
+        timestamps = data.get_by_index(1).value.get_by_name('timestamps')
+        self.assertEqual(timestamps.value[2:], [None, None])
+        # the channels of one TIM share the timestamp of each sample
+        self.assertEqual(
+            data.get_by_index(0).value.get_by_name('timestamps').value,
+            data.get_by_index(2).value.get_by_name('timestamps').value)
+        self.assertNotEqual(self.threads[1], self.threads[2])
+        self.assertEqual(tdaccs.close.call_count, 3)
+
+    def test_read_block_from_multiple_tims_is_bounded(self):
+        """ Test that oversized blocks are refused """
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+        tdas.max_block_samples = 100
+
+        response = tdas.\
+            read_transducer_block_data_from_multiple_channels_of_multiple_tims(
+                            1234, [1, 2], [1, 1],
+                            ieee1451.TimeDuration(1, 0), 51,
+                            ieee1451.TimeDuration(0, 0),
+                            ieee1451.TimeInstance(0, 0))
+
+        self.assertEqual(response['error_code'].code,
+                         ieee1451.ErrorCode.MEMORY_RESOURCE_EXCEEDED)
+        self.assertFalse(tdaccs.open.called)
+
+        response = tdas.read_transducer_block_data_from_a_channel_of_a_tim(
+                            1234, 1, 1, ieee1451.TimeDuration(1, 0), 101,
+                            ieee1451.TimeDuration(0, 0),
+                            ieee1451.TimeInstance(0, 0))
+        self.assertEqual(response['error_code'].code,
+                         ieee1451.ErrorCode.MEMORY_RESOURCE_EXCEEDED)
+        self.assertFalse(tdaccs.open.called)
+
+    def test_write_block_data(self):
+        """ Test a timed block write and its operation report """
+        self.written = []
+
+        def write_data_mock(trans_comm_id, timeout, sampling_mode, value):
+            self.written.append(value.get_by_index(0))
+            return {'error_code': self.no_error}
+
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.return_value = {'error_code': self.no_error,
+                                    'trans_comm_id': 1}
+        tdaccs.write_data.side_effect = write_data_mock
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+
+        waveform = ieee1451.ArgumentArray()
+        waveform.put_by_name('samples', ieee1451.Argument(
+                                ieee1451.TypeCode.FLOAT64_ARRAY_TC,
+                                [0.0, 0.5, 1.0]))
+        response = tdas.write_transducer_block_data_to_a_channel_of_a_tim(
+                                1234, 1, 1, ieee1451.TimeDuration(1, 0),
+                                ieee1451.TimeDuration(0, 5000000),
+                                ieee1451.TimeInstance(0, 0), waveform)
+
+        self.assertEqual(response['error_code'], self.no_error)
+        operation_id = response['operation_id']
+        self.assertTrue(tdas.get_operation(operation_id).finished.wait(5))
+
+        report = tdas.report_block_operation(1234, operation_id)
+        self.assertEqual(report['error_code'], self.no_error)
+        self.assertEqual(report['state'], 'done')
+        self.assertEqual(report['completed'], 3)
+        self.assertEqual(report['timing']['count'], 3)
+        self.assertEqual(self.written, [
+            ieee1451.Argument(ieee1451.TypeCode.FLOAT64_TC, v)
+            for v in [0.0, 0.5, 1.0]])
+        tdaccs.close.assert_called_with(1)
+
+    def test_cancel_block_write(self):
+        """ Test cancelling a block write which has not started yet """
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.return_value = {'error_code': self.no_error,
+                                    'trans_comm_id': 1}
+        tdaccs.write_data.return_value = {'error_code': self.no_error}
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+
+        response = tdas.write_transducer_block_data_to_a_channel_of_a_tim(
+                                1234, 1, 1, ieee1451.TimeDuration(1, 0),
+                                ieee1451.TimeDuration(1, 0),
+                                ieee1451.TimeInstance(int(time.time()) + 60,
+                                                      0),
+                                [1, 2, 3])
+        operation_id = response['operation_id']
+
+        cancel = tdas.cancel_block_operation(1234, operation_id)
+        self.assertTrue(cancel['cancelled'])
+        self.assertTrue(tdas.get_operation(operation_id).finished.wait(5))
+        report = tdas.report_block_operation(1234, operation_id)
+        self.assertEqual(report['state'], 'cancelled')
+        self.assertEqual(report['completed'], 0)
+        self.assertFalse(tdaccs.write_data.called)
+
+        unknown = tdas.report_block_operation(1234, 999)
+        self.assertEqual(unknown['error_code'].code,
+                         ieee1451.ErrorCode.UNKNOWN_MSGID)
+
+    def test_failed_block_write_closes_broken_session(self):
+        """ Test that a block write raising releases its session as
+        failed """
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.return_value = {'error_code': self.no_error,
+                                    'trans_comm_id': 1}
+        tdaccs.write_data.side_effect = IOError('link down')
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+        tdas.session_pool = mock.Mock()
+        tdas.session_pool.acquire.return_value = {'error_code': self.no_error,
+                                                  'trans_comm_id': 1}
+
+        response = tdas.write_transducer_block_data_to_a_channel_of_a_tim(
+                                1234, 1, 1, ieee1451.TimeDuration(1, 0),
+                                ieee1451.TimeDuration(0, 0),
+                                ieee1451.TimeInstance(0, 0), [1, 2, 3])
+        operation = tdas.get_operation(response['operation_id'])
+        self.assertTrue(operation.finished.wait(5))
+        self.assertEqual(operation.state, 'failed')
+        error = tdas.session_pool.release.call_args[0][1]
+        self.assertEqual(error.code, ieee1451.ErrorCode.NETWORK_FAILURE)
+
+    def test_stream_subscriptions(self):
+        """ Test subscribing and unsubscribing clients to a stream """
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.return_value = {'error_code': self.no_error,
+                                    'trans_comm_id': 3}
+        tdaccs.start_stream.return_value = {'error_code': self.no_error,
+                                            'operation_id': 42}
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+
+        for client_id in ['a@ncap', 'b@ncap']:
+            response = tdas.subscribe_transducer_stream(1234, 1, 2,
+                                                        client_id)
+            self.assertEqual(response['error_code'], self.no_error)
+            self.assertEqual(response['operation_id'], 42)
+        self.assertEqual(tdaccs.start_stream.call_count, 1)
+
+        tdas.unsubscribe_transducer_stream(1234, 1, 2, 'a@ncap')
+        response = tdas.unsubscribe_transducer_stream(1234, 1, 2, 'b@ncap')
+        self.assertTrue(response['unsubscribed'])
+        tdaccs.cancel.assert_called_with(42)
+
+    def test_sensor_alert_with_sampler(self):
+        """ Test sensor alerts fed by a sampler and by single reads """
+        self.values = [1, 1, 8, 8, 8, 1]
+        self.alerts = []
+        sampled = threading.Event()
+
+        def read_data_mock(trans_comm_id, timeout, sampling_mode):
+            value = self.values.pop(0) if self.values else 1
+            if not self.values:
+                sampled.set()
+            return {'error_code': self.no_error, 'result': value}
+
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.return_value = {'error_code': self.no_error,
+                                    'trans_comm_id': 1}
+        tdaccs.read_data.side_effect = read_data_mock
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+        tdas.sensor_alerts.sender = \
+            lambda client_id, alert: self.alerts.append(alert['state'])
+
+        response = tdas.subscribe_sensor_alert(1234, 1, 1, [None, 5],
+                                               'a@ncap', sampling_rate=200)
+        self.assertEqual(response['error_code'], self.no_error)
+        self.assertTrue(sampled.wait(5))
+
+        response = tdas.unsubscribe_sensor_alert(
+                                1234, response['subscription_id'])
+        self.assertEqual(response['error_code'], self.no_error)
+        self.assertEqual(tdas.channel_monitors, {})
+        self.assertEqual(self.alerts[:2], ['high', 'normal'])
+
+    def test_sensor_alert_with_stream(self):
+        """ Test sensor alerts fed by a shared stream """
+        self.alerts = []
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.return_value = {'error_code': self.no_error,
+                                    'trans_comm_id': 1}
+        tdaccs.start_stream.return_value = {'error_code': self.no_error,
+                                            'operation_id': 8}
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+        tdas.sensor_alerts.sender = \
+            lambda client_id, alert: self.alerts.append((client_id,
+                                                         alert['state']))
+
+        first = tdas.subscribe_sensor_alert(1234, 1, 1, [0, 10], 'a@ncap')
+        second = tdas.subscribe_sensor_alert(1234, 1, 1, [0, 20], 'b@ncap')
+        self.assertEqual(tdaccs.start_stream.call_count, 1)
+
+        for value in [5, 15, 25]:
+            aa = ieee1451.ArgumentArray()
+            aa.put_by_name('result', ieee1451.Argument(
+                                ieee1451.TypeCode.FLOAT64_TC, value))
+            tdas.stream_manager.measurement_update(8, aa, 0)
+        self.assertEqual(self.alerts, [('a@ncap', 'high'),
+                                       ('b@ncap', 'high')])
+
+        self.assertEqual(second['sampling_rate'], None)
+        conflict = tdas.subscribe_sensor_alert(1234, 1, 1, [0, 20],
+                                               'c@ncap', sampling_rate=10)
+        self.assertEqual(conflict['error_code'].code,
+                         ieee1451.ErrorCode.ILLEGAL_MODE)
+
+        other = tdas.unsubscribe_sensor_alert(
+                            1234, first['subscription_id'], 'b@ncap')
+        self.assertEqual(other['error_code'].code,
+                         ieee1451.ErrorCode.UNKNOWN_MSGID)
+        tdas.unsubscribe_sensor_alert(1234, first['subscription_id'],
+                                      'a@ncap')
+        self.assertFalse(tdaccs.cancel.called)
+        tdas.client_left('b@ncap')
+        tdaccs.cancel.assert_called_with(8)
+        self.assertEqual(tdas.channel_monitors, {})
+        unknown = tdas.unsubscribe_sensor_alert(1234, 999)
+        self.assertEqual(unknown['error_code'].code,
+                         ieee1451.ErrorCode.UNKNOWN_MSGID)
+
+    def test_sample_history(self):
+        """ Test keeping and reading the sample history of a channel """
+        self.values = [1, 2, 3]
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.return_value = {'error_code': self.no_error,
+                                    'trans_comm_id': 1}
+        tdaccs.start_stream.return_value = {'error_code': self.no_error,
+                                            'operation_id': 4}
+        tdaccs.read_data.side_effect = lambda *args: {
+            'error_code': self.no_error, 'result': self.values.pop(0)}
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+
+        response = tdas.read_sample_history(1234, 1, 1)
+        self.assertEqual(response['error_code'].code,
+                         ieee1451.ErrorCode.UNKNOWN_DESTID)
+
+        for capacity, code in [(0, ieee1451.ErrorCode.ILLEGAL_MODE),
+                               (10 ** 9,
+                                ieee1451.ErrorCode.MEMORY_RESOURCE_EXCEEDED)]:
+            response = tdas.enable_sample_history(1234, 1, 1, capacity)
+            self.assertEqual(response['error_code'].code, code)
+        self.assertEqual(
+            tdas.enable_sample_history(1234, 1, 1, 100)['error_code'],
+            self.no_error)
+        for _ in range(3):
+            tdas.read_transducer_sample_data_from_a_channel_of_a_tim(
+                            1234, 1, 1, ieee1451.TimeDuration(1, 0), 0)
+        tdas.stream_manager.measurement_update(4, 4, 0)
+
+        response = tdas.read_sample_history(1234, 1, 1, last_n=3)
+        self.assertEqual(response['error_code'], self.no_error)
+        samples = response['sample_data'].to_argument_array()
+        self.assertEqual(samples.get_by_name('samples').value,
+                         [2.0, 3.0, 4.0])
+
+        tdas.disable_sample_history(1234, 1, 1)
+        tdaccs.cancel.assert_called_with(4)
+        self.assertEqual(tdas.channel_monitors, {})
+        response = tdas.disable_sample_history(1234, 1, 1)
+        self.assertEqual(response['error_code'].code,
+                         ieee1451.ErrorCode.UNKNOWN_DESTID)
+
+    def test_aggregate_and_downsample_history(self):
+        """ Test aggregating and downsampling the sample history """
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.return_value = {'error_code': self.no_error,
+                                    'trans_comm_id': 1}
+        tdaccs.start_stream.return_value = {'error_code': self.no_error,
+                                            'operation_id': 4}
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+        tdas.enable_sample_history(1234, 1, 1, 100)
+        for i in range(20):
+            tdas.observe_sample(1, 1, i, timestamp=1000.0 + i)
+
+        response = tdas.aggregate_sample_data(
+                            1234, 1, 1, ieee1451.TimeDuration(10, 0),
+                            start_time=ieee1451.TimeInstance(1005, 0))
+        self.assertEqual(response['error_code'], self.no_error)
+        aggregates = response['aggregates']
+        self.assertEqual(aggregates.get_by_name('count').value, [5, 10])
+        self.assertEqual(aggregates.get_by_name('max').value, [9.0, 19.0])
+
+        response = tdas.downsample_sample_data(1234, 1, 1, 5)
+        samples = response['sample_data'].get_by_name('samples').value
+        self.assertEqual(len(samples), 5)
+        self.assertEqual(samples[0], 0.0)
+        self.assertEqual(samples[-1], 19.0)
+
+    def test_aggregate_live_block_errors(self):
+        """ Test that bad live reads are answered with an error code """
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.return_value = {'error_code': self.no_error,
+                                    'trans_comm_id': 1}
+        tdaccs.read_data.return_value = {
+            'error_code': ieee1451.Error(
+                                ieee1451.ErrorSource.ERROR_SOURCE_LOCAL_0,
+                                ieee1451.ErrorCode.UNKNOWN_DESTID),
+            'result': None}
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+
+        response = tdas.aggregate_sample_data(
+                            1234, 1, 1, ieee1451.TimeDuration(1, 0),
+                            number_of_samples=4)
+        self.assertEqual(response['error_code'].code,
+                         ieee1451.ErrorCode.ILLEGAL_MODE)
+        self.assertFalse(tdaccs.open.called)
+
+        for max_points in [None, 0]:
+            response = tdas.downsample_sample_data(1234, 1, 1, max_points)
+            self.assertEqual(response['error_code'].code,
+                             ieee1451.ErrorCode.ILLEGAL_MODE)
+
+        response = tdas.downsample_sample_data(
+                            1234, 1, 1, 10,
+                            timeout=ieee1451.TimeDuration(1, 0),
+                            number_of_samples=4,
+                            sample_interval=ieee1451.TimeDuration(0, 0))
+        self.assertEqual(response['error_code'].code,
+                         ieee1451.ErrorCode.UNKNOWN_DESTID)
+
+    def test_aggregate_live_block(self):
+        """ Test aggregating a block read live """
+        self.values = [1, 5, 3, 7]
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.return_value = {'error_code': self.no_error,
+                                    'trans_comm_id': 1}
+        tdaccs.read_data.side_effect = lambda *args: {
+            'error_code': self.no_error, 'result': self.values.pop(0)}
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+
+        response = tdas.aggregate_sample_data(
+                            1234, 1, 1, ieee1451.TimeDuration(1000, 0),
+                            timeout=ieee1451.TimeDuration(1, 0),
+                            number_of_samples=4,
+                            sample_interval=ieee1451.TimeDuration(0, 0))
+        self.assertEqual(response['error_code'], self.no_error)
+        aggregates = response['aggregates']
+        self.assertEqual(sum(aggregates.get_by_name('count').value), 4)
+        self.assertEqual(max(aggregates.get_by_name('max').value), 7.0)
+
+    def test_calibrated_reads(self):
+        """ Test that the Calibration TEDS of a channel corrects its single
+        and block reads """
+        def read_data_mock(trans_comm_id, timeout, sampling_mode):
+            arg_array = ieee1451.ArgumentArray()
+            arg_array.put_by_name('result', ieee1451.Argument(
+                                ieee1451.TypeCode.UINT32_TC,
+                                trans_comm_id * 500))
+            return {'error_code': self.no_error, 'result': arg_array}
+
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.side_effect = lambda tim_id, channel_id: {
+                            'error_code': self.no_error,
+                            'trans_comm_id': tim_id * 2 + channel_id}
+        tdaccs.read_data.side_effect = read_data_mock
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+        xmlns = {'teds': 'http://localhost/1451HTTPAPI'}
+        cal_teds = teds_support.teds_element_from_file(
+                                'teds:CalibrationTEDS', xmlns,
+                                'tests/SmartTransducerTEDSMock.xml')[0]
+        tdas.load_calibration(1, 0, cal_teds)
+
+        # channel 0 reads 1000, channel 1 reads 1500 and is not calibrated
+        timeout = ieee1451.TimeDuration(1, 0)
+        response = tdas.read_transducer_sample_data_from_a_channel_of_a_tim(
+                                    1234, 1, 0, timeout, 0)
+        value = response['sample_data'].get_by_name('result')
+        self.assertEqual(value.type_code, ieee1451.TypeCode.FLOAT64_TC)
+        self.assertAlmostEqual(value.value, 373.15)
+        response = tdas.read_transducer_sample_data_from_a_channel_of_a_tim(
+                                    1234, 1, 1, timeout, 0)
+        self.assertEqual(response['sample_data'].get_by_name('result').value,
+                         1500)
+
+        response = tdas.read_transducer_block_data_from_a_channel_of_a_tim(
+                                    1234, 1, 0, timeout, 2,
+                                    ieee1451.TimeDuration(0, 0),
+                                    ieee1451.TimeInstance(0, 0))
+        samples = response['sample_data'].get_by_name('samples').value
+        self.assertEqual(len(samples), 2)
+        for sample in samples:
+            self.assertAlmostEqual(sample, 373.15)
+
+        response = tdas.\
+            read_transducer_block_data_from_multiple_channels_of_multiple_tims(
+                            1234, [1, 1], [0, 1], timeout, 1,
+                            ieee1451.TimeDuration(0, 0),
+                            ieee1451.TimeInstance(0, 0))
+        data = response['sample_data']
+        self.assertAlmostEqual(
+            data.get_by_index(0).value.get_by_name('samples').value[0], 373.15)
+        self.assertEqual(
+            data.get_by_index(1).value.get_by_name('samples').value, [1500.0])
+
+    def test_start_read_falls_back_to_read_data(self):
+        """ Test that backends without nonblocking_io are read blocking """
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.open.return_value = {'error_code': self.no_error,
+                                    'trans_comm_id': 1}
+        tdaccs.read_data.return_value = {'error_code': self.no_error,
+                                         'result': 12}
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+
+        deferred = tdas.\
+            start_read_transducer_sample_data_from_a_channel_of_a_tim(
+                    1234, 1, 1, ieee1451.TimeDuration(1, 0), 0)
+        self.assertTrue(deferred.done.is_set())
+        self.assertEqual(deferred.result['sample_data'], 12)
+        self.assertFalse(tdaccs.start_read_data.called)
+
+    def test_start_read_completed_by_callback(self):
+        """ Test a non-blocking read completed from the backend thread """
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.nonblocking_io = True
+        tdaccs.open.return_value = {'error_code': self.no_error,
+                                    'trans_comm_id': 4}
+
+        def start_read_data(trans_comm_id, trigger_time, timeout,
+                            sampling_mode, callback):
+            threading.Timer(0.02, callback.measurement_update,
+                            (77, 'value', 0)).start()
+            return {'error_code': self.no_error, 'operation_id': 77}
+        tdaccs.start_read_data.side_effect = start_read_data
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+
+        deferred = tdas.\
+            start_read_transducer_sample_data_from_a_channel_of_a_tim(
+                    1234, 1, 2, ieee1451.TimeDuration(1, 0), 0)
+        result = deferred.wait(2)
+        self.assertEqual(result, {'error_code': self.no_error,
+                                  'ncap_id': 1234,
+                                  'tim_id': 1,
+                                  'channel_id': 2,
+                                  'sample_data': 'value'})
+        tdaccs.close.assert_called_once_with(4)
+        self.assertFalse(tdaccs.read_data.called)
+
+    def test_start_write_times_out(self):
+        """ Test that a write without callback is cancelled on timeout """
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.nonblocking_io = True
+        tdaccs.open.return_value = {'error_code': self.no_error,
+                                    'trans_comm_id': 4}
+        tdaccs.start_write_data.return_value = {'error_code': self.no_error,
+                                                'operation_id': 5}
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+        tdas.callback_grace = 0
+
+        deferred = tdas.\
+            start_write_transducer_sample_data_to_a_channel_of_a_tim(
+                    1234, 1, 2, ieee1451.TimeDuration(0, 20000000), 0, 3)
+        self.assertFalse(deferred.done.is_set())
+        result = deferred.wait(2)
+        self.assertEqual(result['error_code'].code,
+                         ieee1451.ErrorCode.TIMEOUT)
+        tdaccs.cancel.assert_called_once_with(5)
+        tdaccs.close.assert_called_once_with(4)
+        value = tdaccs.start_write_data.call_args[0][4]
+        self.assertEqual(value.get_by_index(0).value, 3)
+
+    def test_start_read_duplicate_operation_id(self):
+        """ Test that a reused operation ID fails the second read """
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.nonblocking_io = True
+        tdaccs.open.side_effect = [
+            {'error_code': self.no_error, 'trans_comm_id': 1},
+            {'error_code': self.no_error, 'trans_comm_id': 2}]
+        tdaccs.start_read_data.return_value = {'error_code': self.no_error,
+                                               'operation_id': 0}
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+
+        start = tdas.start_read_transducer_sample_data_from_a_channel_of_a_tim
+        d1 = start(1234, 1, 1, ieee1451.TimeDuration(1, 0), 0)
+        d2 = start(1234, 1, 2, ieee1451.TimeDuration(1, 0), 0)
+        self.assertEqual(d2.wait(0)['error_code'].code,
+                         ieee1451.ErrorCode.LOCKED_RESOURCE)
+        tdaccs.close.assert_called_once_with(2)
+
+        tdas.operation_table.measurement_update(0, 'value', 0)
+        self.assertEqual(d1.wait(1)['sample_data'], 'value')
+        self.assertEqual(tdaccs.close.call_count, 2)
+
+    def test_start_write_raising(self):
+        """ Test that a start_write_data exception is answered """
+        tdaccs = mock.Mock(spec=transducer_services_base.TransducerAccessBase)
+        tdaccs.nonblocking_io = True
+        tdaccs.open.return_value = {'error_code': self.no_error,
+                                    'trans_comm_id': 3}
+        tdaccs.start_write_data.side_effect = IOError('link down')
+
+        tdas = transducer_data_access_services.TransducerDataAccessServices()
+        tdas.register_transducer_access_service(tdaccs)
+
+        deferred = tdas.\
+            start_write_transducer_sample_data_to_a_channel_of_a_tim(
+                    1234, 1, 2, ieee1451.TimeDuration(1, 0), 0, 3)
+        self.assertEqual(deferred.wait(0)['error_code'].code,
+                         ieee1451.ErrorCode.NETWORK_FAILURE)
+        tdaccs.close.assert_called_once_with(3)
+
 if __name__ == '__main__':
     import sys
     sys.exit(unittest.main())
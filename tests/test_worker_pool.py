@@ -0,0 +1,89 @@
+"""
+test_worker_pool
+----------------------------------
+
+Tests for `worker_pool` module.
+"""
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import threading
+from ncaplite import worker_pool
+
+
+class TestWorkerPool(unittest.TestCase):
+    """TestCase for running tasks concurrently."""
+
+    def test_results_in_task_order(self):
+        """Test that results are returned in the order of the tasks."""
+        tasks = [(lambda i=i: i * i) for i in range(20)]
+        results = worker_pool.run_concurrently(tasks, max_workers=4)
+        self.assertEqual([r.value for r in results],
+                         [i * i for i in range(20)])
+        self.assertTrue(all(r.done for r in results))
+
+    def test_exception_is_captured(self):
+        """Test that a failing task does not affect the others."""
+        def fail():
+            raise ValueError('boom')
+
+        results = worker_pool.run_concurrently([fail, lambda: 1])
+        self.assertTrue(results[0].done)
+        self.assertIsInstance(results[0].exception, ValueError)
+        self.assertEqual(results[1].value, 1)
+
+    def test_timeout_leaves_tasks_unfinished(self):
+        """Test that tasks still running at the deadline are not done."""
+        release = threading.Event()
+        finished = threading.Event()
+
+        def slow():
+            release.wait(5)
+            finished.set()
+            return 'late'
+
+        results = worker_pool.run_concurrently([lambda: 'fast', slow],
+                                               timeout=0.05)
+        release.set()
+        finished.wait(5)
+        self.assertTrue(results[0].done)
+        self.assertFalse(results[1].done)
+        self.assertIsNone(results[1].value)
+
+    def test_every_worker_starts_with_a_task(self):
+        """Test that each thread gets a task of its own from the start."""
+        threads = []
+
+        def task():
+            # the idents of finished threads are reused, keep the objects
+            threads.append(threading.current_thread())
+
+        worker_pool.run_concurrently([task, task, task], max_workers=3)
+        self.assertEqual(len(set(threads)), 3)
+
+    def test_tasks_not_started_at_deadline_never_run(self):
+        """Test that tasks queued behind the deadline are dropped."""
+        release = threading.Event()
+        ran = []
+
+        def slow():
+            release.wait(5)
+            ran.append('slow')
+
+        results = worker_pool.run_concurrently(
+                    [slow, lambda: ran.append('queued')], max_workers=1,
+                    timeout=0.05)
+        release.set()
+        while not ran:
+            release.wait(0.01)
+        release.wait(0.05)
+        self.assertEqual(ran, ['slow'])
+        self.assertFalse(results[1].done)
+
+    def test_no_tasks(self):
+        """Test that an empty task list returns at once."""
+        self.assertEqual(worker_pool.run_concurrently([]), [])
+
+if __name__ == '__main__':
+    unittest.main()